@@ -0,0 +1,68 @@
+"""
+Run the hot path benchmarks and compare them with a stored baseline.
+
+    python -m benchmarks run [--filter REGEX] [--quick] [--save results.json]
+    python -m benchmarks compare baseline.json results.json [--threshold 10]
+
+`compare` exits with status 1 when a benchmark regressed by more than the
+threshold percentage.
+"""
+
+import argparse
+import sys
+
+from benchmarks import hot_path  # noqa: F401 (registers the benchmarks)
+from benchmarks.harness import (
+    compare_results,
+    format_comparisons,
+    format_results,
+    load_results,
+    run_benchmarks,
+    save_results,
+)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--filter", help="only run benchmarks matching this regex")
+    run.add_argument(
+        "--quick", action="store_true", help="run a tenth of the operations"
+    )
+    run.add_argument("--save", metavar="PATH", help="save the results as JSON")
+
+    compare = commands.add_parser("compare", help="compare results with a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percentage increase reported as a regression (default: 10)",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run_benchmarks(args.filter, scale=0.1 if args.quick else 1.0)
+        print(format_results(results))
+        if args.save:
+            save_results(results, args.save)
+            print(f"Results saved to {args.save}")
+        return 0
+
+    comparisons = compare_results(
+        load_results(args.baseline), load_results(args.current), args.threshold
+    )
+    print(format_comparisons(comparisons))
+    regressions = [row for row in comparisons if row.regressed]
+    if regressions:
+        print(f"{len(regressions)} regressions above {args.threshold:g}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Benchmark of the storage body codec: CPU cost against bytes saved, for each
+available codec and level, on marketing emails of realistic sizes.
+
+Run with: python -m benchmarks.bench_compression
+"""
+
+import random
+import timeit
+
+from cloudmailin.compression import BodyCodec, available_codecs, decode_document
+
+LEVELS = {"zlib": (1, 6, 9), "zstd": (1, 3, 10)}
+
+# Body sizes of the corpus: a short newsletter up to a heavy promotional email
+HTML_SIZES = (16 * 1024, 64 * 1024, 256 * 1024, 900 * 1024)
+
+WORDS = (
+    "sale offer exclusive new arrivals discount shop now limited time free "
+    "shipping members only spring collection best sellers save up to off"
+).split()
+
+
+def marketing_html(size: int, rng: random.Random) -> str:
+    """
+    Table-based HTML with inline styles and tracking links, like the output
+    of email marketing tools.
+    """
+    rows = []
+    length = 0
+    while length < size:
+        product = " ".join(rng.choices(WORDS, k=4)).title()
+        row = (
+            '<tr><td style="padding:12px 24px;font-family:Helvetica,Arial,'
+            'sans-serif;font-size:14px;color:#333333;">'
+            f'<a href="https://click.example.com/t/{rng.getrandbits(64):x}" '
+            f'style="color:#0066cc;text-decoration:none;">{product}</a>'
+            f"<span>{rng.randint(5, 500)}.{rng.randint(0, 99):02d} EUR</span>"
+            "</td></tr>\n"
+        )
+        rows.append(row)
+        length += len(row)
+    return f"<html><body><table>{''.join(rows)}</table></body></html>"
+
+
+def build_corpus(rng: random.Random) -> list:
+    corpus = []
+    for size in HTML_SIZES:
+        html = marketing_html(size, rng)
+        plain = " ".join(rng.choices(WORDS, k=size // 40))
+        corpus.append({"subject": "Spring sale", "plain": plain, "html": html})
+    return corpus
+
+
+def measure(statement, number: int = 5) -> float:
+    """
+    Best time per call, in seconds, over 3 repeats.
+    """
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number
+
+
+def main():
+    corpus = build_corpus(random.Random(42))
+    raw_bytes = sum(
+        len(document["plain"].encode()) + len(document["html"].encode())
+        for document in corpus
+    )
+    print(f"corpus: {len(corpus)} emails, {raw_bytes / 1024:.0f} KiB of bodies")
+
+    print(
+        f"{'codec':<8}{'level':>6}{'stored KiB':>12}{'saved':>8}"
+        f"{'encode MB/s':>13}{'decode MB/s':>13}"
+    )
+    for codec_name in available_codecs():
+        for level in LEVELS[codec_name]:
+            codec = BodyCodec(codec_name, threshold=4096, level=level)
+            encoded = [codec.encode_document(document) for document in corpus]
+            stored = sum(
+                len(document["plain"]) + len(document["html"]) for document in encoded
+            )
+            encode_seconds = measure(
+                lambda: [codec.encode_document(document) for document in corpus]
+            )
+            decode_seconds = measure(
+                lambda: [decode_document(document) for document in encoded]
+            )
+            print(
+                f"{codec_name:<8}{level:>6}{stored / 1024:>12.0f}"
+                f"{1 - stored / raw_bytes:>8.0%}"
+                f"{raw_bytes / encode_seconds / 1e6:>13.0f}"
+                f"{raw_bytes / decode_seconds / 1e6:>13.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
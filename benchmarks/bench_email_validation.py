@@ -0,0 +1,83 @@
+"""
+Microbenchmarks for Email validation, comparing the cached RFC 2822 / address
+validation path with the previous strptime + EmailStr implementation.
+
+Run with: python -m benchmarks.bench_email_validation
+"""
+
+import timeit
+from datetime import datetime
+
+from pydantic import BaseModel, EmailStr, model_validator
+
+from cloudmailin.schemas import Email
+from cloudmailin.validators import parse_rfc2822_date
+
+PAYLOAD = {
+    "envelope": {"from": "newsletter@example.com", "to": "recipient@example.com"},
+    "headers": {"subject": "Weekly deals", "date": "Mon, 16 Jan 2012 17:00:01 +0000"},
+    "plain": "Plain body. " * 100,
+    "html": "<p>Html body.</p>" * 100,
+}
+
+
+class LegacyEmail(BaseModel):
+    """
+    The Email model before the fast validation path, for comparison.
+    """
+
+    sender: EmailStr
+    recipient: EmailStr
+    subject: str
+    date: datetime
+    plain: str
+    html: str
+
+    @model_validator(mode="before")
+    @classmethod
+    def preprocess_payload(cls, values):
+        flattened = Email.flatten_payload(values)
+        flattened["date"] = datetime.strptime(
+            flattened["date"], "%a, %d %b %Y %H:%M:%S %z"
+        )
+        return flattened
+
+
+def measure(statement, number: int = 5000) -> float:
+    """
+    Best time per call, in microseconds, over 5 repeats.
+    """
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    date = PAYLOAD["headers"]["date"]
+    cases = [
+        (
+            "date parsing",
+            lambda: datetime.strptime(date, "%a, %d %b %Y %H:%M:%S %z"),
+            lambda: parse_rfc2822_date(date),
+        ),
+        (
+            "date parsing, miss",
+            lambda: datetime.strptime(date, "%a, %d %b %Y %H:%M:%S %z"),
+            lambda: parse_rfc2822_date.__wrapped__(date),
+        ),
+        (
+            "email validation",
+            lambda: LegacyEmail.model_validate(PAYLOAD),
+            lambda: Email.model_validate(PAYLOAD),
+        ),
+    ]
+
+    print(f"{'case':<22}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, before, after in cases:
+        before_us, after_us = measure(before), measure(after)
+        print(
+            f"{name:<22}{before_us:>14.2f}{after_us:>14.2f}"
+            f"{before_us / after_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Microbenchmark of the storage serialization, comparing the compiled
+projections with email.model_dump().
+
+Run with: python -m benchmarks.bench_projection
+"""
+
+import timeit
+
+from cloudmailin.handlers.projection import DEFAULT_PROJECTION, Projection
+from cloudmailin.schemas import Email
+
+EMAIL = Email.from_flat_data(
+    sender="newsletter@example.com",
+    recipient="recipient@example.com",
+    subject="Weekly deals",
+    date="Mon, 16 Jan 2012 17:00:01 +0000",
+    plain="Plain body. " * 100,
+    html="<p>Html body.</p>" * 100,
+)
+
+
+def measure(statement, number: int = 100000) -> float:
+    """
+    Best time per call, in microseconds, over 5 repeats.
+    """
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    slim = Projection(
+        fields=["sender", "subject", "date", "campaign_type"],
+        rename={"sender": "from"},
+        epoch_millis="date_ms",
+    )
+    before_us = measure(EMAIL.model_dump)
+    cases = [("default projection", DEFAULT_PROJECTION), ("slim projection", slim)]
+
+    print(f"{'case':<20}{'model_dump (us)':>17}{'projection (us)':>17}{'speedup':>10}")
+    for name, projection in cases:
+        after_us = measure(lambda: projection(EMAIL))
+        print(
+            f"{name:<20}{before_us:>17.2f}{after_us:>17.2f}"
+            f"{before_us / after_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
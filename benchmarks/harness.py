@@ -0,0 +1,170 @@
+"""
+Minimal benchmark harness: registered benchmarks are timed with timeit and
+their peak allocation per operation is measured with tracemalloc. Results
+are saved as JSON and compared against a stored baseline.
+"""
+
+import json
+import platform
+import re
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, UTC
+from typing import Callable, NamedTuple
+
+BENCHMARKS = {}
+
+
+class Benchmark(NamedTuple):
+    name: str
+    setup: Callable  # Context manager factory yielding the operation to time
+    number: int  # Operations per timing repeat
+
+
+class Comparison(NamedTuple):
+    name: str
+    metric: str
+    baseline: float
+    current: float
+    change_percent: float
+    regressed: bool
+
+
+def benchmark(name: str, number: int = 1000):
+    """
+    Register a benchmark.
+
+    The decorated generator sets up its fixtures, yields the zero-argument
+    operation to measure and tears the fixtures down once it resumes.
+    """
+
+    def decorator(setup):
+        if name in BENCHMARKS:
+            raise ValueError(f"Benchmark '{name}' is already registered")
+        BENCHMARKS[name] = Benchmark(name, contextmanager(setup), number)
+        return setup
+
+    return decorator
+
+
+def measure_time(operation, number: int, repeat: int = 5) -> float:
+    """
+    Best time per operation, in microseconds, over `repeat` runs.
+    """
+    operation()  # Warm up caches and lazy imports outside the measurement
+    return min(timeit.repeat(operation, number=number, repeat=repeat)) / number * 1e6
+
+
+def measure_allocations(operation, number: int = 20) -> float:
+    """
+    Mean peak of Python memory allocated by one operation, in bytes.
+    """
+    operation()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(number):
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            operation()
+            total += tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return total / number
+
+
+def run_benchmarks(pattern: str = None, scale: float = 1.0) -> dict:
+    """
+    Run the registered benchmarks whose name matches `pattern`.
+
+    `scale` multiplies the number of operations of every benchmark, e.g. 0.1
+    for a quick run.
+    """
+    results = {}
+    for bench in BENCHMARKS.values():
+        if pattern and not re.search(pattern, bench.name):
+            continue
+        number = max(1, int(bench.number * scale))
+        with bench.setup() as operation:
+            results[bench.name] = {
+                "number": number,
+                "time_per_op_us": measure_time(operation, number),
+                "peak_alloc_bytes": measure_allocations(operation),
+            }
+    return {
+        "created_at": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def save_results(results: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+def load_results(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare_results(
+    baseline: dict,
+    current: dict,
+    threshold_percent: float = 10.0,
+    metrics: tuple = ("time_per_op_us", "peak_alloc_bytes"),
+) -> list:
+    """
+    Compare every metric of the benchmarks present in both runs.
+
+    A metric regresses when it grew by more than `threshold_percent` percent
+    over the baseline.
+    """
+    comparisons = []
+    for name, measured in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        for metric in metrics:
+            before, after = reference.get(metric), measured.get(metric)
+            if before is None or after is None:
+                continue
+            if before:
+                change = (after - before) / before * 100
+            else:
+                change = 0.0 if not after else float("inf")
+            comparisons.append(
+                Comparison(
+                    name, metric, before, after, change, change > threshold_percent
+                )
+            )
+    return comparisons
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'benchmark':<32}{'time/op (us)':>16}{'peak alloc/op (B)':>20}"]
+    for name, measured in results["results"].items():
+        lines.append(
+            f"{name:<32}{measured['time_per_op_us']:>16.2f}"
+            f"{measured['peak_alloc_bytes']:>20.0f}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparisons(comparisons: list) -> str:
+    lines = [
+        f"{'benchmark':<32}{'metric':<20}{'baseline':>14}{'current':>14}{'change':>10}"
+    ]
+    for row in comparisons:
+        flag = "  REGRESSION" if row.regressed else ""
+        lines.append(
+            f"{row.name:<32}{row.metric:<20}{row.baseline:>14.2f}"
+            f"{row.current:>14.2f}{row.change_percent:>+9.1f}%{flag}"
+        )
+    return "\n".join(lines)
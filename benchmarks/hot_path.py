@@ -0,0 +1,129 @@
+"""
+Benchmarks of the ingest hot path, from Email validation to the full
+/generic/new round trip. Firestore is replaced by an in-memory fake, so the
+numbers measure the application code only.
+
+Run with: python -m benchmarks run
+"""
+
+import logging
+from unittest.mock import patch
+
+from benchmarks.harness import benchmark
+from cloudmailin.handler_registry import HandlerRegistry
+from cloudmailin.handlers import base_handler
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.campaign_classifier import CampaignClassifierHandler
+from cloudmailin.handlers.steps import assign_campaign_type
+from cloudmailin.schemas import Email
+
+BODY_SIZES = {"small": 200, "medium": 20 * 1024, "large": 1024 * 1024}
+
+
+def make_payload(body_size: int, sender: str = "newsletter@example.com") -> dict:
+    paragraph = "Weekly deals on everything you love, only this week. "
+    plain = (paragraph * (body_size // len(paragraph) + 1))[:body_size]
+    return {
+        "envelope": {"from": sender, "to": "recipient@example.com"},
+        "headers": {
+            "subject": "Big summer sale",
+            "date": "Mon, 16 Jan 2012 17:00:01 +0000",
+        },
+        "plain": plain,
+        "html": f"<p>{plain}</p>",
+    }
+
+
+class FakeDocument:
+    def __init__(self, document_id: str):
+        self.id = document_id
+
+
+class FakeCollection:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, data):
+        self.count += 1
+        return None, FakeDocument(f"doc-{self.count}")
+
+
+class FakeFirestoreClient:
+    """
+    Stand-in for firestore.Client that accepts writes without storing them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._collection = FakeCollection()
+
+    def collection(self, name):
+        return self._collection
+
+
+class FakeDatabase:
+    def store_email(self, email_data, dedup_key=None):
+        return "doc-1"
+
+
+def _email_validation(size: str):
+    payload = make_payload(BODY_SIZES[size])
+
+    def setup():
+        yield lambda: Email.model_validate(payload)
+
+    return setup
+
+
+for _size, _number in (("small", 5000), ("medium", 2000), ("large", 50)):
+    benchmark(f"email_validation[{_size}]", number=_number)(_email_validation(_size))
+
+
+@benchmark("registry_lookup", number=20000)
+def registry_lookup():
+    registry = HandlerRegistry()
+    for index in range(1000):
+        registry.register(f"newsletter{index}@brand{index}.com", BaseHandler)
+    for index in range(100):
+        registry.register(f"*@shop{index}.com", CampaignClassifierHandler)
+    registry.compile()
+    senders = ["newsletter500@brand500.com", "anyone@shop50.com", "someone@else.org"]
+
+    def lookup():
+        for sender in senders:
+            registry.get_handler_for_sender(sender)
+
+    yield lookup
+
+
+@benchmark("assign_campaign_type", number=5000)
+def campaign_type():
+    email = Email.model_validate(make_payload(BODY_SIZES["medium"]))
+    yield lambda: assign_campaign_type(email)
+
+
+@benchmark("base_handler_handle", number=5000)
+def handler_handle():
+    email = Email.model_validate(make_payload(BODY_SIZES["small"]))
+    handler = CampaignClassifierHandler()
+    database = FakeDatabase()
+    with patch.object(base_handler, "get_db", lambda: database):
+        yield lambda: handler.handle(email)
+
+
+@benchmark("generic_new_round_trip", number=500)
+def generic_new():
+    from cloudmailin import create_app
+
+    with patch("cloudmailin.db.firestore.Client", FakeFirestoreClient):
+        app = create_app(
+            {
+                "TESTING": True,
+                "FIRESTORE_COLLECTION": "benchmark_emails",
+                "LOG_ASYNC": False,
+            }
+        )
+        # Keep the per-request INFO lines out of the measurement and output
+        logging.getLogger("cloudmailin").setLevel(logging.WARNING)
+        client = app.test_client()
+        payload = make_payload(BODY_SIZES["small"])
+        yield lambda: client.post("/generic/new", json=payload)
@@ -1,49 +1,26 @@
 from flask import Flask, request, g
 import logging
-import json
-from datetime import datetime, UTC
 import os
 
+from .logs import JSONFormatter  # noqa: F401
 
-class JSONFormatter(logging.Formatter):
-    """
-    Custom JSON log formatter for structured logs.
-    """
 
-    def format(self, record):
-        log_record = {
-            "timestamp": datetime.now(UTC).isoformat(),
-            "level": record.levelname,
-            "message": record.getMessage(),
-        }
-        return json.dumps(log_record)
+# Per-request access lines, sampled separately through LOG_SAMPLING_RATES
+request_logger = logging.getLogger("cloudmailin.requests")
 
 
 def create_app(test_config=None):
     # Late import to ensure the function is patched correctly in tests.
     # Follows Flask's pattern of initializing dependencies dynamically within create_app
     # Avoids module-level imports that can cause issues with testing and state mgmnt
-    from .handler_registry import initialize_handler_registry_from_config
+    from .handler_registry import (
+        initialize_handler_registry_from_config,
+        projections_need_body_fields,
+    )
 
     # Create the app
     app = Flask(__name__, instance_relative_config=True)
 
-    # Configure Logging
-    handler = logging.StreamHandler()
-    handler.setFormatter(JSONFormatter())
-
-    app_logger = logging.getLogger("cloudmailin")
-    app_logger.setLevel(logging.INFO)
-    app_logger.handlers = [handler]
-    app_logger.propagate = True  # Ensure logs propagate to the root logger
-
-    # Attach the app logger to Flask's logger
-    app.logger.handlers = app_logger.handlers
-    app.logger.setLevel(app_logger.level)
-    app.logger.propagate = True
-
-    app.logger.info("Application starting...")
-
     # App Configuration
     # Load environment-specific configuration (ProductionConfig is the default)
     env_config = os.getenv("FLASK_ENV", "ProductionConfig")
@@ -57,25 +34,77 @@ def create_app(test_config=None):
         # Override with test configuration
         app.config.from_mapping(test_config)
 
+    # Configure Logging
+    from . import logs
+
+    logs.init_app(app)
+
+    app.logger.info("Application starting...")
+
     # Initialize and add handler registry to the app
     config_path = app.config.get("HANDLER_CONFIG_PATH", "config/handler_config.yaml")
 
     app.config["handler_registry"] = initialize_handler_registry_from_config(
-        config_path
+        config_path, projections_need_body_fields(app.config)
     )
 
+    # Load and validate the campaign rules of the classifier step
+    from . import classifier
+
+    classifier.init_app(app)
+
+    # Size the cache of pure step results before the pipelines use it
+    from .handlers import memo
+
+    memo.init_app(app)
+
+    # Reload the handler registry when its configuration changes
+    from . import handler_registry
+
+    handler_registry.init_app(app, config_path)
+
     # Initialize Database
     from . import db
 
     db.init_app(app)
 
+    # Initialize the background ingest queue (only used in async mode)
+    from . import work_queue
+
+    work_queue.init_app(app)
+
+    # Single-flight processing of retried requests
+    from . import idempotency
+
+    idempotency.init_app(app)
+
+    # Request size limits and memory profiling
+    from . import payload
+
+    payload.init_app(app)
+
+    # `flask loadtest` command
+    from . import loadtest
+
+    loadtest.init_app(app)
+
+    # Request latency and payload size metrics
+    from . import metrics
+
+    metrics.init_app(app)
+
+    # Per-request spans, correlated with the log lines of the request
+    from . import tracing
+
+    tracing.init_app(app)
+
     # Setup logging before every request
     @app.before_request
     def log_incoming_request():
         """
         Log details of each incoming request.
         """
-        app.logger.info(f"Received request: {request.method} {request.path}")
+        request_logger.info("Received request: %s %s", request.method, request.path)
 
     @app.before_request
     def set_firestore_collection():
@@ -86,12 +115,14 @@ def create_app(test_config=None):
         custom_collection = request.headers.get("X-Firestore-Collection", None)
         if custom_collection:
             g.firestore_collection = custom_collection
-            app.logger.info(f"Overriding Firestore collection to: {custom_collection}")
+            app.logger.info("Overriding Firestore collection to: %s", custom_collection)
 
     # Register Blueprints
-    from . import generic, health
+    from . import admin, generic, health
 
     app.register_blueprint(generic.bp)
     app.register_blueprint(health.bp)
+    app.register_blueprint(admin.bp)
+    app.register_blueprint(metrics.bp)
 
     return app
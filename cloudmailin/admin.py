@@ -0,0 +1,52 @@
+import hmac
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from cloudmailin.handler_registry import get_registry_reloader
+from cloudmailin.handlers.memo import default_step_cache
+
+bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@bp.before_request
+def require_admin_token():
+    """
+    Hide the admin endpoints unless ADMIN_TOKEN is set, and require it as a
+    bearer token.
+    """
+    token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        abort(404)
+
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+
+
+@bp.route("/handlers", methods=["GET"])
+def handlers_status():
+    """
+    Report the handler configuration currently in use by this worker.
+    """
+    return jsonify(get_registry_reloader(current_app).status()), 200
+
+
+@bp.route("/handlers/reload", methods=["POST"])
+def reload_handlers():
+    """
+    Reload the handler configuration of this worker now.
+
+    On failure the previous registry stays in use and the error is returned.
+    """
+    reloader = get_registry_reloader(current_app)
+    if reloader.reload():
+        return jsonify({"status": "reloaded", **reloader.status()}), 200
+    return jsonify({"status": "failed", **reloader.status()}), 500
+
+
+@bp.route("/step-cache", methods=["GET"])
+def step_cache_stats():
+    """
+    Report the hit, miss and eviction counters of the step cache of this worker.
+    """
+    return jsonify(default_step_cache.stats()), 200
@@ -0,0 +1,212 @@
+"""
+ASGI entry point, serving /generic/new on an event loop.
+
+    uvicorn --factory cloudmailin.asgi:create_asgi_app --port 8080
+    gunicorn -k uvicorn.workers.UvicornWorker "cloudmailin.asgi:create_asgi_app()"
+
+The ingest route awaits its handler (BaseHandler.ahandle) and writes through
+firestore.AsyncClient, so one worker process keeps many writes in flight
+instead of one per thread. The other routes are the regular Flask views, run
+in worker threads.
+"""
+
+import asyncio
+import io
+import sys
+
+from cloudmailin import create_app, generic
+from cloudmailin.async_db import close_async_client_pool
+
+
+class RequestBodyStream(io.RawIOBase):
+    """
+    Blocking file over the ASGI request body, read from a worker thread while
+    the event loop receives the body messages.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more_body = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(
+                self._receive(), self._loop
+            ).result()
+            self._buffer = message.get("body", b"")
+            self._more_body = message.get("more_body", False)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+async def read_body(receive, limit: int = None) -> bytes:
+    """
+    Read the whole request body, stopping once it exceeds `limit` bytes (the
+    app then answers with a 413 as the body is too large).
+    """
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        chunks.append(chunk)
+        size += len(chunk)
+        more_body = message.get("more_body", False)
+        if limit is not None and size > limit:
+            break
+    return b"".join(chunks)
+
+
+def build_environ(scope: dict, body) -> dict:
+    """
+    WSGI environ of an ASGI HTTP request, whose body is read from `body`.
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # Chunked bodies have no Content-Length: read them to the end
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin-1")
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+    return environ
+
+
+class AsgiApp:
+    """
+    Serve a Flask app over ASGI.
+
+    Requests to `async_views`, keyed by method and path, are dispatched on
+    the event loop inside a Flask request context, so the before and after
+    request hooks (access logs, metrics, tracing) apply as in the WSGI app.
+    Every other request is handed to the WSGI app in a worker thread.
+    """
+
+    def __init__(self, app, async_views: dict = None):
+        self.app = app
+        self.async_views = (
+            async_views
+            if async_views is not None
+            else {("POST", "/generic/new"): generic.new_generic_email_async}
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope: {scope['type']}")
+
+        view = self.async_views.get((scope["method"], scope["path"]))
+        if view is None:
+            body = io.BufferedReader(
+                RequestBodyStream(receive, asyncio.get_running_loop())
+            )
+            status, headers, chunks = await asyncio.to_thread(
+                self.call_wsgi, build_environ(scope, body)
+            )
+        else:
+            body = await read_body(receive, self.app.config.get("MAX_CONTENT_LENGTH"))
+            environ = build_environ(scope, io.BytesIO(body))
+            environ["CONTENT_LENGTH"] = str(len(body))
+            response = await self.dispatch(view, environ)
+            status = response.status_code
+            headers = response.headers.to_wsgi_list()
+            chunks = [response.get_data()]
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"".join(chunks)})
+
+    async def dispatch(self, view, environ: dict):
+        """
+        Run an async view the way Flask runs a sync one: request hooks, error
+        handlers and teardown included.
+        """
+        app = self.app
+        context = app.request_context(environ)
+        error = None
+        context.push()
+        try:
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = await view()
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            return app.handle_exception(e)
+        finally:
+            context.pop(error)
+
+    def call_wsgi(self, environ: dict) -> tuple:
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = headers
+
+        iterable = self.app(environ, start_response)
+        try:
+            chunks = list(iterable)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        return response["status"], response["headers"], chunks
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Async gRPC channels must be closed from their event loop
+                await close_async_client_pool(self.app)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(test_config=None) -> AsgiApp:
+    return AsgiApp(create_app(test_config))
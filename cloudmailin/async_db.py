@@ -0,0 +1,235 @@
+import asyncio
+import time
+import uuid
+
+from flask import g, current_app
+
+from google.cloud import firestore
+
+from cloudmailin import blobstore, dedup, spool
+from cloudmailin.db import FirestoreClientPool, get_client_pool
+from cloudmailin.metrics import STORAGE_WRITE_DURATION, STORAGE_WRITE_ERRORS
+
+
+class ThreadedDocumentReference:
+    def __init__(self, reference):
+        self._reference = reference
+        self.id = reference.id
+
+    async def set(self, data: dict):
+        await asyncio.to_thread(self._reference.set, data)
+
+    async def get(self):
+        return await asyncio.to_thread(self._reference.get)
+
+
+class ThreadedCollectionReference:
+    def __init__(self, collection):
+        self._collection = collection
+        self.id = collection.id
+
+    def document(self, document_id: str = None) -> ThreadedDocumentReference:
+        return ThreadedDocumentReference(self._collection.document(document_id))
+
+    async def add(self, data: dict) -> tuple:
+        return await asyncio.to_thread(self._collection.add, data)
+
+
+class ThreadedAsyncClient:
+    """
+    Async facade over a synchronous storage backend (memory, SQLite), with
+    the subset of the firestore.AsyncClient API the async path relies on.
+    Calls run in the default executor, so they never block the event loop.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def collection(self, name: str) -> ThreadedCollectionReference:
+        return ThreadedCollectionReference(self._client.collection(name))
+
+
+class AsyncFirestoreClientPool(FirestoreClientPool):
+    """
+    Pool of firestore.AsyncClient instances for the ASGI app.
+
+    Async gRPC channels are bound to the event loop that first uses them, so
+    the pool is created from the running loop and closed with `aclose()`.
+    Each channel multiplexes many concurrent writes; FIRESTORE_KEEPALIVE_MS
+    does not apply to them.
+    """
+
+    def _create_client(self):
+        if self.client_factory is not None:
+            return self.client_factory(database=self.database_name)
+        return firestore.AsyncClient(database=self.database_name)
+
+    def close(self):
+        raise RuntimeError("Async client pools are closed with `await aclose()`.")
+
+    async def aclose(self):
+        """
+        Close the async gRPC channel of every client in the pool.
+        """
+        clients, self._clients = self._clients, []
+        for client in clients:
+            api = getattr(client, "_firestore_api_internal", None)
+            if api is not None:
+                await api.transport.close()
+
+
+def _threaded_client_factory(sync_pool):
+    def create_client(**kwargs):
+        return ThreadedAsyncClient(sync_pool.get_client())
+
+    return create_client
+
+
+def get_async_client_pool(app=None) -> AsyncFirestoreClientPool:
+    """
+    Get the async client pool of the app, creating it on first use.
+
+    Other storage backends than Firestore share the clients of the sync pool
+    (and so their documents), behind a ThreadedAsyncClient.
+    """
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get("firestore_async_pool")
+    if pool is None:
+        client_factory = None
+        if (app.config.get("STORAGE_BACKEND") or "firestore") != "firestore":
+            client_factory = _threaded_client_factory(get_client_pool(app))
+        # The event loop is single-threaded, so no lock is needed
+        pool = app.extensions["firestore_async_pool"] = AsyncFirestoreClientPool(
+            database=app.config.get("FIRESTORE_DATABASE", "cloudmailin"),
+            size=app.config.get("FIRESTORE_CHANNEL_POOL_SIZE", 1),
+            client_factory=client_factory,
+        )
+    return pool
+
+
+async def close_async_client_pool(app):
+    """
+    Close and discard the async client pool of the app, if any.
+    """
+    pool = app.extensions.pop("firestore_async_pool", None)
+    if pool is not None:
+        await pool.aclose()
+
+
+class AsyncDatabaseHelper:
+    def __init__(
+        self, config, client, spool=None, dedup=None, codec=None, blob_store=None
+    ):
+        """
+        Initialize the helper on top of an async Firestore client.
+
+        Emails are written inline: the ASGI app keeps many writes in flight
+        instead of buffering them, so write-behind and bulk commits do not
+        apply. Spooling, dedup, body compression and blob offloading work as
+        in DatabaseHelper.
+        """
+        self.client = client
+        self.config = config
+        self.spool = spool
+        self.dedup = dedup
+        self.codec = codec
+        self.blob_store = blob_store
+
+        self.collection_name = self.config.get("FIRESTORE_COLLECTION")
+        if not self.collection_name:
+            raise ValueError("FIRESTORE_COLLECTION is required but not configured.")
+
+    def get_collection_name(self):
+        """
+        Get the Firestore collection name, overriding it if the request context provides one.
+        """
+        return getattr(g, "firestore_collection", None) or self.collection_name
+
+    def get_collection(self):
+        return self.client.collection(self.get_collection_name())
+
+    async def store_email(self, email_data, dedup_key: str = None):
+        """
+        Store an email document in the Firestore collection.
+
+        `dedup_key` identifies the email for dedup (see dedup.email_dedup_key);
+        it is derived from the document when not given.
+
+        Returns:
+            str: The id of the stored document, or None if it could not be
+            stored. Emails that are spooled keep the id they will be replayed with.
+        """
+        document_id = key = None
+        if self.dedup is not None:
+            key = dedup_key or dedup.dedup_key(email_data)
+            document_id = dedup.document_id_for(key)
+        if self.codec is not None:
+            email_data = self.codec.encode_document(email_data)
+
+        try:
+            if self.blob_store is not None:
+                # Blob stores are synchronous (files, object storage)
+                email_data = await asyncio.to_thread(
+                    blobstore.offload_bodies,
+                    email_data,
+                    self.blob_store,
+                    self.config.get("BLOB_OFFLOAD_THRESHOLD", 512 * 1024),
+                )
+            collection = self.get_collection()
+            if key is not None and key in self.dedup:
+                if await self._is_stored(collection, document_id):
+                    current_app.logger.info(
+                        "Skipping duplicate email: document %s exists", document_id
+                    )
+                    return document_id
+
+            started = time.perf_counter()
+            if document_id is not None:
+                await collection.document(document_id).set(email_data)
+            else:
+                document_id = (await collection.add(email_data))[1].id
+            STORAGE_WRITE_DURATION.observe(time.perf_counter() - started, "async")
+            if key is not None:
+                self.dedup.add(key)
+            return document_id
+        except Exception as e:
+            STORAGE_WRITE_ERRORS.inc("async")
+            current_app.logger.error(
+                f"Failed to store email in database: {e}", exc_info=True
+            )
+            if self.spool is not None:
+                document_id = document_id or uuid.uuid4().hex
+                # Appending fsyncs the spool file, which would block the loop
+                await asyncio.to_thread(
+                    self.spool.append,
+                    self.get_collection_name(),
+                    document_id,
+                    email_data,
+                )
+                return document_id
+            return None
+
+    async def _is_stored(self, collection, document_id: str) -> bool:
+        """
+        Whether the document exists. Lookup failures count as not stored: the
+        write is idempotent anyway.
+        """
+        try:
+            return (await collection.document(document_id).get()).exists
+        except Exception as e:
+            current_app.logger.warning(f"Duplicate lookup failed: {e}")
+            return False
+
+
+def get_async_db():
+    if "async_db" not in g:
+        g.async_db = AsyncDatabaseHelper(
+            current_app.config,
+            client=get_async_client_pool().get_client(),
+            spool=spool.get_spool(),
+            dedup=dedup.get_dedup_filter(),
+            codec=current_app.extensions.get("body_codec"),
+            blob_store=current_app.extensions.get("blob_store"),
+        )
+
+    return g.async_db
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+
+from cloudmailin.compression import COMPRESSION_MARKER, decompress
+from cloudmailin.payload import BODY_FIELDS
+
+# Key of the stored document describing each body moved to the blob store
+OFFLOAD_MARKER = "offloaded_fields"
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed store of email bodies: blobs are identified by the
+    SHA-256 digest of their content, so identical bodies are stored once.
+    """
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """
+        Store the blob, unless it is already stored, and return its digest.
+        """
+
+    @abstractmethod
+    def get(self, digest: str) -> bytes:
+        """
+        Content of a stored blob.
+        """
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        """
+        Whether a blob is stored.
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store on the local filesystem, for development and tests.
+
+    Blobs are written atomically to <directory>/<first 2 hex digits>/<digest>.
+    """
+
+    def __init__(self, directory: str):
+        if not directory:
+            raise ValueError("BLOB_STORE_DIR is required by the local blob store.")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), "rb") as file:
+            return file.read()
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+
+BLOB_STORES = {
+    "local": lambda config: LocalBlobStore(config.get("BLOB_STORE_DIR")),
+}
+
+
+def offload_bodies(document: dict, blob_store: BlobStore, threshold: int) -> dict:
+    """
+    Copy of the document with its bodies of at least `threshold` bytes moved
+    to the blob store. The document keeps the digest and size of each one
+    under OFFLOAD_MARKER.
+    """
+    offloaded = {}
+    for field in BODY_FIELDS:
+        value = document.get(field)
+        if isinstance(value, str):
+            if len(value) < threshold:
+                continue
+            data, encoding = value.encode("utf-8", "surrogatepass"), "utf-8"
+        elif isinstance(value, bytes):
+            # Already compressed by the body codec
+            data, encoding = value, None
+        else:
+            continue
+        if len(data) < threshold:
+            continue
+        offloaded[field] = {
+            "sha256": blob_store.put(data),
+            "size": len(data),
+            "encoding": encoding,
+        }
+
+    if not offloaded:
+        return document
+    document = {key: value for key, value in document.items() if key not in offloaded}
+    document[OFFLOAD_MARKER] = offloaded
+    return document
+
+
+class StoredDocument(Mapping):
+    """
+    Read-only view of a stored email document that restores its bodies.
+
+    Offloaded bodies are only fetched from the blob store when they are
+    accessed, and compressed bodies are decompressed, so reading the subject
+    of a large email costs no blob read.
+    """
+
+    def __init__(self, document: dict, blob_store: BlobStore = None):
+        self._document = document
+        self._blob_store = blob_store
+        self._offloaded = document.get(OFFLOAD_MARKER) or {}
+        self._compressed = document.get(COMPRESSION_MARKER) or {}
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        if key in (OFFLOAD_MARKER, COMPRESSION_MARKER):
+            raise KeyError(key)
+        if key in self._loaded:
+            return self._loaded[key]
+        if key not in self._offloaded and key not in self._compressed:
+            return self._document[key]
+
+        value = self._fetch(key)
+        self._loaded[key] = value
+        return value
+
+    def _fetch(self, key):
+        if key in self._offloaded:
+            reference = self._offloaded[key]
+            if self._blob_store is None:
+                raise RuntimeError(
+                    f"Field '{key}' is offloaded but no blob store is set"
+                )
+            value = self._blob_store.get(reference["sha256"])
+            if reference["encoding"]:
+                value = value.decode(reference["encoding"], "surrogatepass")
+        else:
+            value = self._document[key]
+
+        if key in self._compressed:
+            value = decompress(value, self._compressed[key]).decode(
+                "utf-8", "surrogatepass"
+            )
+        return value
+
+    def __iter__(self):
+        yield from (
+            key
+            for key in self._document
+            if key not in (OFFLOAD_MARKER, COMPRESSION_MARKER)
+        )
+        yield from (key for key in self._offloaded if key not in self._document)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def get_blob_store(config) -> BlobStore:
+    """
+    The blob store configured by BLOB_STORE, or None if disabled.
+
+    Raises:
+        ValueError: If BLOB_STORE names an unknown implementation.
+    """
+    name = config.get("BLOB_STORE")
+    if not name:
+        return None
+    if name not in BLOB_STORES:
+        raise ValueError(
+            f"Unknown blob store '{name}' (available: {', '.join(BLOB_STORES)})"
+        )
+    return BLOB_STORES[name](config)
+
+
+def init_app(app):
+    app.extensions["blob_store"] = get_blob_store(app.config)
@@ -0,0 +1,232 @@
+import re
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+import yaml
+from flask import current_app, has_app_context
+
+DEFAULT_CAMPAIGN_RULES_PATH = "config/campaign_rules.yaml"
+
+UNCLASSIFIED = "unclassified"
+
+# Fields of an email scanned for campaign keywords
+CLASSIFIED_FIELDS = ("subject", "plain", "html")
+
+
+# Words, and punctuation characters as tokens of their own ("50% off")
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class KeywordMatcher:
+    """
+    Find which of a set of keywords occur in a text, in a single pass.
+
+    Keywords are words or phrases matched case-insensitively on whole words:
+    unlike a substring search, "sale" matches neither "sales" nor
+    "wholesale", so every form of a word to match is listed.
+
+    The text is tokenized once by the C regex engine and the keywords are
+    found with hash lookups: single words against the vocabulary of the text,
+    phrases against its n-grams (computed only for the lengths, and when the
+    first word of a phrase occurs). The cost of a scan depends on the length
+    of the text, not on the number of keywords.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        # Keywords by number of tokens, keyed by their tokens
+        self._keywords = {}
+        self._first_tokens = {}
+        for keyword in keywords:
+            keyword = keyword.lower()
+            tokens = tuple(TOKEN_PATTERN.findall(keyword))
+            if not tokens:
+                continue
+            length = len(tokens)
+            key = tokens[0] if length == 1 else tokens
+            self._keywords.setdefault(length, {})[key] = keyword
+            self._first_tokens.setdefault(length, set()).add(tokens[0])
+
+    def find(self, text: str) -> set:
+        """
+        Keywords occurring in a lowercased text.
+        """
+        if not self._keywords or not text:
+            return set()
+
+        tokens = TOKEN_PATTERN.findall(text)
+        vocabulary = set(tokens)
+        found = set()
+        for length, keywords in self._keywords.items():
+            if vocabulary.isdisjoint(self._first_tokens[length]):
+                continue
+            if length == 1:
+                matches = vocabulary.intersection(keywords)
+            else:
+                ngrams = zip(*(islice(tokens, i, None) for i in range(length)))
+                matches = keywords.keys() & set(ngrams)
+            found.update(keywords[match] for match in matches)
+        return found
+
+
+class CampaignRule(NamedTuple):
+    name: str
+    priority: int
+    keywords: Tuple[str, ...]
+    # Weight of each field, overriding the default field weights
+    field_weights: Dict[str, float]
+
+
+class CampaignClassifier:
+    """
+    Assign a campaign type to an email from keyword rules.
+
+    Each campaign scores the weight of a field for every distinct keyword of
+    the campaign found in that field. Campaigns reaching `min_score` are
+    candidates, and the one with the highest priority wins, then the one with
+    the highest score, then the first declared. Emails without any candidate
+    are unclassified.
+    """
+
+    def __init__(
+        self,
+        rules: Iterable[CampaignRule],
+        field_weights: Dict[str, float] = None,
+        min_score: float = 1.0,
+    ):
+        self.rules = tuple(rules)
+        self.min_score = min_score
+        default_weights = field_weights or dict.fromkeys(CLASSIFIED_FIELDS, 1.0)
+
+        # Weight of every (rule, field) pair, and the rules of each keyword
+        self._weights = [
+            {**default_weights, **rule.field_weights} for rule in self.rules
+        ]
+        self._fields = tuple(
+            field
+            for field in CLASSIFIED_FIELDS
+            if any(weights.get(field) for weights in self._weights)
+        )
+        self._rules_by_keyword = {}
+        for index, rule in enumerate(self.rules):
+            for keyword in rule.keywords:
+                self._rules_by_keyword.setdefault(keyword.lower(), set()).add(index)
+        self.matcher = KeywordMatcher(self._rules_by_keyword)
+
+    def scores(self, email) -> Dict[str, float]:
+        """
+        Score of every campaign with at least one keyword in the email.
+        """
+        scores = {}
+        for field in self._fields:
+            text = getattr(email, field, None)
+            if not text:
+                continue
+            for keyword in self.matcher.find(text.lower()):
+                for index in self._rules_by_keyword[keyword]:
+                    weight = self._weights[index].get(field, 0.0)
+                    if weight:
+                        scores[index] = scores.get(index, 0.0) + weight
+        return {self.rules[index].name: score for index, score in scores.items()}
+
+    def classify(self, email) -> str:
+        scores = self.scores(email)
+        best = None
+        for index, rule in enumerate(self.rules):
+            score = scores.get(rule.name, 0.0)
+            if score < self.min_score:
+                continue
+            key = (rule.priority, score, -index)
+            if best is None or key > best[0]:
+                best = (key, rule.name)
+        return best[1] if best else UNCLASSIFIED
+
+
+def _field_weights(weights, where: str) -> Dict[str, float]:
+    if weights is None:
+        return {}
+    if not isinstance(weights, dict) or not all(
+        field in CLASSIFIED_FIELDS and isinstance(weight, (int, float))
+        for field, weight in weights.items()
+    ):
+        raise ValueError(
+            f"Invalid campaign rules: {where} must map fields among "
+            f"{', '.join(CLASSIFIED_FIELDS)} to numeric weights."
+        )
+    return {field: float(weight) for field, weight in weights.items()}
+
+
+def load_campaign_rules(path: str) -> CampaignClassifier:
+    """
+    Load campaign rules from a YAML file and compile them into a classifier.
+
+    Raises:
+        ValueError: If the rules are invalid.
+    """
+    with open(path, "r") as file:
+        config = yaml.safe_load(file)
+
+    if not isinstance(config, dict) or not isinstance(config.get("campaigns"), dict):
+        raise ValueError("Invalid campaign rules: Missing 'campaigns' section.")
+
+    rules = []
+    for name, details in config["campaigns"].items():
+        if not isinstance(details, dict):
+            raise ValueError(
+                f"Invalid campaign rules: Campaign '{name}' must map to a dictionary."
+            )
+        keywords = details.get("keywords")
+        if not isinstance(keywords, list) or not all(
+            isinstance(keyword, str) and keyword for keyword in keywords
+        ):
+            raise ValueError(
+                f"Invalid campaign rules: Campaign '{name}' must have a "
+                "'keywords' list of strings."
+            )
+        priority = details.get("priority", 0)
+        if not isinstance(priority, int):
+            raise ValueError(
+                f"Invalid campaign rules: Priority of '{name}' must be an integer."
+            )
+        rules.append(
+            CampaignRule(
+                name=name,
+                priority=priority,
+                keywords=tuple(keywords),
+                field_weights=_field_weights(
+                    details.get("fields"), f"Fields of '{name}'"
+                ),
+            )
+        )
+
+    return CampaignClassifier(
+        rules,
+        field_weights=_field_weights(config.get("fields"), "'fields'") or None,
+        min_score=float(config.get("min_score", 1.0)),
+    )
+
+
+@lru_cache(maxsize=8)
+def _load_cached(path: str) -> CampaignClassifier:
+    return load_campaign_rules(path)
+
+
+def get_campaign_classifier() -> CampaignClassifier:
+    """
+    Classifier of the app, loaded from CAMPAIGN_RULES_PATH by init_app (or
+    compiled from the default rules file outside of an application context).
+    """
+    path = DEFAULT_CAMPAIGN_RULES_PATH
+    if has_app_context():
+        classifier = current_app.extensions.get("campaign_classifier")
+        if classifier is not None:
+            return classifier
+        path = current_app.config.get("CAMPAIGN_RULES_PATH", path)
+    return _load_cached(path)
+
+
+def init_app(app):
+    # Load the rules at startup: invalid rules fail here, not on a request
+    app.extensions["campaign_classifier"] = load_campaign_rules(
+        app.config.get("CAMPAIGN_RULES_PATH", DEFAULT_CAMPAIGN_RULES_PATH)
+    )
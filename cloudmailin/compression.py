@@ -0,0 +1,119 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+from cloudmailin.payload import BODY_FIELDS
+
+# Key of the stored document recording the codec of each compressed field
+COMPRESSION_MARKER = "compressed_fields"
+
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 3}
+
+
+def available_codecs() -> tuple:
+    return ("zlib", "zstd") if zstandard is not None else ("zlib",)
+
+
+def compress(data: bytes, codec: str, level: int = None) -> bytes:
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+class BodyCodec:
+    """
+    Compress the plain and html bodies of email documents before storage.
+
+    Bodies of at least `threshold` UTF-8 bytes are replaced by their
+    compressed bytes, if that makes them smaller, and the codec of each
+    compressed field is recorded under COMPRESSION_MARKER. decode_document()
+    restores the original document.
+    """
+
+    def __init__(self, codec: str = "zlib", threshold: int = 4096, level: int = None):
+        if codec not in available_codecs():
+            raise ValueError(
+                f"Unsupported compression codec: {codec} "
+                f"(available: {', '.join(available_codecs())})"
+            )
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+
+    def encode_document(self, document: dict) -> dict:
+        """
+        Copy of the document with its large bodies compressed.
+        """
+        compressed = {}
+        for field in BODY_FIELDS:
+            value = document.get(field)
+            if not isinstance(value, str) or len(value) < self.threshold:
+                # Characters are at least one byte: too short either way
+                continue
+            raw = value.encode("utf-8", "surrogatepass")
+            if len(raw) < self.threshold:
+                continue
+            packed = compress(raw, self.codec, self.level)
+            if len(packed) < len(raw):
+                compressed[field] = packed
+
+        if not compressed:
+            return document
+        return {
+            **document,
+            **compressed,
+            COMPRESSION_MARKER: dict.fromkeys(compressed, self.codec),
+        }
+
+
+def decode_document(document: dict) -> dict:
+    """
+    Restore a document stored by BodyCodec.encode_document.
+
+    Documents without compressed fields are returned as they are.
+    """
+    codecs = document.get(COMPRESSION_MARKER)
+    if not codecs:
+        return document
+
+    decoded = {
+        key: value for key, value in document.items() if key != COMPRESSION_MARKER
+    }
+    for field, codec in codecs.items():
+        decoded[field] = decompress(document[field], codec).decode(
+            "utf-8", "surrogatepass"
+        )
+    return decoded
+
+
+def get_body_codec(config) -> BodyCodec:
+    """
+    The codec configured by STORAGE_COMPRESSION, or None if disabled.
+    """
+    codec = config.get("STORAGE_COMPRESSION")
+    if not codec:
+        return None
+    return BodyCodec(
+        codec,
+        threshold=config.get("STORAGE_COMPRESSION_THRESHOLD", 4096),
+        level=config.get("STORAGE_COMPRESSION_LEVEL"),
+    )
+
+
+def init_app(app):
+    # Fail at startup on an unknown or unavailable codec
+    app.extensions["body_codec"] = get_body_codec(app.config)
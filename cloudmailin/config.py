@@ -1,5 +1,153 @@
 class Config:
-    pass
+    # Number of pooled Firestore clients (one gRPC channel each) per worker process
+    FIRESTORE_CHANNEL_POOL_SIZE = 1
+    # gRPC keepalive for pooled channels, None keeps the client default (30s)
+    FIRESTORE_KEEPALIVE_MS = None
+
+    # Where emails are stored: "firestore", "memory" (an in-memory stand-in
+    # for load tests and offline runs) or "sqlite" (embedded, for edge and
+    # dev deployments; run `flask init-db` to create the schema)
+    STORAGE_BACKEND = "firestore"
+    # The memory backend adds LATENCY_MS +/- JITTER_MS to every RPC and fails
+    # ERROR_RATE of them
+    MEMORY_STORAGE_LATENCY_MS = 0.0
+    MEMORY_STORAGE_JITTER_MS = 0.0
+    MEMORY_STORAGE_ERROR_RATE = 0.0
+    # SQLite database file, None for instance/cloudmailin.sqlite
+    SQLITE_PATH = None
+    # PRAGMA synchronous of the WAL journal: NORMAL may lose the last commits
+    # on power loss (never on a crash of the app), FULL syncs every commit
+    SQLITE_SYNCHRONOUS = "NORMAL"
+
+    # Write-behind mode: buffer emails in memory and commit them in batches
+    WRITE_BEHIND_ENABLED = False
+    WRITE_BEHIND_BATCH_SIZE = 500
+    WRITE_BEHIND_MAX_AGE_SECONDS = 1.0
+    WRITE_BEHIND_MAX_BUFFER = 10000
+    # Cloud Run waits 10s after SIGTERM before killing the container
+    WRITE_BEHIND_DRAIN_TIMEOUT = 8.0
+
+    # "sync" processes emails before replying, "async" acknowledges with a 202
+    # and processes them on a pool of worker threads
+    INGEST_MODE = "sync"
+    INGEST_WORKERS = 4
+    INGEST_QUEUE_SIZE = 1000
+    # "memory" or "disk" (fsync each email to INGEST_JOURNAL_DIR before the ack)
+    INGEST_DURABILITY = "memory"
+    INGEST_JOURNAL_DIR = None
+    INGEST_DRAIN_TIMEOUT = 8.0
+    # Emails whose handler failed are retried in-process, waiting
+    # INGEST_RETRY_BACKOFF_SECONDS doubled on each attempt (at most
+    # INGEST_MAX_BACKOFF_SECONDS); past INGEST_MAX_ATTEMPTS they are left to
+    # the next process recovering the journal ("disk") or dropped ("memory")
+    INGEST_MAX_ATTEMPTS = 5
+    INGEST_RETRY_BACKOFF_SECONDS = 1.0
+    INGEST_MAX_BACKOFF_SECONDS = 60.0
+
+    # Local spool for emails that fail to persist, disabled when SPOOL_DIR is None
+    SPOOL_DIR = None
+    SPOOL_SEGMENT_MAX_BYTES = 16 * 1024 * 1024
+    SPOOL_REPLAY_INTERVAL_SECONDS = 30.0
+    SPOOL_MAX_BACKOFF_SECONDS = 600.0
+    SPOOL_REPLAY_BATCH_SIZE = 500
+
+    # Suppress duplicate deliveries (CloudMailin retries) by storing emails
+    # under ids derived from their Message-ID, with a Bloom filter of the
+    # recently stored emails to skip the lookup of new ones
+    DEDUP_ENABLED = False
+    DEDUP_BLOOM_CAPACITY = 100000
+    DEDUP_BLOOM_ERROR_RATE = 0.001
+    DEDUP_BLOOM_ROTATION_SECONDS = 3600.0
+
+    # Requests to /generic/new with the same Idempotency-Key header run once:
+    # concurrent retries wait for the first one (up to IDEMPOTENCY_WAIT_SECONDS,
+    # then 409) and later ones replay its result within the window.
+    # IDEMPOTENCY_DERIVED_KEYS derives a key from the email when the header is
+    # missing
+    IDEMPOTENCY_WINDOW_SECONDS = 300.0
+    IDEMPOTENCY_MAX_KEYS = 10000
+    IDEMPOTENCY_WAIT_SECONDS = 30.0
+    IDEMPOTENCY_DERIVED_KEYS = False
+
+    # Store plain and html bodies of at least STORAGE_COMPRESSION_THRESHOLD
+    # bytes compressed: None (disabled), "zlib" or "zstd" (needs zstandard).
+    # Read them back with cloudmailin.compression.decode_document
+    STORAGE_COMPRESSION = None
+    STORAGE_COMPRESSION_THRESHOLD = 4096
+    STORAGE_COMPRESSION_LEVEL = None
+
+    # Move bodies of at least BLOB_OFFLOAD_THRESHOLD bytes (after compression)
+    # out of the documents into a content-addressed blob store: None
+    # (disabled) or "local" (files under BLOB_STORE_DIR). Read them back with
+    # cloudmailin.blobstore.StoredDocument
+    BLOB_STORE = None
+    BLOB_STORE_DIR = None
+    BLOB_OFFLOAD_THRESHOLD = 512 * 1024
+
+    # Documents per Firestore write batch for /generic/batch (max 500)
+    BATCH_COMMIT_SIZE = 500
+
+    # Request size limits, answered with a 413. MAX_CONTENT_LENGTH applies to
+    # /generic/new and to each line of /generic/batch
+    MAX_CONTENT_LENGTH = 25 * 1024 * 1024
+    MAX_BATCH_CONTENT_LENGTH = 1024 * 1024 * 1024
+    MAX_BODY_FIELD_LENGTH = 10 * 1024 * 1024
+    # Measure the peak Python memory of each request, exported as the
+    # cloudmailin_request_peak_memory_bytes histogram by route, to size
+    # containers. tracemalloc runs while requests are in flight, which slows
+    # allocations down noticeably: enable it for sizing runs, not permanently
+    REQUEST_MEMORY_PROFILING = False
+
+    # Body of /generic/new replies: "full" echoes the email, "summary" returns
+    # the stored document id, handler and status, "empty" replies 204.
+    # Overridable per request with the X-Response-Profile header
+    RESPONSE_PROFILE = "full"
+
+    # Keyword rules of the campaign classifier step
+    CAMPAIGN_RULES_PATH = "config/campaign_rules.yaml"
+
+    # Results of pure pipeline steps, memoized per content hash
+    STEP_CACHE_MAX_ENTRIES = 10000
+    STEP_CACHE_TTL_SECONDS = 300.0
+
+    # Poll the handler config file and reload the registry when it changes,
+    # disabled when None
+    HANDLER_CONFIG_POLL_SECONDS = None
+
+    # Write logs from a background thread; records beyond LOG_QUEUE_SIZE
+    # waiting to be written are dropped rather than blocking requests
+    LOG_ASYNC = True
+    LOG_QUEUE_SIZE = 10000
+    # Fraction of the INFO lines kept per logger, e.g.
+    # {"cloudmailin.requests": 0.01, "cloudmailin.handlers": 0.1}
+    LOG_SAMPLING_RATES = {}
+
+    # Prometheus metrics at /metrics. Off by default: the endpoint is not
+    # authenticated and would publish sender, handler and traffic figures on
+    # the public service, so only enable it where /metrics is reachable by
+    # the scraper alone (e.g. behind an internal load balancer). With several
+    # gunicorn workers, set METRICS_MULTIPROC_DIR to a directory shared by
+    # them (emptied when the service starts): each worker writes its metrics
+    # there every METRICS_FLUSH_SECONDS and /metrics reports their sum
+    METRICS_ENABLED = False
+    METRICS_MULTIPROC_DIR = None
+    METRICS_FLUSH_SECONDS = 5.0
+
+    # Per-request spans around validation, handler lookup, steps and storage,
+    # with the trace id (from traceparent or X-Cloud-Trace-Context when the
+    # request has one) added to every log line
+    TRACING_ENABLED = False
+    # Append the spans of each request as OTLP/JSON lines to this file
+    TRACING_EXPORT_PATH = None
+    # Traces waiting for the exporter thread beyond this are dropped
+    TRACING_EXPORT_QUEUE_SIZE = 10000
+    # Log the span breakdown of requests slower than this, disabled when None
+    TRACING_SLOW_REQUEST_SECONDS = None
+    # Google Cloud project, to link log lines to their trace in Cloud Logging
+    TRACING_PROJECT_ID = None
+
+    # Bearer token of the /admin endpoints, which are disabled when None
+    ADMIN_TOKEN = None
 
 
 class ProductionConfig(Config):
@@ -10,6 +158,23 @@ class StagingConfig(Config):
     FIRESTORE_COLLECTION = "staging_emails"
 
 
+class LoadTestConfig(Config):
+    # FLASK_ENV=LoadTestConfig serves the app offline, e.g. under gunicorn
+    # while `flask loadtest --url` drives it
+    FIRESTORE_COLLECTION = "loadtest_emails"
+    STORAGE_BACKEND = "memory"
+    MEMORY_STORAGE_LATENCY_MS = 20.0
+    MEMORY_STORAGE_JITTER_MS = 5.0
+    # Served offline, so /metrics is not exposed publicly
+    METRICS_ENABLED = True
+
+
+class LocalConfig(Config):
+    # FLASK_ENV=LocalConfig stores emails in instance/cloudmailin.sqlite
+    FIRESTORE_COLLECTION = "local_emails"
+    STORAGE_BACKEND = "sqlite"
+
+
 class UnitTestingConfig(Config):
     FIRESTORE_COLLECTION = None
 
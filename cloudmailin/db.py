@@ -1,83 +1,429 @@
+import atexit
+import itertools
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import click
+from flask.cli import with_appcontext
 
 from flask import g, current_app
 
 from google.cloud import firestore
 
+from cloudmailin import (
+    blobstore,
+    compression,
+    dedup,
+    spool,
+    storage,
+    write_behind,
+)
+from cloudmailin.metrics import STORAGE_WRITE_DURATION, STORAGE_WRITE_ERRORS
+
+logger = logging.getLogger("cloudmailin")
+
+# Guards the lazy creation of the process-wide client pool
+_pool_lock = threading.Lock()
+
+
+class FirestoreClientPool:
+    """
+    Process-wide pool of Firestore clients, each one owning its own gRPC channel.
+
+    Clients are thread-safe, so they are shared by every request served by the
+    worker process and handed out round-robin.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        size: int = 1,
+        keepalive_ms: int = None,
+        client_factory=None,
+    ):
+        if size < 1:
+            raise ValueError("FIRESTORE_CHANNEL_POOL_SIZE must be at least 1.")
+
+        self.database_name = database
+        self.keepalive_ms = keepalive_ms
+        # Builds the clients instead of firestore.Client, e.g. a stand-in
+        self.client_factory = client_factory
+        self._clients = [self._create_client() for _ in range(size)]
+        # next() on itertools.count is atomic, so no lock is needed on lookups
+        self._counter = itertools.count()
+
+    def _create_client(self):
+        if self.client_factory is not None:
+            return self.client_factory(database=self.database_name)
+        client = firestore.Client(database=self.database_name)
+        if self.keepalive_ms and getattr(client, "_emulator_host", None) is None:
+            try:
+                _open_channel(client, self.keepalive_ms)
+            except Exception as e:
+                # The channel is built from private client attributes, which a
+                # google-cloud-firestore upgrade may rename
+                logger.warning(
+                    "Could not apply FIRESTORE_KEEPALIVE_MS, "
+                    f"using the default gRPC channel: {e!r}"
+                )
+        return client
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get_client(self):
+        """
+        Return the next client in the pool.
+        """
+        if not self._clients:
+            raise RuntimeError("Firestore client pool is closed.")
+        return self._clients[next(self._counter) % len(self._clients)]
+
+    def close(self):
+        """
+        Close the gRPC channel of every client in the pool.
+        """
+        clients, self._clients = self._clients, []
+        for client in clients:
+            _close_channel(client)
+
+
+def _open_channel(client, keepalive_ms):
+    """
+    Build the client's gRPC channel with a custom keepalive.
+
+    The Firestore client hardcodes its channel options, so the channel is
+    created here the same way the client would lazily create it. The client is
+    only modified once the whole transport is built, so it keeps its default
+    channel if this fails.
+    """
+    from google.cloud.firestore_v1.services.firestore import client as gapic_client
+    from google.cloud.firestore_v1.services.firestore.transports import grpc
+
+    options = [
+        ("grpc.keepalive_time_ms", keepalive_ms),
+        ("grpc.keepalive_timeout_ms", min(keepalive_ms, 20000)),
+        ("grpc.keepalive_permit_without_calls", 1),
+    ]
+    channel = grpc.FirestoreGrpcTransport.create_channel(
+        client._target, credentials=client._credentials, options=options
+    )
+    transport = grpc.FirestoreGrpcTransport(host=client._target, channel=channel)
+    api = gapic_client.FirestoreClient(
+        transport=transport, client_options=client._client_options
+    )
+    client._transport = transport
+    client._firestore_api_internal = api
+
+
+def _close_channel(client):
+    """
+    Close the gRPC channel of a client, if it was ever opened.
+    """
+    if isinstance(client, storage.StorageBackend):
+        client.close()
+        return
+    api = getattr(client, "_firestore_api_internal", None)
+    if api is not None:
+        api.transport.close()
+
+
+def get_client_pool(app=None):
+    """
+    Get the Firestore client pool of the app, creating it on first use.
+
+    The pool is created lazily so that gRPC channels are opened after
+    gunicorn forks the worker process, never in the master.
+    """
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get("firestore_pool")
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get("firestore_pool")
+            if pool is None:
+                pool = FirestoreClientPool(
+                    database=app.config.get("FIRESTORE_DATABASE", "cloudmailin"),
+                    size=app.config.get("FIRESTORE_CHANNEL_POOL_SIZE", 1),
+                    keepalive_ms=app.config.get("FIRESTORE_KEEPALIVE_MS"),
+                    client_factory=storage.client_factory(app),
+                )
+                app.extensions["firestore_pool"] = pool
+                # Close the pooled gRPC channels when the worker process exits
+                atexit.register(close_client_pool, app)
+    return pool
+
+
+def close_client_pool(app):
+    """
+    Close and discard the Firestore client pool of the app, if any.
+    """
+    pool = app.extensions.pop("firestore_pool", None)
+    if pool is not None:
+        pool.close()
+
 
 class DatabaseHelper:
-    def __init__(self, config):
+    def __init__(
+        self,
+        config,
+        client=None,
+        write_behind=None,
+        spool=None,
+        dedup=None,
+        codec=None,
+        blob_store=None,
+    ):
         """
-        Initialize the Firestore client.
+        Initialize the helper on top of a Firestore client.
+
+        When no client is given a dedicated one is created. When a write-behind
+        buffer is given, emails are queued there instead of written inline.
+        When a spool is given, emails that fail to persist are recorded there.
+        When a dedup Bloom filter is given, emails are stored under
+        deterministic ids and repeated deliveries are skipped. When a body
+        codec is given, large bodies are stored compressed. When a blob store
+        is given, bodies above BLOB_OFFLOAD_THRESHOLD are moved there.
         """
         self.database_name = config.get("FIRESTORE_DATABASE", "cloudmailin")
-        self.client = firestore.Client(database=self.database_name)
+        self.client = (
+            client
+            if client is not None
+            else firestore.Client(database=self.database_name)
+        )
         self.config = config
+        self.write_behind = write_behind
+        self.spool = spool
+        self.dedup = dedup
+        self.codec = codec
+        self.blob_store = blob_store
+        # Documents waiting for a bulk commit while inside batched(), and the
+        # ids of the documents whose commit failed
+        self._pending_writes = None
+        self._batch_size = None
+        self._failed_writes = None
 
         # Validate FIRESTORE_COLLECTION presence in the config
         self.collection_name = self.config.get("FIRESTORE_COLLECTION")
         if not self.collection_name:
             raise ValueError("FIRESTORE_COLLECTION is required but not configured.")
 
+    def get_collection_name(self):
+        """
+        Get the Firestore collection name, overriding it if the request context provides one.
+        """
+        return getattr(g, "firestore_collection", None) or self.collection_name
+
     def get_collection(self):
         """
         Get the Firestore collection, overriding it if the request context provides one.
         """
-        collection_override = getattr(g, "firestore_collection", None)
-        if collection_override:
-            return self.client.collection(collection_override)
-        return self.client.collection(self.collection_name)
+        return self.client.collection(self.get_collection_name())
 
-    def store_email(self, email_data):
+    def store_email(self, email_data, dedup_key: str = None):
         """
         Store an email document in the Firestore collection.
+
+        `dedup_key` identifies the email for dedup (see dedup.email_dedup_key);
+        it is derived from the document when not given.
+
+        Returns:
+            str: The id of the stored document, or None if it could not be
+            stored. Emails that are spooled keep the id they will be replayed with.
         """
+        document_id = key = None
+        if self.dedup is not None:
+            key = dedup_key or dedup.dedup_key(email_data)
+            document_id = dedup.document_id_for(key)
+        if self.codec is not None:
+            email_data = self.codec.encode_document(email_data)
+
         try:
+            if self.blob_store is not None:
+                email_data = blobstore.offload_bodies(
+                    email_data,
+                    self.blob_store,
+                    self.config.get("BLOB_OFFLOAD_THRESHOLD", 512 * 1024),
+                )
             collection = self.get_collection()
-            collection.add(email_data)
+            if key is not None and key in self.dedup:
+                # Possibly a retried delivery: a false positive of the filter
+                # only costs this lookup
+                if self._is_stored(collection, document_id):
+                    current_app.logger.info(
+                        "Skipping duplicate email: document %s exists", document_id
+                    )
+                    return document_id
+
+            document_id = self._write(collection, document_id, email_data)
+            if key is not None:
+                self.dedup.add(key)
+            return document_id
         except Exception as e:
+            STORAGE_WRITE_ERRORS.inc("inline")
             current_app.logger.error(
                 f"Failed to store email in database: {e}", exc_info=True
             )
+            if self.spool is not None:
+                document_id = document_id or uuid.uuid4().hex
+                self.spool.append(self.get_collection_name(), document_id, email_data)
+                return document_id
+            return None
 
+    def _write(self, collection, document_id, email_data) -> str:
+        """
+        Write the document (with an auto id when document_id is None) to the
+        pending batch, the write-behind buffer or Firestore, and return its id.
+        """
+        if self._pending_writes is not None:
+            document = collection.document(document_id)
+            self._pending_writes.append((document, email_data))
+            if len(self._pending_writes) >= self._batch_size:
+                self._failed_writes.update(self._commit_pending_writes())
+            return document.id
 
-def get_db():
-    if "db" not in g:
-        g.db = DatabaseHelper(current_app.config)
-        # g.db =sqlite3.connect(
-        #    current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        # )
-        # g.db.row_factory = sqlite3.Row
+        if self.write_behind is not None:
+            document = collection.document(document_id)
+            if self.write_behind.put(document, email_data):
+                return document.id
+            # The buffer is full: fall back to an inline write
 
-    return g.db
+        started = time.perf_counter()
+        if document_id is not None:
+            # Writing to a deterministic id makes a duplicate idempotent
+            collection.document(document_id).set(email_data)
+        else:
+            # add() returns an (update_time, document_reference) pair
+            document_id = collection.add(email_data)[1].id
+        STORAGE_WRITE_DURATION.observe(time.perf_counter() - started, "inline")
+        return document_id
 
+    def _is_stored(self, collection, document_id: str) -> bool:
+        """
+        Whether the document exists, in Firestore or in the pending batch.
+        Lookup failures count as not stored: the write is idempotent anyway.
+        """
+        if self._pending_writes is not None and any(
+            document.id == document_id for document, _ in self._pending_writes
+        ):
+            return True
+        try:
+            return collection.document(document_id).get().exists
+        except Exception as e:
+            current_app.logger.warning(f"Duplicate lookup failed: {e}")
+            return False
 
-def close_db(e=None):
-    db = g.pop("db", None)
+    @contextmanager
+    def batched(self, batch_size: int = 500):
+        """
+        Collect the emails stored inside the block and commit them in bulk,
+        with Firestore write batches of up to `batch_size` documents.
 
-    if db is not None:
-        pass
-    #    db.close()
+        Yields:
+            dict: Filled with the ids of the documents whose commit failed
+            (complete once the block exits), mapped to "spooled" when the
+            spool took them or "error" when they were lost.
+        """
+        self._pending_writes = []
+        self._batch_size = batch_size
+        failed_writes = self._failed_writes = {}
+        try:
+            yield failed_writes
+        finally:
+            try:
+                failed_writes.update(self._commit_pending_writes())
+            finally:
+                self._pending_writes = None
+                self._failed_writes = None
+
+    def _commit_pending_writes(self) -> dict:
+        """
+        Commit the pending writes.
 
+        Returns:
+            dict: The ids of the documents that could not be committed, mapped
+            to "spooled" or "error" (empty when the commit succeeded).
+        """
+        pending, self._pending_writes = self._pending_writes, []
+        if not pending:
+            return {}
+        try:
+            started = time.perf_counter()
+            batch = self.client.batch()
+            for document, email_data in pending:
+                batch.set(document, email_data)
+            batch.commit()
+            STORAGE_WRITE_DURATION.observe(time.perf_counter() - started, "batch")
+            return {}
+        except Exception as e:
+            STORAGE_WRITE_ERRORS.inc("batch")
+            current_app.logger.error(
+                f"Failed to store {len(pending)} emails in database: {e}",
+                exc_info=True,
+            )
+            if self.spool is None:
+                return {document.id: "error" for document, _ in pending}
+            for document, email_data in pending:
+                self.spool.append(document.parent.id, document.id, email_data)
+            return {document.id: "spooled" for document, _ in pending}
 
-def init_db():
-    """In a sql database this would clear the existing data and create new tables"""
-    pass
 
+def get_db():
+    if "db" not in g:
+        # The helper is cheap: it reuses the process-wide pooled client
+        g.db = DatabaseHelper(
+            current_app.config,
+            client=get_client_pool().get_client(),
+            write_behind=(
+                write_behind.get_write_behind()
+                if current_app.config.get("WRITE_BEHIND_ENABLED")
+                else None
+            ),
+            spool=spool.get_spool(),
+            dedup=dedup.get_dedup_filter(),
+            codec=current_app.extensions.get("body_codec"),
+            blob_store=current_app.extensions.get("blob_store"),
+        )
+
+    return g.db
+
+
+def close_db(e=None):
+    # The client is shared by the whole process, so the helper holds nothing
+    # that needs closing at the end of the request
+    g.pop("db", None)
 
-#    db = get_db()
 
-# with current_app.open_resource("schema.sql") as f:
-#    db.executescript(f.read().decode("utf8"))
+def init_db() -> bool:
+    """
+    Create the tables and indexes of the storage backend, keeping existing
+    data. Returns False for backends without a schema (Firestore, memory).
+    """
+    client = get_client_pool().get_client()
+    if not isinstance(client, storage.StorageBackend):
+        return False
+    client.init_schema()
+    return True
 
 
 @click.command("init-db")
+@with_appcontext
 def init_db_command():
-    """In a sql database this would clear the existing data and create new tables"""
-    init_db()
-    click.echo("Initialised the database")
+    """Create the tables and indexes of the storage backend."""
+    backend = current_app.config.get("STORAGE_BACKEND") or "firestore"
+    if init_db():
+        click.echo(f"Initialised the {backend} database")
+    else:
+        click.echo(f"The {backend} backend has no schema to initialise")
 
 
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    spool.init_app(app)
+    write_behind.init_app(app)
+    dedup.init_app(app)
+    compression.init_app(app)
+    blobstore.init_app(app)
@@ -0,0 +1,150 @@
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+
+
+def dedup_key(email_data: dict) -> str:
+    """
+    Identity of an email delivery: its recipient and Message-ID or, for
+    emails without one, a hash of its recipient, sender, date and subject.
+
+    The recipient is part of the key because CloudMailin delivers the same
+    message once per recipient.
+    """
+    return _identity_key(
+        email_data.get("recipient"),
+        email_data.get("message_id"),
+        email_data.get("sender"),
+        email_data.get("date"),
+        email_data.get("subject"),
+    )
+
+
+def email_dedup_key(email) -> str:
+    """
+    dedup_key() of an Email model, read from its fields rather than from the
+    stored document, whose keys a storage projection may rename or drop.
+    """
+    return _identity_key(
+        email.recipient, email.message_id, email.sender, email.date, email.subject
+    )
+
+
+def _identity_key(recipient, message_id, sender, date, subject) -> str:
+    recipient = recipient or ""
+    message_id = (message_id or "").strip().strip("<>").strip()
+    if message_id:
+        return f"message-id\0{recipient}\0{message_id}"
+
+    date = date.isoformat() if hasattr(date, "isoformat") else str(date)
+    return "content\0" + "\0".join((recipient, sender or "", date, subject or ""))
+
+
+def document_id_for(key: str) -> str:
+    """
+    Deterministic document id of a dedup key, so that a duplicate overwrites
+    its original instead of creating a new document.
+    """
+    return hashlib.sha256(key.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter: no false negatives, false positives at
+    `error_rate` once `capacity` keys were added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("Bloom filter capacity and error rate are out of range.")
+
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        # Double hashing (Kirsch-Mitzenmacher) from a single 128-bit digest
+        digest = hashlib.blake2b(
+            key.encode("utf-8", "surrogatepass"), digest_size=16
+        ).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filter of the recently seen dedup keys.
+
+    Two generations are kept: keys are added to the current one and looked up
+    in both. The current generation becomes the previous one when it is full
+    or older than `rotation_seconds`, so memory stays bounded and every key
+    is remembered for at least one rotation period.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100000,
+        error_rate: float = 0.001,
+        rotation_seconds: float = 3600.0,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rotation_seconds = rotation_seconds
+        self._lock = threading.Lock()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._rotated_at = time.monotonic()
+
+    def add(self, key: str):
+        with self._lock:
+            if self._current.count >= self.capacity or (
+                self.rotation_seconds
+                and time.monotonic() - self._rotated_at >= self.rotation_seconds
+            ):
+                self._rotate()
+            self._current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        current, previous = self._current, self._previous
+        return key in current or (previous is not None and key in previous)
+
+    def _rotate(self):
+        self._previous = self._current
+        self._current = BloomFilter(self.capacity, self.error_rate)
+        self._rotated_at = time.monotonic()
+
+
+def get_dedup_filter(app=None):
+    """
+    Get the Bloom filter of the app, or None if deduplication is disabled.
+    """
+    app = app or current_app
+    return app.extensions.get("dedup_filter")
+
+
+def init_app(app):
+    if not app.config.get("DEDUP_ENABLED"):
+        return
+
+    app.extensions["dedup_filter"] = RotatingBloomFilter(
+        capacity=app.config.get("DEDUP_BLOOM_CAPACITY", 100000),
+        error_rate=app.config.get("DEDUP_BLOOM_ERROR_RATE", 0.001),
+        rotation_seconds=app.config.get("DEDUP_BLOOM_ROTATION_SECONDS", 3600.0),
+    )
@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+
+from cloudmailin.storage import StorageBackend
+
+
+class LatencyModel:
+    """
+    Delay (and optionally fail) every simulated Firestore RPC.
+
+    Each call sleeps for `latency_ms` plus or minus up to `jitter_ms`, then
+    fails with ServiceUnavailable with probability `error_rate`, like a
+    real write hitting a transient backend error.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = None,
+    ):
+        if not 0 <= error_rate <= 1:
+            raise ValueError(f"Invalid Firestore error rate: {error_rate}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def wait(self):
+        delay_ms = self.latency_ms
+        if self.jitter_ms:
+            delay_ms += self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise exceptions.ServiceUnavailable("Injected Firestore failure")
+
+
+class InMemoryFirestoreClient(StorageBackend):
+    """
+    Stand-in for firestore.Client keeping documents in memory, for load tests
+    and offline runs.
+
+    Every RPC (a write, a lookup or a batch commit) goes through the latency
+    model.
+    """
+
+    def __init__(self, latency: LatencyModel = None, **kwargs):
+        self.latency = latency or LatencyModel()
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def documents(self, collection: str) -> dict:
+        """
+        Copy of the documents stored in a collection, by id.
+        """
+        with self._lock:
+            return dict(self._collections.get(collection, {}))
+
+    def _commit(self, writes: list):
+        self.latency.wait()
+        with self._lock:
+            for collection, document_id, data in writes:
+                self._collections.setdefault(collection, {})[document_id] = dict(data)
+
+    def _get(self, collection: str, document_id: str):
+        self.latency.wait()
+        with self._lock:
+            return self._collections.get(collection, {}).get(document_id)
+
+    def _delete(self, collection: str, document_id: str):
+        self.latency.wait()
+        with self._lock:
+            self._collections.get(collection, {}).pop(document_id, None)
+
+    def _stream(self, collection: str):
+        self.latency.wait()
+        return list(self.documents(collection).items())
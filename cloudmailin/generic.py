@@ -1,49 +1,457 @@
-from flask import Blueprint, request, jsonify, current_app
+import asyncio
+import json
+
+from flask import Blueprint, request, jsonify, current_app, g, make_response
 from pydantic import ValidationError
+from werkzeug.exceptions import RequestEntityTooLarge
 
+from cloudmailin.db import get_db
+from cloudmailin.idempotency import (
+    IdempotencyConflict,
+    IdempotencyKeyReused,
+    IdempotentResult,
+    get_idempotency_fingerprint,
+    get_idempotency_key,
+    get_idempotency_store,
+)
+from cloudmailin.metrics import VALIDATION_FAILURES
+from cloudmailin.payload import check_body_fields, read_json_payload
 from cloudmailin.schemas import Email
+from cloudmailin.tracing import span
+from cloudmailin.work_queue import get_ingest_queue
 
 bp = Blueprint("generic", __name__, url_prefix="/generic")
 
+RESPONSE_PROFILES = ("full", "summary", "empty")
 
-@bp.route("/new", methods=["POST"])
-def new_generic_email():
-    try:
-        data_received = request.get_json()
-        email = Email(**data_received)
 
-        # Step 1: Retrieve the handler registry from the app context
-        handler_registry = current_app.config.get("handler_registry")
-        if not handler_registry:
-            raise RuntimeError("Handler registry is not configured in the app context.")
+class OversizedLine:
+    """
+    Stands for a line longer than the maximum line length, whose content was
+    discarded as it streamed in.
+    """
+
+    __slots__ = ("length",)
+
+    def __init__(self, length: int):
+        self.length = length
+
+
+def iter_lines(stream, chunk_size: int = 64 * 1024, max_line_length: int = None):
+    """
+    Yield the lines of a binary stream, reading it in fixed-size chunks so
+    that the whole body is never held in memory.
+
+    Lines longer than max_line_length bytes are yielded as OversizedLine, and
+    their content is dropped without being buffered.
+    """
+    remainder = b""
+    # Length of the oversized line being skipped, None when not skipping
+    skipped = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        *lines, remainder = (remainder + chunk).split(b"\n")
+        for line in lines:
+            if skipped is not None:
+                yield OversizedLine(skipped + len(line))
+                skipped = None
+            elif max_line_length and len(line) > max_line_length:
+                yield OversizedLine(len(line))
+            else:
+                yield line
+        if max_line_length and len(remainder) > max_line_length:
+            skipped = (skipped or 0) + len(remainder)
+            remainder = b""
+    if skipped is not None:
+        yield OversizedLine(skipped + len(remainder))
+    elif remainder:
+        if max_line_length and len(remainder) > max_line_length:
+            yield OversizedLine(len(remainder))
+        else:
+            yield remainder
+
+
+def get_response_profile() -> str:
+    """
+    Response profile of the current request: the X-Response-Profile header
+    when it names a valid profile, the RESPONSE_PROFILE config otherwise.
+    """
+    profile = request.headers.get("X-Response-Profile", "").lower()
+    if profile in RESPONSE_PROFILES:
+        return profile
+    return current_app.config.get("RESPONSE_PROFILE", "full")
+
+
+def build_response(email: Email, handler_name: str, status: str, status_code: int):
+    """
+    Build the reply to an ingested email according to the response profile.
+
+    "full" echoes the email back, "summary" only returns the stored document
+    id, the handler and the status, and "empty" returns no body at all.
+    """
+    profile = get_response_profile()
+
+    if profile == "empty":
+        # 204 would hide the difference between processed and accepted
+        return "", 204 if status_code == 200 else status_code
+
+    if profile == "summary":
+        return (
+            jsonify(
+                {"id": email.document_id, "handler": handler_name, "status": status}
+            ),
+            status_code,
+        )
+
+    body = {
+        "sender": email.sender,
+        "recipient": email.recipient,
+        "subject": email.subject,
+    }
+    if status == "processed":
+        body.update(
+            {
+                "date": email.date,
+                "plain": email.plain,
+                "html": email.html,
+            }
+        )
+    body.update({"status": status, "handler": handler_name})
+    return jsonify(body), status_code
+
+
+def submit_to_ingest_queue(email: Email, payload: dict, handler) -> IdempotentResult:
+    """
+    In async ingest mode, queue the email to be processed in the background
+    by the handler instance looked up now, so that a registry reload in the
+    meantime does not change how it is processed.
+
+    Returns:
+        IdempotentResult: The "accepted" result, or None if the email must be
+        processed now (sync mode, or the queue is full).
+    """
+    if current_app.config.get("INGEST_MODE", "sync") != "async":
+        return None
+    accepted = get_ingest_queue(current_app).submit(
+        email,
+        payload,
+        handler,
+        collection=getattr(g, "firestore_collection", None),
+    )
+    if not accepted:
+        return None
+    return IdempotentResult(type(handler).__name__, "accepted", 202, {})
+
+
+def processed_result(email: Email, processed, handler_class) -> IdempotentResult:
+    changes = {}
+    if isinstance(processed, Email):
+        # Fields the handler left untouched are the same objects
+        changes = {
+            field: getattr(processed, field)
+            for field in Email.model_fields
+            if getattr(processed, field) is not getattr(email, field)
+        }
+    return IdempotentResult(handler_class.__name__, "processed", 200, changes)
+
+
+def process_email(
+    email: Email, payload: dict, handler_registry, handler_class
+) -> IdempotentResult:
+    """
+    Hand the email over to its handler, or to the ingest queue in async mode.
+    """
+    # Async mode: acknowledge now and process in the background. When the
+    # queue is full the email is processed synchronously instead.
+    handler = handler_registry.get_handler(handler_class)
+    accepted = submit_to_ingest_queue(email, payload, handler)
+    if accepted is not None:
+        return accepted
+
+    return processed_result(email, handler.handle(email), handler_class)
+
+
+async def aprocess_email(
+    email: Email, payload: dict, handler_registry, handler_class
+) -> IdempotentResult:
+    """
+    Like process_email(), awaiting the handler's ahandle(). Handlers without
+    one are run in a worker thread.
+    """
+    handler = handler_registry.get_handler(handler_class)
+    accepted = submit_to_ingest_queue(email, payload, handler)
+    if accepted is not None:
+        return accepted
+
+    if hasattr(handler, "ahandle"):
+        processed = await handler.ahandle(email)
+    else:
+        processed = await asyncio.to_thread(handler.handle, email)
+    return processed_result(email, processed, handler_class)
+
+
+def parse_email_request() -> tuple:
+    """
+    Validate the posted email and look up its handler.
+
+    Returns:
+        tuple: The email, the raw payload, the handler registry and the
+        handler class.
+    """
+    data_received = read_json_payload(current_app.config.get("MAX_BODY_FIELD_LENGTH"))
+    with span("validate"):
+        email = Email.model_validate(data_received)
 
-        # Step 2: Retrieve the appropriate handler
+    # Step 1: Retrieve the handler registry from the app context
+    handler_registry = current_app.config.get("handler_registry")
+    if not handler_registry:
+        raise RuntimeError("Handler registry is not configured in the app context.")
+
+    # Step 2: Retrieve the appropriate handler
+    with span("lookup_handler"):
         handler_class = handler_registry.get_handler_for_sender(email.sender)
-        handler = handler_class()
+    g.handler_name = handler_class.__name__
+    return email, data_received, handler_registry, handler_class
+
+
+def email_response(email: Email, result: IdempotentResult, replayed: bool):
+    response = make_response(
+        build_response(
+            email.model_copy(update=result.changes),
+            result.handler_name,
+            result.status,
+            result.status_code,
+        )
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
 
-        # Step 3: Process the email using the handler
-        handler.handle(email)
+def email_error_response(error: Exception):
+    """
+    Reply to a /generic/new request that failed with `error`. Must be called
+    from the except block handling it.
+    """
+    if isinstance(error, IdempotencyConflict):
+        return (
+            jsonify(
+                {
+                    "error": "Conflict",
+                    "details": "A request with this Idempotency-Key is in progress.",
+                }
+            ),
+            409,
+        )
 
+    if isinstance(error, IdempotencyKeyReused):
         return (
             jsonify(
                 {
-                    "sender": email.sender,
-                    "recipient": email.recipient,
-                    "subject": email.subject,
-                    "date": email.date,
-                    "plain": email.plain,
-                    "html": email.html,
-                    "status": "processed",
-                    "handler": handler_class.__name__,
+                    "error": "Unprocessable Entity",
+                    "details": "This Idempotency-Key was used for another payload.",
                 }
             ),
-            200,
+            422,
         )
 
-    except ValidationError as e:
+    if isinstance(error, ValidationError):
         # Handle structured Pydantic errors
-        return jsonify({"error": "Validation failed", "details": str(e)}), 400
+        VALIDATION_FAILURES.inc("/generic/new", "schema")
+        return jsonify({"error": "Validation failed", "details": str(error)}), 400
+
+    if isinstance(error, RequestEntityTooLarge):
+        # Rendered as a JSON 413 by the app error handler
+        raise error
+
+    current_app.logger.exception("Unhandled exception in /generic/new")
+    return jsonify({"error": "Internal Server Error"}), 500
+
+
+@bp.route("/new", methods=["POST"])
+def new_generic_email():
+    try:
+        email, data_received, handler_registry, handler_class = parse_email_request()
 
-    except Exception:
-        current_app.logger.exception("Unhandled exception in /generic/new")
+        # Step 3: Process the email, once per idempotency key
+        def process() -> IdempotentResult:
+            return process_email(email, data_received, handler_registry, handler_class)
+
+        key = get_idempotency_key(email)
+        if key is None:
+            result, replayed = process(), False
+        else:
+            result, replayed = get_idempotency_store().run(
+                key,
+                process,
+                wait_timeout=current_app.config.get("IDEMPOTENCY_WAIT_SECONDS"),
+                fingerprint=get_idempotency_fingerprint(email),
+            )
+        return email_response(email, result, replayed)
+
+    except Exception as e:
+        return email_error_response(e)
+
+
+async def new_generic_email_async():
+    """
+    Async variant of /generic/new, served natively by the ASGI app (see
+    cloudmailin.asgi) so that one process keeps many storage writes in flight.
+    """
+    try:
+        email, data_received, handler_registry, handler_class = parse_email_request()
+
+        async def process() -> IdempotentResult:
+            return await aprocess_email(
+                email, data_received, handler_registry, handler_class
+            )
+
+        key = get_idempotency_key(email)
+        if key is None:
+            result, replayed = await process(), False
+        else:
+            result, replayed = await get_idempotency_store().arun(
+                key,
+                process,
+                wait_timeout=current_app.config.get("IDEMPOTENCY_WAIT_SECONDS"),
+                fingerprint=get_idempotency_fingerprint(email),
+            )
+        return email_response(email, result, replayed)
+
+    except Exception as e:
+        return email_error_response(e)
+
+
+@bp.route("/batch", methods=["POST"])
+def batch_generic_emails():
+    """
+    Ingest newline-delimited JSON CloudMailin payloads, one email per line.
+
+    Lines are parsed as the body streams in and processed independently; the
+    storage writes of the whole request are committed in bulk. The response
+    reports the outcome of every line: lines whose bulk commit failed are
+    reported as "spooled" (kept in the local spool and replayed later) or
+    "error", and counted as failed. When the body exceeds
+    MAX_BATCH_CONTENT_LENGTH mid-stream, the lines read so far are kept and
+    reported with a 413, so a client knows which ones not to resend.
+    """
+    handler_registry = current_app.config.get("handler_registry")
+    if not handler_registry:
+        current_app.logger.error(
+            "Handler registry is not configured in the app context."
+        )
         return jsonify({"error": "Internal Server Error"}), 500
+
+    # Batches are streamed, so they get their own (usually larger) body limit
+    request.max_content_length = current_app.config.get("MAX_BATCH_CONTENT_LENGTH")
+    max_field_length = current_app.config.get("MAX_BODY_FIELD_LENGTH")
+    max_line_length = current_app.config.get("MAX_CONTENT_LENGTH")
+    lines = iter_lines(request.stream, max_line_length=max_line_length)
+
+    results = []
+    # Result of each line handed to a handler, with the id of its document
+    stored = []
+    stream_error = None
+    batch_size = current_app.config.get("BATCH_COMMIT_SIZE", 500)
+    with get_db().batched(batch_size) as failed_writes:
+        line_number = 0
+        while True:
+            # Reading past MAX_BATCH_CONTENT_LENGTH raises from the stream
+            try:
+                line = next(lines, None)
+            except RequestEntityTooLarge as e:
+                stream_error = e
+                break
+            if line is None:
+                break
+            line_number += 1
+            if not isinstance(line, OversizedLine) and not line.strip():
+                continue
+            try:
+                if isinstance(line, OversizedLine):
+                    raise RequestEntityTooLarge(
+                        f"The line of {line.length} bytes exceeds the maximum "
+                        f"length of {max_line_length} bytes."
+                    )
+                payload = json.loads(line)
+                if max_field_length and isinstance(payload, dict):
+                    check_body_fields(payload, max_field_length)
+                with span("validate"):
+                    email = Email.model_validate(payload)
+                with span("lookup_handler"):
+                    handler_class = handler_registry.get_handler_for_sender(
+                        email.sender
+                    )
+                handled = handler_registry.get_handler(handler_class).handle(email)
+            except json.JSONDecodeError as e:
+                VALIDATION_FAILURES.inc("/generic/batch", "json")
+                results.append(
+                    {
+                        "line": line_number,
+                        "status": "invalid",
+                        "error": f"Invalid JSON: {e}",
+                    }
+                )
+                continue
+            except RequestEntityTooLarge as e:
+                results.append(
+                    {
+                        "line": line_number,
+                        "status": "invalid",
+                        "error": "Payload Too Large",
+                        "details": e.description,
+                    }
+                )
+                continue
+            except ValidationError as e:
+                VALIDATION_FAILURES.inc("/generic/batch", "schema")
+                results.append(
+                    {
+                        "line": line_number,
+                        "status": "invalid",
+                        "error": "Validation failed",
+                        "details": str(e),
+                    }
+                )
+                continue
+            except Exception:
+                current_app.logger.exception(
+                    f"Unhandled exception in /generic/batch on line {line_number}"
+                )
+                results.append(
+                    {
+                        "line": line_number,
+                        "status": "error",
+                        "error": "Internal Server Error",
+                    }
+                )
+                continue
+
+            result = {
+                "line": line_number,
+                "status": "processed",
+                "handler": handler_class.__name__,
+            }
+            results.append(result)
+            stored.append((result, getattr(handled, "document_id", None)))
+
+    processed = 0
+    for result, document_id in stored:
+        status = failed_writes.get(document_id)
+        if status is None:
+            processed += 1
+        else:
+            result["status"] = status
+            result["error"] = "Failed to store the email in database"
+
+    body = {
+        "processed": processed,
+        "failed": len(results) - processed,
+        "results": results,
+    }
+    if stream_error is not None:
+        body.update({"error": "Payload Too Large", "details": stream_error.description})
+        return jsonify(body), 413
+    return jsonify(body), 200
@@ -1,7 +1,17 @@
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
 import yaml
 
 from cloudmailin.handlers.base_handler import BaseHandler
 from cloudmailin.handlers.campaign_classifier import CampaignClassifierHandler
+from cloudmailin.handlers.pipeline import compile_pipeline
+from cloudmailin.handlers.projection import compile_projection
+from cloudmailin.metrics import REGISTRY_LOOKUPS
 
 DEFAULT_HANDLER = BaseHandler
 
@@ -10,23 +20,116 @@ HANDLERS_MAP = {
     "CampaignClassifierHandler": CampaignClassifierHandler,
 }
 
+# Sender rules starting with this prefix are regular expressions
+REGEX_PREFIX = "re:"
+
+# Numbered backreferences ("\1", "(?(1)...)") would point at other groups once
+# a pattern is embedded in the alternation of the regex rules
+NUMBERED_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d")
+
+logger = logging.getLogger("cloudmailin")
+
+
+@lru_cache(maxsize=8192)
+def normalize_sender(sender: str) -> str:
+    """
+    Canonical form of a sender address used for routing: lowercased, without
+    a plus-address tag ("news+tag@x.com" -> "news@x.com") and with an
+    internationalized domain converted to its ASCII (punycode) form.
+    """
+    sender = sender.strip().lower()
+    local, at, domain = sender.rpartition("@")
+    if not at:
+        return sender
+
+    local = local.split("+", 1)[0]
+    if not domain.isascii():
+        try:
+            domain = domain.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return f"{local}@{domain}"
+
+
+class _DomainNode:
+    """
+    Node of the reversed-domain trie: "mail.example.com" is stored under
+    com -> example -> mail.
+    """
+
+    __slots__ = ("children", "domain_handler", "subdomain_handler")
+
+    def __init__(self):
+        self.children = {}
+        # Handler of "*@<domain>" and of "*@*.<domain>"
+        self.domain_handler = None
+        self.subdomain_handler = None
+
 
 class HandlerRegistry:
-    """Registry for mapping email senders to handlers."""
+    """
+    Registry for mapping email senders to handlers.
+
+    A sender rule is one of:
+
+    - an exact address: "newsletter@example.com"
+    - every address of a domain: "*@example.com"
+    - every address of the subdomains of a domain: "*@*.example.com"
+    - a regular expression, matched against the whole lowercased address as
+      received, plus tag and internationalized domain included:
+      "re:^promo-\\d+@example\\.com$", "re:.*\\+promo@.*"
+
+    Exact and domain rules are matched against the normalized address (see
+    normalize_sender).
+
+    Exact addresses are kept in a dict and domain rules in a reversed-domain
+    trie, so their lookup cost depends on the length of the address only.
+    Regular expressions are compiled into one alternation, tried only when
+    no exact or domain rule matches. Patterns that cannot be embedded in it
+    (inline global flags, numbered backreferences) are matched on their own,
+    and a named group reused across rules starts a new alternation.
+    Precedence is exact address, then the most specific domain rule, then
+    the first registered regex.
+    """
 
     def __init__(self):
         self._registry = {}
+        self._domains = _DomainNode()
+        self._patterns = []
+        self._pattern_handlers = {}
+        self._matchers = None
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self.rule_count = 0
+
+    def add_handler(self, handler):
+        """
+        Use a configured handler instance for every email routed to its class.
+        """
+        self._handlers[type(handler)] = handler
+
+    def get_handler(self, handler_class):
+        """
+        Fetch the shared instance of a handler class, creating it on first use.
+
+        Handlers are stateless, so one instance serves every email.
+        """
+        handler = self._handlers.get(handler_class)
+        if handler is None:
+            handler = self._handlers.setdefault(handler_class, handler_class())
+        return handler
 
     def register(self, sender: str, handler_class):
         """
-        Register a handler for a specific sender.
+        Register a handler for a sender rule.
 
         Args:
-            sender (str): The email sender address.
+            sender (str): An address, a domain wildcard or a "re:" pattern.
             handler_class (type): The handler class to register.
 
         Raises:
-            ValueError: If handler_class is not a valid class or lacks a handle method.
+            ValueError: If handler_class is not a valid class or lacks a handle
+                method, or if the sender rule is malformed.
         """
         if not isinstance(handler_class, type):
             raise ValueError("Handler must be a class")
@@ -36,7 +139,115 @@ class HandlerRegistry:
         ):
             raise ValueError("Handler class must have a callable 'handle' method")
 
-        self._registry[sender] = handler_class
+        self.rule_count += 1
+        if sender.startswith(REGEX_PREFIX):
+            self._register_pattern(sender.removeprefix(REGEX_PREFIX), handler_class)
+        elif sender.startswith("*@"):
+            self._register_domain(sender[2:], handler_class)
+        else:
+            self._registry[normalize_sender(sender)] = handler_class
+
+    def _register_domain(self, domain: str, handler_class):
+        subdomains = domain.startswith("*.")
+        if subdomains:
+            domain = domain[2:]
+
+        labels = normalize_sender(f"@{domain}")[1:].split(".")
+        if not all(labels) or "*" in domain or "@" in domain:
+            raise ValueError(f"Invalid domain wildcard: '*@{domain}'")
+
+        node = self._domains
+        for label in reversed(labels):
+            node = node.children.setdefault(label, _DomainNode())
+        if subdomains:
+            node.subdomain_handler = handler_class
+        else:
+            node.domain_handler = handler_class
+
+    def _register_pattern(self, pattern: str, handler_class):
+        try:
+            group_names = set(re.compile(pattern).groupindex)
+        except re.error as e:
+            raise ValueError(f"Invalid sender pattern '{pattern}': {e}")
+
+        with self._lock:
+            name = f"rule{len(self._patterns)}"
+            try:
+                # Inline global flags are only valid at the start of a pattern
+                re.compile(f"(?P<{name}>{pattern})")
+                embeddable = not NUMBERED_REFERENCE.search(pattern)
+            except re.error:
+                embeddable = False
+            self._patterns.append((name, pattern, group_names, embeddable))
+            self._pattern_handlers[name] = handler_class
+            self._matchers = None
+
+    def compile(self):
+        """
+        Compile the regex rules into as few patterns as possible, keeping
+        their registration order.
+
+        Called lazily by the first lookup after a registration; call it after
+        loading the rules to keep the compilation cost out of requests.
+
+        Returns:
+            list: (compiled pattern, handler class) pairs, tried in order. The
+            handler is None for alternations, whose matching group names the
+            rule.
+        """
+        with self._lock:
+            if self._matchers is None:
+                self._matchers = self._build_matchers()
+            return self._matchers
+
+    def _build_matchers(self) -> list:
+        matchers = []
+        alternation, names = [], set()
+
+        def close_alternation():
+            if alternation:
+                matchers.append((re.compile("|".join(alternation)), None))
+                alternation.clear()
+                names.clear()
+
+        for name, pattern, group_names, embeddable in self._patterns:
+            if not embeddable:
+                close_alternation()
+                matchers.append((re.compile(pattern), self._pattern_handlers[name]))
+                continue
+            if names & (group_names | {name}):
+                close_alternation()
+            alternation.append(f"(?P<{name}>{pattern})")
+            names.update(group_names, {name})
+        close_alternation()
+        return matchers
+
+    def _match_domain(self, domain: str):
+        handler_class = None
+        node = self._domains
+        labels = domain.split(".")
+        for depth in range(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[depth])
+            if node is None:
+                break
+            if depth == 0:
+                handler_class = node.domain_handler or handler_class
+            else:
+                handler_class = node.subdomain_handler or handler_class
+        return handler_class
+
+    def _match_pattern(self, address: str):
+        matchers = self._matchers
+        if matchers is None:
+            if not self._patterns:
+                return None
+            matchers = self.compile()
+
+        for pattern, handler_class in matchers:
+            match = pattern.fullmatch(address)
+            if match is not None:
+                return handler_class or self._pattern_handlers[match.lastgroup]
+        return None
 
     def get_handler_for_sender(self, sender: str):
         """
@@ -48,7 +259,18 @@ class HandlerRegistry:
         Returns:
             type: The handler class for the sender.
         """
-        return self._registry.get(sender, DEFAULT_HANDLER)
+        address = normalize_sender(sender)
+        handler_class = self._registry.get(address)
+        if handler_class is None:
+            domain = address.rpartition("@")[2]
+            handler_class = self._match_domain(domain) or self._match_pattern(
+                sender.strip().lower()
+            )
+        if handler_class is None:
+            REGISTRY_LOOKUPS.inc("default")
+            return DEFAULT_HANDLER
+        REGISTRY_LOOKUPS.inc("configured")
+        return handler_class
 
 
 def load_config(path: str) -> dict:
@@ -91,12 +313,45 @@ def load_config(path: str) -> dict:
     return config
 
 
-def initialize_handler_registry_from_config(config_file: str) -> HandlerRegistry:
+def build_handler_class(handler_name: str, details: dict) -> type:
+    """
+    Resolve the handler class of a configuration entry.
+
+    An entry is named after a class of HANDLERS_MAP, or names its base class
+    with a `class` key, in which case a subclass named after the entry is
+    created so that new handlers can be declared in the configuration alone.
+
+    Raises:
+        ValueError: If the class is not defined in HANDLERS_MAP.
+    """
+    class_name = details.get("class", handler_name)
+    if class_name not in HANDLERS_MAP:
+        raise ValueError(f"Handler '{class_name}' is not defined in HANDLERS_MAP")
+
+    handler_class = HANDLERS_MAP[class_name]
+    if class_name != handler_name:
+        handler_class = type(handler_name, (handler_class,), {})
+    return handler_class
+
+
+def projections_need_body_fields(config) -> bool:
+    """
+    Whether storage projections must keep the body fields, because body
+    compression or blob offload is enabled in the app config.
+    """
+    return bool(config.get("STORAGE_COMPRESSION") or config.get("BLOB_STORE"))
+
+
+def initialize_handler_registry_from_config(
+    config_file: str, body_fields_required: bool = False
+) -> HandlerRegistry:
     """
     Load handler configuration from a YAML file and initialize the handler registry.
 
     Args:
         config_file (str): Path to the configuration file.
+        body_fields_required (bool): Reject storage projections that rename or
+            drop the body fields.
 
     Returns:
         HandlerRegistry: An initialized handler registry.
@@ -106,11 +361,127 @@ def initialize_handler_registry_from_config(config_file: str) -> HandlerRegistry
     registry = HandlerRegistry()
 
     for handler_name, details in config.get("handlers", {}).items():
-        if handler_name not in HANDLERS_MAP:
-            raise ValueError(f"Handler '{handler_name}' is not defined in HANDLERS_MAP")
+        handler_class = build_handler_class(handler_name, details)
+        pipeline = compile_pipeline(details["steps"])
+        projection = compile_projection(
+            details.get("storage"), body_fields_required=body_fields_required
+        )
+        registry.add_handler(handler_class(pipeline=pipeline, projection=projection))
 
-        handler_class = HANDLERS_MAP[handler_name]
         for sender in details.get("senders", []):
             registry.register(sender, handler_class)
 
+    registry.compile()
     return registry
+
+
+class RegistryReloader:
+    """
+    Rebuild the handler registry when its configuration file changes.
+
+    A new registry is built off the request path and swapped into
+    app.config["handler_registry"] in a single assignment. Requests read the
+    registry once, so they see either the previous or the new snapshot, never
+    a half-built one, and lookups take no lock. A reload that fails keeps the
+    previous registry and records the error in `last_error`.
+
+    Each worker process runs its own reloader.
+    """
+
+    def __init__(self, app, path: str, interval: float = None):
+        self.app = app
+        self.path = path
+        self.interval = interval
+        self.loaded_at = time.time()
+        self.last_error = None
+        self._signature = self._file_signature()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="handler-config-reloader", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def reload(self) -> bool:
+        """
+        Build a new registry from the configuration file and swap it in.
+
+        Returns:
+            bool: True if the new registry is in use, False if the previous
+            one was kept because the configuration could not be loaded.
+        """
+        with self._lock:
+            signature = self._file_signature()
+            try:
+                registry = initialize_handler_registry_from_config(
+                    self.path, projections_need_body_fields(self.app.config)
+                )
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.error(
+                    f"Failed to reload handler config {self.path}, "
+                    f"keeping the previous registry: {self.last_error}"
+                )
+                # Do not retry until the file changes again
+                self._signature = signature
+                return False
+
+            self.app.config["handler_registry"] = registry
+            self._signature = signature
+            self.loaded_at = time.time()
+            self.last_error = None
+            logger.info(
+                f"Reloaded handler config {self.path}: {registry.rule_count} rules"
+            )
+            return True
+
+    def check(self) -> bool:
+        """
+        Reload the registry if the configuration file changed since the last
+        attempt.
+
+        Returns:
+            bool: True if a new registry was swapped in.
+        """
+        if self._file_signature() == self._signature:
+            return False
+        return self.reload()
+
+    def status(self) -> dict:
+        return {
+            "path": self.path,
+            "rules": self.app.config["handler_registry"].rule_count,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+        }
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.check()
+
+
+def get_registry_reloader(app):
+    return app.extensions.get("handler_registry_reloader")
+
+
+def init_app(app, config_path: str):
+    reloader = RegistryReloader(
+        app, config_path, interval=app.config.get("HANDLER_CONFIG_POLL_SECONDS")
+    )
+    app.extensions["handler_registry_reloader"] = reloader
+    if reloader.interval:
+        reloader.start()
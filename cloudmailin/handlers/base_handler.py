@@ -1,42 +1,89 @@
-from typing import List, Callable
-from flask import current_app
+import asyncio
+import logging
+from typing import List
 
 from cloudmailin.schemas import Email
+from cloudmailin.async_db import get_async_db
 from cloudmailin.db import get_db
+from cloudmailin.dedup import email_dedup_key
+from cloudmailin.handlers.pipeline import Pipeline, StepFunction
+from cloudmailin.handlers.projection import DEFAULT_PROJECTION, Projection
+from cloudmailin.tracing import span
 
-# Define a type alias for step functions
-StepFunction = Callable[[Email], Email]
+# Per-email lines, sampled separately through LOG_SAMPLING_RATES
+logger = logging.getLogger("cloudmailin.handlers")
 
 
 class BaseHandler:
     """
     Base handler for processing emails.
     Provides foundational functionality such as logging.
+
+    Handlers hold no per-email state, so a single instance can serve every
+    request. The steps are applied through a pipeline, either the one given
+    (e.g. compiled from handler_config.yaml) or one built from `steps`, and
+    the email is stored through a projection (email.model_dump() by default).
     """
 
     steps: List[StepFunction] = []
 
+    def __init__(self, pipeline: Pipeline = None, projection: Projection = None):
+        self.pipeline = pipeline if pipeline is not None else Pipeline(self.steps)
+        self.projection = projection or DEFAULT_PROJECTION
+
     def handle(self, email: Email) -> Email:
         """
         Handle an email object: Log a health-related message, apply all steps in sequence and Store in the database.
         """
         # Step 1: Log app health check message
-        current_app.logger.info(
-            f"[{self.__class__.__name__}] Processing email from {email.sender}"
+        logger.info(
+            "[%s] Processing email from %s", self.__class__.__name__, email.sender
         )
 
         # Pass the email model through each step
-        for step in self.steps:
-            email = step(email)
+        with span(self.__class__.__name__):
+            email = self.pipeline(email)
 
         # Step 3: Store email in database
         #        try:
         db = get_db()
-        db.store_email(email.model_dump())
-        current_app.logger.info(f"Email stored in database: {email.subject}")
+        with span("store_email"):
+            document_id = db.store_email(
+                self.projection(email), dedup_key=email_dedup_key(email)
+            )
+        email = email.model_copy(update={"document_id": document_id})
+        logger.info("Email stored in database: %s", email.subject)
         #        except Exception as e:
         #            current_app.logger.error(
         #                f"Failed to store email in database: {e}", exc_info=True
         #            )
 
         return email
+
+    async def ahandle(self, email: Email) -> Email:
+        """
+        Async variant of handle(), used by the ASGI app: async steps and the
+        storage write are awaited instead of blocking a worker thread.
+
+        Subclasses that override handle() keep their behaviour, their handle()
+        runs in a worker thread.
+        """
+        if type(self).handle is not BaseHandler.handle:
+            return await asyncio.to_thread(self.handle, email)
+
+        logger.info(
+            "[%s] Processing email from %s", self.__class__.__name__, email.sender
+        )
+
+        with span(self.__class__.__name__):
+            email = await self.pipeline.acall(email)
+
+        db = get_async_db()
+        with span("store_email"):
+            document_id = await db.store_email(
+                self.projection(email), dedup_key=email_dedup_key(email)
+            )
+        email = email.model_copy(update={"document_id": document_id})
+        logger.info("Email stored in database: %s", email.subject)
+
+        return email
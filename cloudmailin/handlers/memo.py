@@ -0,0 +1,176 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+# Attribute set by pure_step on the steps it declares pure
+PURE_STEP_ATTRIBUTE = "__pure_step__"
+
+
+def pure_step(reads: Iterable[str], writes: Iterable[str], version=None):
+    """
+    Declare a step deterministic: its result only depends on the `reads`
+    fields of the email (and on `version()`) and only changes its `writes`
+    fields.
+
+    Pipelines memoize pure steps, so identical emails (e.g. the thousands of
+    copies of a newsletter) run them once. Steps depending on state loaded
+    from configuration (e.g. rules files) pass a `version` callable returning
+    a hashable value identifying that state; it is part of the cache key, so
+    results are not shared across rule sets.
+    """
+    reads, writes = tuple(reads), tuple(writes)
+    if not reads or not writes:
+        raise ValueError("A pure step must read and write at least one field")
+
+    def decorator(step):
+        setattr(step, PURE_STEP_ATTRIBUTE, (reads, writes, version))
+        return step
+
+    return decorator
+
+
+class StepCache:
+    """
+    Bounded LRU cache of pure step results, with a time to live.
+
+    Entries are the values of the fields written by a step, keyed by the step,
+    its version and a BLAKE2b digest of the fields it read.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, max_entries: int, ttl: float):
+        """
+        Resize the cache, evicting the least recently used entries if needed.
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self.ttl = ttl
+            self._evict()
+
+    def get(self, key):
+        """
+        Cached value for the key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if self.ttl and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.max_entries:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+def digest_fields(values) -> bytes:
+    """
+    BLAKE2b digest of a sequence of field values.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        data = (
+            value.encode("utf-8", "surrogatepass")
+            if isinstance(value, str)
+            else repr(value).encode("utf-8")
+        )
+        # Length-prefixed, so that ("ab", "c") and ("a", "bc") differ
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.digest()
+
+
+class MemoizedStep:
+    """
+    Wrap a pure step so that its results are served from a StepCache.
+
+    A cached result is applied with a shallow model copy updating only the
+    written fields: the step does not run and the bodies are not copied.
+    """
+
+    __slots__ = ("step", "reads", "writes", "version", "cache")
+
+    def __init__(self, step, cache: StepCache):
+        self.step = step
+        self.reads, self.writes, self.version = getattr(step, PURE_STEP_ATTRIBUTE)
+        self.cache = cache
+
+    def __call__(self, email):
+        key = (
+            self.step,
+            self.version() if self.version is not None else None,
+            digest_fields([getattr(email, f) for f in self.reads]),
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return email.model_copy(update=cached)
+
+        result = self.step(email)
+        self.cache.put(key, {field: getattr(result, field) for field in self.writes})
+        return result
+
+
+# Process-wide cache shared by every pipeline
+default_step_cache = StepCache()
+
+
+def memoize(step, cache: StepCache = None):
+    """
+    Wrap the step in a MemoizedStep if it is declared pure.
+    """
+    if not hasattr(step, PURE_STEP_ATTRIBUTE):
+        return step
+    return MemoizedStep(step, cache or default_step_cache)
+
+
+def init_app(app):
+    default_step_cache.configure(
+        max_entries=app.config.get("STEP_CACHE_MAX_ENTRIES", 10000),
+        ttl=app.config.get("STEP_CACHE_TTL_SECONDS", 300.0),
+    )
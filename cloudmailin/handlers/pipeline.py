@@ -0,0 +1,134 @@
+import importlib
+import inspect
+from time import perf_counter
+from typing import Awaitable, Callable, Iterable, Union
+
+from cloudmailin.metrics import STEP_DURATION
+from cloudmailin.handlers.memo import StepCache, memoize
+from cloudmailin.schemas import Email
+from cloudmailin.tracing import span
+
+# Define a type alias for step functions (async steps return an awaitable)
+StepFunction = Callable[[Email], Union[Email, Awaitable[Email]]]
+
+
+def is_async_step(step) -> bool:
+    """
+    Whether the step is a coroutine function (or a callable object whose
+    __call__ is one).
+    """
+    return inspect.iscoroutinefunction(step) or inspect.iscoroutinefunction(
+        getattr(step, "__call__", None)
+    )
+
+
+class Pipeline:
+    """
+    An immutable sequence of step functions, applied in order to an email.
+
+    Pipelines are callables themselves, so a pipeline can be used as a step of
+    another one; nested pipelines are flattened when the outer one is built.
+    Pipelines can also be concatenated with `+`.
+
+    Steps declared with @pure_step are memoized in `cache` (the process-wide
+    step cache by default). Steps of nested and concatenated pipelines keep
+    the cache of the pipeline they come from.
+
+    Steps can be coroutine functions, e.g. to call another service without
+    blocking the event loop. Pipelines with async steps are applied with
+    `await pipeline.acall(email)`, which runs sync steps inline; calling them
+    synchronously raises TypeError. Async steps are not memoized.
+    """
+
+    __slots__ = ("steps", "_calls", "_names", "_async")
+
+    def __init__(self, steps: Iterable[StepFunction] = (), cache: StepCache = None):
+        flattened, calls = [], []
+        for step in steps:
+            if isinstance(step, Pipeline):
+                flattened.extend(step.steps)
+                calls.extend(step._calls)
+            elif callable(step):
+                flattened.append(step)
+                calls.append(step if is_async_step(step) else memoize(step, cache))
+            else:
+                raise ValueError(f"Pipeline step {step!r} is not callable")
+        self.steps = tuple(flattened)
+        self._async = tuple(is_async_step(step) for step in self.steps)
+        self._calls = tuple(calls)
+        self._names = tuple(
+            getattr(step, "__name__", type(step).__name__) for step in self.steps
+        )
+
+    @property
+    def is_async(self) -> bool:
+        return any(self._async)
+
+    def __call__(self, email: Email) -> Email:
+        if self.is_async:
+            raise TypeError(f"{self!r} has async steps: use `await pipeline.acall()`")
+        for name, step in zip(self._names, self._calls):
+            started = perf_counter()
+            with span(name):
+                email = step(email)
+            STEP_DURATION.observe(perf_counter() - started, name)
+        return email
+
+    async def acall(self, email: Email) -> Email:
+        for name, step, is_async in zip(self._names, self._calls, self._async):
+            started = perf_counter()
+            with span(name):
+                email = await step(email) if is_async else step(email)
+            STEP_DURATION.observe(perf_counter() - started, name)
+        return email
+
+    def __add__(self, other: "Pipeline") -> "Pipeline":
+        return Pipeline((self, other))
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Pipeline) and self.steps == other.steps
+
+    def __hash__(self) -> int:
+        return hash(self.steps)
+
+    def __repr__(self) -> str:
+        names = ", ".join(getattr(step, "__name__", repr(step)) for step in self.steps)
+        return f"Pipeline([{names}])"
+
+
+def resolve_step(path: str) -> StepFunction:
+    """
+    Import a step function (or a pipeline) from its dotted path, e.g.
+    "cloudmailin.handlers.steps.assign_campaign_type".
+
+    Raises:
+        ValueError: If the path cannot be imported or is not callable.
+    """
+    if not isinstance(path, str) or "." not in path:
+        raise ValueError(f"Invalid step '{path}': expected a dotted import path")
+
+    module_name, _, attribute = path.rpartition(".")
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise ValueError(f"Invalid step '{path}': {e}")
+
+    step = getattr(module, attribute, None)
+    if step is None:
+        raise ValueError(f"Invalid step '{path}': '{module_name}' has no '{attribute}'")
+    if not callable(step):
+        raise ValueError(f"Invalid step '{path}': not callable")
+    return step
+
+
+def compile_pipeline(paths: Iterable[str]) -> Pipeline:
+    """
+    Resolve a list of dotted step paths into a pipeline.
+
+    Raises:
+        ValueError: If a step cannot be resolved.
+    """
+    return Pipeline(resolve_step(path) for path in paths)
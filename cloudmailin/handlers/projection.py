@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+from typing import Dict, Iterable
+
+from cloudmailin.payload import BODY_FIELDS
+from cloudmailin.schemas import Email
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+class Projection:
+    """
+    Compiled serializer turning an Email into the document to store.
+
+    Picks the `fields` (all the dumped fields by default) minus `exclude`,
+    renamed with `rename`, and optionally adds the date as integer epoch
+    milliseconds under `epoch_millis`. Values are read with a single
+    attrgetter and kept as Firestore-native types (datetime for timestamps),
+    without going through model_dump(). The default projection produces the
+    same document as email.model_dump().
+    """
+
+    __slots__ = ("fields", "keys", "epoch_millis", "_getter")
+
+    def __init__(
+        self,
+        fields: Iterable[str] = None,
+        exclude: Iterable[str] = (),
+        rename: Dict[str, str] = None,
+        epoch_millis: str = None,
+    ):
+        rename = rename or {}
+        exclude = tuple(exclude)
+        known = Email.model_fields
+        for field in (*(fields or ()), *exclude, *rename):
+            if field not in known:
+                raise ValueError(f"Unknown email field '{field}' in storage projection")
+
+        if fields is None:
+            fields = [name for name, info in known.items() if not info.exclude]
+        self.fields = tuple(field for field in fields if field not in exclude)
+        self.keys = tuple(rename.get(field, field) for field in self.fields)
+        if len(set(self.keys)) != len(self.keys):
+            raise ValueError("Storage projection maps two fields to the same name")
+        self.epoch_millis = epoch_millis
+
+        if len(self.fields) == 1:
+            # attrgetter of a single attribute returns the value, not a tuple
+            field = self.fields[0]
+            self._getter = lambda email: (getattr(email, field),)
+        else:
+            self._getter = attrgetter(*self.fields)
+
+    @property
+    def keeps_body_fields(self) -> bool:
+        """
+        Whether the plain and html bodies are stored under their own names.
+        """
+        stored = dict(zip(self.fields, self.keys))
+        return all(stored.get(field) == field for field in BODY_FIELDS)
+
+    def __call__(self, email: Email) -> dict:
+        document = dict(zip(self.keys, self._getter(email))) if self.fields else {}
+        if self.epoch_millis:
+            document[self.epoch_millis] = (email.date - EPOCH) // MILLISECOND
+        return document
+
+
+DEFAULT_PROJECTION = Projection()
+
+
+def compile_projection(spec: dict, body_fields_required: bool = False) -> Projection:
+    """
+    Compile the `storage` section of a handler configuration.
+
+    With `body_fields_required` (body compression or blob offload enabled,
+    which find the bodies by name), projections must store the plain and
+    html bodies under their own names.
+
+    Raises:
+        ValueError: If the section is malformed, names unknown fields, stores
+            `epoch_millis` under the name of a projected field or renames or
+            drops a required body field.
+    """
+    if spec is None:
+        return DEFAULT_PROJECTION
+    if not isinstance(spec, dict) or not set(spec) <= {
+        "fields",
+        "exclude",
+        "rename",
+        "epoch_millis",
+    }:
+        raise ValueError(
+            "Invalid storage projection: expected a dictionary with 'fields', "
+            "'exclude', 'rename' and 'epoch_millis' keys."
+        )
+    for key, expected in (("fields", list), ("exclude", list), ("rename", dict)):
+        if key in spec and not isinstance(spec[key], expected):
+            raise ValueError(
+                f"Invalid storage projection: '{key}' must be a {expected.__name__}."
+            )
+    epoch_millis = spec.get("epoch_millis")
+    if epoch_millis is not None and (
+        not isinstance(epoch_millis, str) or not epoch_millis
+    ):
+        raise ValueError(
+            "Invalid storage projection: 'epoch_millis' must be a non-empty string."
+        )
+    projection = Projection(
+        fields=spec.get("fields"),
+        exclude=spec.get("exclude", ()),
+        rename=spec.get("rename"),
+        epoch_millis=epoch_millis,
+    )
+    if epoch_millis in projection.keys:
+        raise ValueError(
+            f"Invalid storage projection: 'epoch_millis' ({epoch_millis}) would "
+            "overwrite a projected field of the same name."
+        )
+    if body_fields_required and not projection.keeps_body_fields:
+        raise ValueError(
+            "Invalid storage projection: 'plain' and 'html' must be stored under "
+            "their own names while STORAGE_COMPRESSION or BLOB_STORE is enabled."
+        )
+    return projection
@@ -1,15 +1,22 @@
+from cloudmailin.classifier import get_campaign_classifier
+from cloudmailin.handlers.memo import pure_step
 from cloudmailin.schemas import Email
 
 
+# Results depend on the loaded campaign rules too: the classifier is part of
+# the cache key (it is loaded once per CAMPAIGN_RULES_PATH)
+@pure_step(
+    reads=("subject", "plain", "html"),
+    writes=("campaign_type",),
+    version=get_campaign_classifier,
+)
 def assign_campaign_type(email: Email) -> Email:
     """
     Step function to classify the email and assign a campaign type.
+
+    The campaign rules (config/campaign_rules.yaml by default) are compiled
+    once into a keyword matcher that scans each field in a single pass.
     """
-    if "sale" in email.subject.lower():
-        campaign_type = "promotion"
-    #    elif "newsletter" in email.subject.lower():
-    #        campaign_type = "newsletter"
-    else:
-        campaign_type = "unclassified"
+    campaign_type = get_campaign_classifier().classify(email)
 
     return email.model_copy(update={"campaign_type": campaign_type})
@@ -0,0 +1,264 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from flask import current_app, g, request
+
+from cloudmailin.dedup import document_id_for, email_dedup_key
+from cloudmailin.handlers.memo import digest_fields
+from cloudmailin.schemas import Email
+
+
+class IdempotencyConflict(Exception):
+    """
+    Raised when a request waited too long for the in-flight request with the
+    same idempotency key.
+    """
+
+
+class IdempotencyKeyReused(Exception):
+    """
+    Raised when an idempotency key is reused for a request with a different
+    payload.
+    """
+
+
+class IdempotentResult(NamedTuple):
+    """
+    Outcome of processing an email, as replayed to its duplicates.
+
+    Only the fields changed by the handler are kept, so the bodies of the
+    email are not held in the store.
+    """
+
+    handler_name: str
+    status: str
+    status_code: int
+    changes: dict
+
+
+class _Call:
+    __slots__ = (
+        "done",
+        "result",
+        "failed",
+        "expires_at",
+        "fingerprint",
+        "async_waiters",
+    )
+
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.expires_at = None
+        # (event loop, future) of the coroutines waiting for the call
+        self.async_waiters = []
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class IdempotencyStore:
+    """
+    Single-flight execution per idempotency key.
+
+    The first request with a key runs; concurrent requests with the same key
+    wait for its result instead of running again. Results are kept for `ttl`
+    seconds, in a store bounded to `max_entries` keys (least recently used
+    completed keys are evicted first). When the running request fails,
+    nothing is cached and one of the waiting requests runs instead.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, key: str, function, wait_timeout: float = None, fingerprint=None):
+        """
+        Run function once per key.
+
+        `fingerprint` identifies the payload of the request: a key reused
+        with another fingerprint is rejected instead of replayed.
+
+        Returns:
+            tuple: The result, and whether it was replayed from another request.
+
+        Raises:
+            IdempotencyConflict: If the in-flight request with the same key did
+                not finish within wait_timeout seconds.
+            IdempotencyKeyReused: If the key is known with another fingerprint.
+        """
+        while True:
+            call, leader = self._claim(key, fingerprint)
+            if leader:
+                try:
+                    result = function()
+                except BaseException:
+                    self._fail(key, call)
+                    raise
+                return self._complete(call, result), False
+
+            if not call.done.wait(wait_timeout):
+                raise IdempotencyConflict(key)
+            if not call.failed:
+                return call.result, True
+
+    async def arun(
+        self, key: str, function, wait_timeout: float = None, fingerprint=None
+    ):
+        """
+        Like run(), for a coroutine function. Requests are single-flighted
+        with the sync ones sharing the store.
+        """
+        while True:
+            call, leader = self._claim(key, fingerprint)
+            if leader:
+                try:
+                    result = await function()
+                except BaseException:
+                    self._fail(key, call)
+                    raise
+                return self._complete(call, result), False
+
+            if not await self._wait_async(call, wait_timeout):
+                raise IdempotencyConflict(key)
+            if not call.failed:
+                return call.result, True
+
+    async def _wait_async(self, call: _Call, timeout: float = None) -> bool:
+        """
+        Wait for a call on the event loop, without taking a thread.
+
+        Returns:
+            bool: False if the call did not finish within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            if call.done.is_set():
+                return True
+            call.async_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                if waiter in call.async_waiters:
+                    call.async_waiters.remove(waiter)
+
+    def _claim(self, key: str, fingerprint=None) -> tuple:
+        """
+        The call of the key, and whether this request leads it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if (
+                call is not None
+                and call.done.is_set()
+                and call.expires_at < time.monotonic()
+            ):
+                del self._calls[key]
+                call = None
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(fingerprint)
+            else:
+                self._calls.move_to_end(key)
+        if not leader and call.fingerprint != fingerprint:
+            raise IdempotencyKeyReused(key)
+        return call, leader
+
+    def _fail(self, key: str, call: _Call):
+        call.failed = True
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        self._finish(call)
+
+    def _complete(self, call: _Call, result):
+        call.result = result
+        call.expires_at = time.monotonic() + self.ttl
+        self._finish(call)
+        with self._lock:
+            self._evict()
+        return result
+
+    def _finish(self, call: _Call):
+        """
+        Wake up the requests waiting for a call, on threads and event loops.
+        """
+        with self._lock:
+            call.done.set()
+            waiters, call.async_waiters = call.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _evict(self):
+        # In-flight calls are never evicted, their waiters need them
+        excess = len(self._calls) - self.max_entries
+        if excess <= 0:
+            return
+        completed = [key for key, call in self._calls.items() if call.done.is_set()]
+        for key in completed[:excess]:
+            del self._calls[key]
+
+
+def get_idempotency_key(email) -> str:
+    """
+    Idempotency key of the current request: the Idempotency-Key header or,
+    when IDEMPOTENCY_DERIVED_KEYS is set, a key derived from the email.
+    Keys are scoped to the Firestore collection of the request.
+
+    Returns:
+        str: The key, or None if the request is not idempotent.
+    """
+    key = request.headers.get("Idempotency-Key")
+    if key:
+        key = f"header:{key}"
+    elif current_app.config.get("IDEMPOTENCY_DERIVED_KEYS"):
+        key = f"email:{document_id_for(email_dedup_key(email))}"
+    else:
+        return None
+    return f"{getattr(g, 'firestore_collection', None) or ''}\0{key}"
+
+
+def payload_fingerprint(email: Email) -> bytes:
+    """
+    Digest of every field of an email, hashed without serializing it.
+    """
+    return digest_fields(getattr(email, field) for field in Email.model_fields)
+
+
+def get_idempotency_fingerprint(email: Email) -> bytes:
+    """
+    Fingerprint of the payload of the current request, or None when its key
+    is derived from the email, which the key already identifies.
+    """
+    if not request.headers.get("Idempotency-Key"):
+        return None
+    return payload_fingerprint(email)
+
+
+def get_idempotency_store(app=None) -> IdempotencyStore:
+    app = app or current_app
+    return app.extensions["idempotency_store"]
+
+
+def init_app(app):
+    app.extensions["idempotency_store"] = IdempotencyStore(
+        ttl=app.config.get("IDEMPOTENCY_WINDOW_SECONDS", 300.0),
+        max_entries=app.config.get("IDEMPOTENCY_MAX_KEYS", 10000),
+    )
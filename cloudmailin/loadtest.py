@@ -0,0 +1,395 @@
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, UTC
+from email.utils import format_datetime
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+DEFAULT_SENDERS = {
+    "newsletter@example.com": 3,
+    "promo@example.com": 2,
+    "*@example.org": 5,
+}
+
+DEFAULT_VOCABULARY = (
+    "sale offer discount weekly newsletter update account invoice order "
+    "shipping delivery summer winter deals exclusive members free new "
+    "product launch event webinar reminder receipt payment security alert "
+    "report digest community news tips guide limited time only today"
+).split()
+
+
+class PayloadSynthesizer:
+    """
+    Generate CloudMailin-shaped JSON payloads.
+
+    Senders are drawn from a weighted mix, where "*@domain" stands for random
+    addresses of the domain. Subjects are 3 to 8 words of the vocabulary and
+    body sizes follow a log-normal distribution around `body_size_median`
+    bytes, the long tail standing for the occasional huge newsletter.
+    """
+
+    def __init__(
+        self,
+        senders: dict = None,
+        vocabulary: list = None,
+        body_size_median: int = 2048,
+        body_size_sigma: float = 1.0,
+        max_body_size: int = 1024 * 1024,
+        seed: int = None,
+    ):
+        senders = senders or DEFAULT_SENDERS
+        self.senders = list(senders)
+        self.weights = [float(weight) for weight in senders.values()]
+        self.vocabulary = list(vocabulary or DEFAULT_VOCABULARY)
+        if not self.vocabulary:
+            raise ValueError("The subject vocabulary is empty")
+        self.body_size_median = body_size_median
+        self.body_size_sigma = body_size_sigma
+        self.max_body_size = max_body_size
+        self._random = random.Random(seed)
+
+        # Bodies are slices of one corpus, so generating them stays cheap
+        words = []
+        length = 0
+        while length < max_body_size * 2:
+            word = self._random.choice(self.vocabulary)
+            words.append(word)
+            length += len(word) + 1
+        self._corpus = " ".join(words)
+
+    def sender(self) -> str:
+        sender = self._random.choices(self.senders, self.weights)[0]
+        if sender.startswith("*@"):
+            return f"user{self._random.randrange(100000)}{sender[1:]}"
+        return sender
+
+    def subject(self) -> str:
+        length = self._random.randint(3, 8)
+        return " ".join(self._random.choices(self.vocabulary, k=length)).capitalize()
+
+    def body_size(self) -> int:
+        size = self._random.lognormvariate(
+            math.log(self.body_size_median), self.body_size_sigma
+        )
+        return max(1, min(int(size), self.max_body_size))
+
+    def body(self) -> str:
+        size = self.body_size()
+        start = self._random.randrange(len(self._corpus) - size)
+        end = start + size
+        return self._corpus[start:end]
+
+    def payload(self) -> dict:
+        sender = self.sender()
+        plain = self.body()
+        return {
+            "envelope": {"from": sender, "to": "inbox@cloudmailin.net"},
+            "headers": {
+                "subject": self.subject(),
+                "date": format_datetime(datetime.now(UTC)),
+                "message_id": f"<{uuid.uuid4().hex}@{sender.rpartition('@')[2]}>",
+            },
+            "plain": plain,
+            "html": f"<html><body><p>{plain}</p></body></html>",
+        }
+
+
+class LoadReport(NamedTuple):
+    requests: int
+    elapsed: float
+    latencies_ms: list
+    statuses: Counter
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def errors(self) -> int:
+        return sum(
+            count
+            for status, count in self.statuses.items()
+            if not isinstance(status, int) or status >= 400
+        )
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """
+        Latency under which `percent` percent of the requests completed, in
+        milliseconds (nearest rank).
+        """
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def format(self) -> str:
+        lines = [
+            f"requests:   {self.requests} in {self.elapsed:.1f}s",
+            f"throughput: {self.throughput:.1f} req/s",
+            f"latency:    p50 {self.percentile(50):.1f} ms, "
+            f"p95 {self.percentile(95):.1f} ms, p99 {self.percentile(99):.1f} ms",
+            f"errors:     {self.errors} ({self.error_rate:.2%})",
+        ]
+        for status, count in sorted(self.statuses.items(), key=str):
+            lines.append(f"  {status}: {count}")
+        return "\n".join(lines)
+
+
+class HttpSender:
+    """
+    POST payloads to an instance, over one keep-alive connection per thread.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.https = parts.scheme == "https"
+        self.path = parts.path or "/generic/new"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = (
+                http.client.HTTPSConnection
+                if self.https
+                else http.client.HTTPConnection
+            )
+            connection = self._local.connection = connection_class(
+                self.host, self.port, timeout=self.timeout
+            )
+        return connection
+
+    def __call__(self, payload: dict):
+        """
+        Send one payload; returns the status code, or the name of the
+        exception for requests that got no response.
+        """
+        body = json.dumps(payload)
+        connection = self._connection()
+        try:
+            connection.request(
+                "POST", self.path, body, {"Content-Type": "application/json"}
+            )
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            self._local.connection = None
+            return type(e).__name__
+
+
+def run_load(
+    send,
+    make_payload,
+    concurrency: int = 8,
+    rps: float = None,
+    duration: float = 10.0,
+    requests: int = None,
+) -> LoadReport:
+    """
+    Drive `send` with generated payloads until `duration` seconds passed or
+    `requests` requests were sent.
+
+    Without `rps` every worker sends its next request as soon as the previous
+    one completes (closed loop). With `rps` requests are started on a fixed
+    schedule (open loop) and latencies are measured from their scheduled time,
+    so a stalled server is not hidden by requests that were never sent.
+    """
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration if duration else None
+    counter = iter(range(requests)) if requests else None
+
+    def claim() -> bool:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        return counter is None or next(counter, None) is not None
+
+    def record(started: float, status):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            statuses[status] += 1
+
+    def send_one(payload, started: float):
+        try:
+            status = send(payload)
+        except Exception as e:
+            status = type(e).__name__
+        record(started, status)
+
+    started = time.perf_counter()
+    if rps:
+        with ThreadPoolExecutor(concurrency) as pool:
+            index = 0
+            while claim():
+                scheduled = started + index / rps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send_one, make_payload(), scheduled)
+                index += 1
+    else:
+
+        def worker():
+            while claim():
+                payload = make_payload()
+                send_one(payload, time.perf_counter())
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return LoadReport(
+        len(latencies), time.perf_counter() - started, latencies, statuses
+    )
+
+
+def parse_senders(values) -> dict:
+    """
+    Parse "address=weight" options into a sender mix.
+
+    Raises:
+        ValueError: If a weight is not a positive number.
+    """
+    senders = {}
+    for value in values:
+        sender, _, weight = value.partition("=")
+        try:
+            senders[sender] = float(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid sender weight: {value}")
+        if senders[sender] <= 0:
+            raise ValueError(f"Invalid sender weight: {value}")
+    return senders
+
+
+def serve_locally(app):
+    """
+    Serve the app on a free local port from a background thread.
+    """
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@click.command("loadtest")
+@click.option("--url", help="Endpoint to load; serves this app locally when omitted.")
+@click.option("--concurrency", default=8, show_default=True, help="Parallel requests.")
+@click.option("--rps", type=float, help="Target requests per second (open loop).")
+@click.option("--duration", default=10.0, show_default=True, help="Seconds to run.")
+@click.option("--requests", "request_count", type=int, help="Stop after N requests.")
+@click.option(
+    "--sender",
+    "senders",
+    multiple=True,
+    help='Sender mix entry "address=weight"; "*@domain" for random addresses.',
+)
+@click.option(
+    "--vocabulary",
+    type=click.File(),
+    help="File with the words of generated subjects and bodies.",
+)
+@click.option("--body-size-median", default=2048, show_default=True)
+@click.option("--body-size-sigma", default=1.0, show_default=True)
+@click.option(
+    "--firestore-latency-ms",
+    default=20.0,
+    show_default=True,
+    help="Latency of the in-memory Firestore when serving locally.",
+)
+@click.option("--firestore-jitter-ms", default=5.0, show_default=True)
+@click.option("--firestore-error-rate", default=0.0, show_default=True)
+@click.option("--seed", type=int, help="Seed of the payload generator.")
+@with_appcontext
+def loadtest_command(
+    url,
+    concurrency,
+    rps,
+    duration,
+    request_count,
+    senders,
+    vocabulary,
+    body_size_median,
+    body_size_sigma,
+    firestore_latency_ms,
+    firestore_jitter_ms,
+    firestore_error_rate,
+    seed,
+):
+    """Send synthesized CloudMailin payloads and report latency and errors."""
+    from cloudmailin.db import close_client_pool
+
+    try:
+        synthesizer = PayloadSynthesizer(
+            senders=parse_senders(senders) if senders else None,
+            vocabulary=vocabulary.read().split() if vocabulary else None,
+            body_size_median=body_size_median,
+            body_size_sigma=body_size_sigma,
+            seed=seed,
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    server = None
+    if not url:
+        app = current_app._get_current_object()
+        # Storage is simulated, so the test runs offline
+        close_client_pool(app)
+        app.config.update(
+            STORAGE_BACKEND="memory",
+            MEMORY_STORAGE_LATENCY_MS=firestore_latency_ms,
+            MEMORY_STORAGE_JITTER_MS=firestore_jitter_ms,
+            MEMORY_STORAGE_ERROR_RATE=firestore_error_rate,
+        )
+        if not app.config.get("FIRESTORE_COLLECTION"):
+            app.config["FIRESTORE_COLLECTION"] = "loadtest_emails"
+        server = serve_locally(app)
+        url = f"http://127.0.0.1:{server.server_port}/generic/new"
+        click.echo(f"Serving the app locally at {url}")
+
+    try:
+        report = run_load(
+            HttpSender(url),
+            synthesizer.payload,
+            concurrency=concurrency,
+            rps=rps,
+            duration=None if request_count else duration,
+            requests=request_count,
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    click.echo(report.format())
+
+
+def init_app(app):
+    app.cli.add_command(loadtest_command)
@@ -0,0 +1,432 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Blueprint, Response, abort, current_app, g, request
+
+logger = logging.getLogger("cloudmailin")
+
+bp = Blueprint("metrics", __name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SNAPSHOT_PATTERN = re.compile(r"^metrics-(\d+)\.json$")
+
+# Seconds, from a cached lookup to a slow Firestore commit
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Bytes, from a one-line notification to a message with attachments
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(10))
+
+
+class Metric:
+    """
+    A metric whose samples are sharded per thread.
+
+    Each thread updates its own dict of samples, so recording never takes a
+    lock; the lock is only taken once per thread, to register its shard.
+    Collecting sums the shards, which are kept after their thread ends.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _shard_samples(self):
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict.copy() is atomic, unlike iterating over a dict being updated
+            yield from shard.copy().items()
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.clear()
+
+    def describe(self) -> dict:
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+        }
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value per label set.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def collect(self) -> dict:
+        samples = {}
+        for labels, value in self._shard_samples():
+            samples[labels] = samples.get(labels, 0.0) + value
+        return samples
+
+
+class Histogram(Metric):
+    """
+    Observations counted in buckets per label set.
+
+    Each label set holds the count of every bucket (not cumulative, the last
+    one being +Inf) followed by the sum of the observations.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> dict:
+        samples = {}
+        for labels, counts in self._shard_samples():
+            merged = samples.get(labels)
+            if merged is None:
+                samples[labels] = list(counts)
+            else:
+                samples[labels] = [a + b for a, b in zip(merged, counts)]
+        return samples
+
+    def describe(self) -> dict:
+        return {**super().describe(), "buckets": list(self.buckets)}
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        """
+        JSON-serializable copy of every metric and its samples.
+        """
+        return {
+            name: {
+                **metric.describe(),
+                "samples": [
+                    [list(labels), value] for labels, value in metric.collect().items()
+                ],
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "cloudmailin_request_duration_seconds",
+    "Time spent serving HTTP requests.",
+    ("method", "route", "status", "handler"),
+)
+STEP_DURATION = REGISTRY.histogram(
+    "cloudmailin_step_duration_seconds",
+    "Time spent in each pipeline step.",
+    ("step",),
+)
+STORAGE_WRITE_DURATION = REGISTRY.histogram(
+    "cloudmailin_storage_write_duration_seconds",
+    "Time spent writing emails to Firestore.",
+    ("mode",),
+)
+STORAGE_WRITE_ERRORS = REGISTRY.counter(
+    "cloudmailin_storage_write_errors_total",
+    "Failed writes of emails to Firestore.",
+    ("mode",),
+)
+PAYLOAD_SIZE = REGISTRY.histogram(
+    "cloudmailin_payload_size_bytes",
+    "Size of the request bodies received.",
+    ("route",),
+    buckets=SIZE_BUCKETS,
+)
+REQUEST_PEAK_MEMORY = REGISTRY.histogram(
+    "cloudmailin_request_peak_memory_bytes",
+    "Peak Python memory allocated while serving a request (with "
+    "REQUEST_MEMORY_PROFILING).",
+    ("route",),
+    buckets=SIZE_BUCKETS,
+)
+VALIDATION_FAILURES = REGISTRY.counter(
+    "cloudmailin_validation_failures_total",
+    "Payloads rejected because they are not valid emails.",
+    ("route", "reason"),
+)
+REGISTRY_LOOKUPS = REGISTRY.counter(
+    "cloudmailin_registry_lookups_total",
+    "Handler lookups by sender, by whether a configured handler matched.",
+    ("result",),
+)
+
+
+# --- Multi-process aggregation --- #
+
+
+def write_snapshot(directory: str, registry: MetricsRegistry = REGISTRY):
+    """
+    Atomically write the metrics of this process to the shared directory.
+    """
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    # The flusher and a scrape may write at the same time
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory: str) -> list:
+    """
+    Snapshots written by every process, including those that have exited, so
+    that the merged counters never go backwards.
+    """
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if not SNAPSHOT_PATTERN.match(name):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics snapshot {name}: {e}")
+    return snapshots
+
+
+def merge_snapshots(snapshots: list) -> dict:
+    """
+    Sum the samples of the same metric and label set across snapshots.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})["samples"]
+            for labels, value in metric["samples"]:
+                labels = tuple(labels)
+                if labels not in target:
+                    target[labels] = value
+                elif isinstance(value, list):
+                    target[labels] = [a + b for a, b in zip(target[labels], value)]
+                else:
+                    target[labels] += value
+    for metric in merged.values():
+        metric["samples"] = list(metric["samples"].items())
+    return merged
+
+
+class MetricsFlusher:
+    """
+    Background thread writing the snapshot of this process every `interval`
+    seconds, and once more when the process exits.
+    """
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-flusher", daemon=True
+        )
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        try:
+            write_snapshot(self.directory)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.flush()
+
+
+# --- Exposition --- #
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_number(value) -> str:
+    return repr(float(value))
+
+
+def render(snapshot: dict) -> str:
+    """
+    Render a (merged) snapshot in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {_escape(metric['help'])}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labels, value in sorted(metric["samples"], key=lambda s: list(s[0])):
+            if metric["type"] == "counter":
+                lines.append(
+                    f"{name}{_format_labels(labelnames, labels)} {_format_number(value)}"
+                )
+                continue
+
+            bounds = [_format_number(bound) for bound in metric["buckets"]] + ["+Inf"]
+            cumulative = 0
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels([*labelnames, "le"], [*labels, bound])
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            series = _format_labels(labelnames, labels)
+            lines.append(f"{name}_sum{series} {_format_number(value[-1])}")
+            lines.append(f"{name}_count{series} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Expose the metrics of this worker, or of every worker sharing
+    METRICS_MULTIPROC_DIR, in the Prometheus text format.
+    """
+    if not current_app.config.get("METRICS_ENABLED", False):
+        abort(404)
+
+    directory = current_app.config.get("METRICS_MULTIPROC_DIR")
+    if directory:
+        write_snapshot(directory)
+        snapshot = merge_snapshots(read_snapshots(directory))
+    else:
+        snapshot = merge_snapshots([REGISTRY.snapshot()])
+    return Response(render(snapshot), mimetype=CONTENT_TYPE)
+
+
+# --- Request instrumentation --- #
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.content_length:
+        PAYLOAD_SIZE.observe(request.content_length, request_route())
+
+
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            request.method,
+            request_route(),
+            str(response.status_code),
+            g.get("handler_name", ""),
+        )
+    return response
+
+
+def request_route() -> str:
+    """
+    Route rule of the current request, the "route" label of the metrics.
+    """
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def init_app(app):
+    if not app.config.get("METRICS_ENABLED", False):
+        return
+
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+
+    directory = app.config.get("METRICS_MULTIPROC_DIR")
+    if directory:
+        flusher = MetricsFlusher(
+            directory, interval=app.config.get("METRICS_FLUSH_SECONDS", 5.0)
+        )
+        app.extensions["metrics_flusher"] = flusher
+        flusher.start()
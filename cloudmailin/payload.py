@@ -0,0 +1,110 @@
+import threading
+import tracemalloc
+
+from flask import current_app, g, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from cloudmailin.metrics import REQUEST_PEAK_MEMORY, request_route
+
+# Body fields of a CloudMailin payload that can grow arbitrarily large
+BODY_FIELDS = ("plain", "html")
+
+# Requests currently measured by the memory profiler, and whether the
+# profiler started tracemalloc (rather than PYTHONTRACEMALLOC)
+_profiled_requests = 0
+_started_tracing = False
+_profiler_lock = threading.Lock()
+
+
+def read_json_payload(max_field_length: int = None):
+    """
+    Parse the JSON body of the current request without caching it.
+
+    Flask caches both the raw body and the parsed JSON on the request by
+    default; neither is needed once the email is built, so the raw bytes are
+    released as soon as they are parsed.
+
+    Raises:
+        RequestEntityTooLarge: If a body field exceeds max_field_length characters.
+    """
+    data = request.get_json(cache=False)
+    if max_field_length and isinstance(data, dict):
+        check_body_fields(data, max_field_length)
+    return data
+
+
+def check_body_fields(data: dict, max_field_length: int):
+    """
+    Reject payloads whose plain or html body exceeds max_field_length characters.
+    """
+    for field in BODY_FIELDS:
+        value = data.get(field)
+        if isinstance(value, str) and len(value) > max_field_length:
+            raise RequestEntityTooLarge(
+                f"Field '{field}' exceeds the maximum length of {max_field_length}."
+            )
+
+
+def handle_request_entity_too_large(error):
+    """
+    Reply to oversized requests with a JSON 413 instead of Werkzeug's HTML page.
+    """
+    return jsonify({"error": "Payload Too Large", "details": error.description}), 413
+
+
+def start_memory_profiling():
+    """
+    Start measuring the peak Python memory of the request.
+
+    tracemalloc only runs while requests are measured: it slows allocations
+    down and takes memory of its own.
+    """
+    global _profiled_requests, _started_tracing
+    with _profiler_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        # Only reset the peak when no other request is being measured, so a
+        # concurrent request never loses its own peak
+        if _profiled_requests == 0:
+            tracemalloc.reset_peak()
+        _profiled_requests += 1
+    g.memory_baseline = tracemalloc.get_traced_memory()[0]
+
+
+def stop_memory_profiling(error=None):
+    """
+    Record the peak memory of the request, relative to its start, in the
+    cloudmailin_request_peak_memory_bytes histogram and the logs.
+
+    With concurrent requests the peak is shared, so the value is an upper
+    bound of what a single request needs.
+    """
+    global _profiled_requests, _started_tracing
+    baseline = g.pop("memory_baseline", None)
+    if baseline is None:
+        return
+
+    with _profiler_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _profiled_requests -= 1
+        if _profiled_requests == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+    g.peak_memory_bytes = max(peak - baseline, 0)
+    REQUEST_PEAK_MEMORY.observe(g.peak_memory_bytes, request_route())
+    current_app.logger.info(
+        "Request peak memory: %s bytes for %s %s",
+        g.peak_memory_bytes,
+        request.method,
+        request.path,
+    )
+
+
+def init_app(app):
+    app.register_error_handler(RequestEntityTooLarge, handle_request_entity_too_large)
+
+    if app.config.get("REQUEST_MEMORY_PROFILING"):
+        app.before_request(start_memory_profiling)
+        app.teardown_request(stop_memory_profiling)
@@ -1,11 +1,20 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr, model_validator, Field
+from typing import Annotated, Optional
+from pydantic import AfterValidator, BaseModel, WithJsonSchema, model_validator, Field
 from datetime import datetime
 
+from cloudmailin.validators import normalize_email_address, parse_rfc2822_date
+
+# Same validation and normalization as pydantic's EmailStr, cached per address
+EmailAddress = Annotated[
+    str,
+    AfterValidator(normalize_email_address),
+    WithJsonSchema({"type": "string", "format": "email"}),
+]
+
 
 class Email(BaseModel):
-    sender: EmailStr = Field(default=..., description="Email address of the sender")
-    recipient: EmailStr = Field(
+    sender: EmailAddress = Field(default=..., description="Email address of the sender")
+    recipient: EmailAddress = Field(
         default=..., description="Email address of the recipient"
     )
     subject: str = Field(default=..., description="Subject line of the email")
@@ -14,7 +23,13 @@ class Email(BaseModel):
         default=..., description="Body of the email in plain text format"
     )
     html: str = Field(default=..., description="Body of the email in html format")
+    message_id: Optional[str] = Field(
+        None, description="Message-ID header of the email"
+    )
     campaign_type: Optional[str] = Field(None, description="Type of campaign")
+    document_id: Optional[str] = Field(
+        None, exclude=True, description="Id of the stored database document"
+    )
 
     @staticmethod
     def flatten_payload(values: dict) -> dict:
@@ -24,7 +39,7 @@ class Email(BaseModel):
         envelope = values.get("envelope", {})
         headers = values.get("headers", {})
 
-        return {
+        flattened = {
             "sender": envelope.get("from"),
             "recipient": envelope.get("to"),
             "subject": headers.get("subject"),
@@ -32,6 +47,10 @@ class Email(BaseModel):
             "html": values.get("html"),
             "date": headers.get("date"),
         }
+        # Optional, used to recognize retried deliveries
+        if headers.get("message_id"):
+            flattened["message_id"] = headers["message_id"]
+        return flattened
 
     @model_validator(mode="before")
     @classmethod
@@ -49,9 +68,7 @@ class Email(BaseModel):
 
         # Parse the date
         try:
-            flattened["date"] = datetime.strptime(
-                flattened["date"], "%a, %d %b %Y %H:%M:%S %z"
-            )
+            flattened["date"] = parse_rfc2822_date(flattened["date"])
         except (ValueError, TypeError):
             raise ValueError(f"Invalid date format: {flattened.get('date')}")
 
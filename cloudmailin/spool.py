@@ -0,0 +1,412 @@
+import base64
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+logger = logging.getLogger("cloudmailin")
+
+# Segments are named after a sequence number and the id of the process that
+# writes them; the active segment of a process carries the ".open" suffix until
+# it is sealed by renaming it.
+SEGMENT_PATTERN = re.compile(r"^segment-(\d+)(?:-(\d+))?\.ndjson(\.open)?$")
+ACTIVE_SUFFIX = ".open"
+
+
+def _try_lock(file) -> bool:
+    """
+    Take an exclusive lock on an open file without waiting for it.
+    """
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _encode_value(value):
+    """
+    JSON fallback for the Firestore-native values found in email documents.
+    """
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_object(obj: dict):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+        if "$bytes" in obj:
+            return base64.b64decode(obj["$bytes"])
+    return obj
+
+
+def dumps(value) -> str:
+    """
+    Serialize a document to JSON, preserving datetimes and bytes.
+    """
+    return json.dumps(value, default=_encode_value)
+
+
+def loads(text: str):
+    """
+    Deserialize a document serialized with dumps().
+    """
+    return json.loads(text, object_hook=_decode_object)
+
+
+class Spool:
+    """
+    Append-only, segment-rotated local log of documents that failed to persist.
+
+    Each line of a segment is one write: the collection, the document id (or
+    None for an auto id) and the document itself. Segments are rotated when
+    they reach `segment_max_bytes`; only sealed segments are replayed, and the
+    number of lines already replayed is tracked in a sidecar `.offset` file so
+    that a drain interrupted by a failure or a restart resumes where it left.
+
+    Several processes (web workers, `flask spool drain`) may share the
+    directory. Each writes its own segments and holds an exclusive lock on its
+    active segment until it seals it by renaming it, so other processes never
+    replay a segment that is still written to; the active segments of
+    processes that died unlock and are sealed by the next drain. Drains also
+    lock the segment they replay, so a segment is replayed by one process.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, collection: str, document_id, data: dict):
+        """
+        Durably record a failed write.
+        """
+        line = dumps({"collection": collection, "id": document_id, "data": data})
+        with self._lock:
+            if self._active is None:
+                self._open_segment()
+            self._active.write(line + "\n")
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            if self._active.tell() >= self.segment_max_bytes:
+                self._seal_active()
+
+    def rotate(self):
+        """
+        Seal the active segment so that it can be replayed.
+        """
+        with self._lock:
+            self._seal_active()
+
+    def sealed_segments(self) -> list:
+        """
+        Paths of the sealed segments, oldest first.
+
+        Active segments left behind by processes that are gone are sealed
+        first; the active segments of live processes are never listed.
+        """
+        for path in self._segment_paths():
+            if path.endswith(ACTIVE_SUFFIX):
+                self._seal_orphan(path)
+        return [
+            path for path in self._segment_paths() if not path.endswith(ACTIVE_SUFFIX)
+        ]
+
+    def status(self) -> dict:
+        """
+        Summary of what is waiting in the spool, active segments included.
+        """
+        pending = 0
+        size = 0
+        segments = 0
+        for path in self._segment_paths():
+            try:
+                with open(path) as file:
+                    lines = sum(1 for _ in file)
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                # Sealed or drained by another process meanwhile
+                continue
+            segments += 1
+            pending += lines - self._read_offset(path.removesuffix(ACTIVE_SUFFIX))
+        return {
+            "directory": self.directory,
+            "segments": segments,
+            "pending_writes": pending,
+            "bytes": size,
+        }
+
+    def drain(self, write_batch, batch_size: int = 500) -> int:
+        """
+        Replay the spooled writes in batches.
+
+        Segments locked by a concurrent drain are skipped.
+
+        Args:
+            write_batch (callable): Called with a list of spooled entries;
+                must raise if they could not be persisted.
+            batch_size (int): Maximum number of entries per call.
+
+        Returns:
+            int: Number of entries replayed. Exceptions from write_batch
+            propagate after the progress made so far has been recorded.
+        """
+        self.rotate()
+        replayed = 0
+        for path in self.sealed_segments():
+            try:
+                file = open(path)
+            except FileNotFoundError:
+                continue
+            with file:
+                if not _try_lock(file) or not self._is_current(path, file):
+                    continue
+                offset = self._read_offset(path)
+                entries = [loads(line) for line in file if line.strip()]
+
+                while offset < len(entries):
+                    end = offset + batch_size
+                    chunk = entries[offset:end]
+                    write_batch(chunk)
+                    offset += len(chunk)
+                    replayed += len(chunk)
+                    self._write_offset(path, offset)
+
+                os.remove(path)
+                self._remove_offset(path)
+        return replayed
+
+    def _segment_paths(self) -> list:
+        segments = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                key = (int(match.group(1)), int(match.group(2) or 0))
+                segments.append((key, os.path.join(self.directory, name)))
+        return [path for _, path in sorted(segments)]
+
+    def _next_number(self) -> int:
+        numbers = [
+            int(match.group(1))
+            for match in map(SEGMENT_PATTERN.match, os.listdir(self.directory))
+            if match
+        ]
+        return max(numbers, default=0) + 1
+
+    def _open_segment(self):
+        # The process id keeps names unique when processes pick the same number
+        name = f"segment-{self._next_number():08d}-{os.getpid()}.ndjson"
+        path = os.path.join(self.directory, name) + ACTIVE_SUFFIX
+        # Lock the segment before it gets a name a drain would look at
+        tmp_path = f"{path}.tmp"
+        file = open(tmp_path, "x")
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+        self._active = file
+        self._active_path = path
+
+    def _seal_active(self):
+        if self._active is not None:
+            # Rename while the lock is held, so the segment is never seen
+            # unlocked under its active name
+            os.rename(self._active_path, self._active_path.removesuffix(ACTIVE_SUFFIX))
+            self._active.close()
+            self._active = None
+            self._active_path = None
+
+    def _seal_orphan(self, path: str):
+        """
+        Seal an active segment whose process is gone (its lock is released).
+        """
+        try:
+            file = open(path)
+        except FileNotFoundError:
+            return
+        with file:
+            if _try_lock(file) and self._is_current(path, file):
+                os.rename(path, path.removesuffix(ACTIVE_SUFFIX))
+
+    @staticmethod
+    def _is_current(path: str, file) -> bool:
+        """
+        Whether `path` still names the locked file (it was not sealed or
+        drained while the lock was being taken).
+        """
+        try:
+            return os.stat(path).st_ino == os.fstat(file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _read_offset(self, path: str) -> int:
+        try:
+            with open(f"{path}.offset") as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, path: str, offset: int):
+        tmp_path = f"{path}.offset.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(str(offset))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, f"{path}.offset")
+
+    def _remove_offset(self, path: str):
+        try:
+            os.remove(f"{path}.offset")
+        except FileNotFoundError:
+            pass
+
+
+def firestore_batch_writer(app):
+    """
+    Build a write_batch callable committing spooled entries to Firestore
+    through the client pool of the app.
+    """
+    from cloudmailin.db import get_client_pool
+
+    def write_batch(entries):
+        client = get_client_pool(app).get_client()
+        batch = client.batch()
+        for entry in entries:
+            collection = client.collection(entry["collection"])
+            batch.set(collection.document(entry["id"]), entry["data"])
+        batch.commit()
+
+    return write_batch
+
+
+class SpoolReplayer:
+    """
+    Background thread draining the spool, backing off exponentially while the
+    database keeps failing.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        write_batch,
+        interval: float = 30.0,
+        max_backoff: float = 600.0,
+        batch_size: int = 500,
+    ):
+        self.spool = spool
+        self.write_batch = write_batch
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self._delay = interval
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="spool-replayer", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def replay_once(self) -> int:
+        """
+        Drain the spool once, updating the backoff delay.
+        """
+        try:
+            replayed = self.spool.drain(self.write_batch, self.batch_size)
+        except Exception as e:
+            self._delay = min(self._delay * 2, self.max_backoff)
+            logger.warning(f"Spool replay failed, retrying in {self._delay:.0f}s: {e}")
+            return 0
+
+        self._delay = self.interval
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled emails to database")
+        return replayed
+
+    def _run(self):
+        while not self._stopping.wait(self._delay):
+            self.replay_once()
+
+
+def get_spool(app=None):
+    """
+    Get the spool of the app, or None if spooling is not configured.
+    """
+    app = app or current_app
+    return app.extensions.get("spool")
+
+
+@click.group("spool")
+def spool_cli():
+    """Inspect and drain the spool of emails that failed to persist."""
+
+
+@spool_cli.command("status")
+@with_appcontext
+def spool_status_command():
+    """Show how many writes are waiting in the spool."""
+    spool = get_spool()
+    if spool is None:
+        raise click.ClickException("Spooling is not configured (SPOOL_DIR).")
+
+    for key, value in spool.status().items():
+        click.echo(f"{key}: {value}")
+
+
+@spool_cli.command("drain")
+@with_appcontext
+def spool_drain_command():
+    """Replay every spooled write to the database now."""
+    spool = get_spool()
+    if spool is None:
+        raise click.ClickException("Spooling is not configured (SPOOL_DIR).")
+
+    replayed = spool.drain(
+        firestore_batch_writer(current_app._get_current_object()),
+        current_app.config.get("SPOOL_REPLAY_BATCH_SIZE", 500),
+    )
+    click.echo(f"Replayed {replayed} spooled writes")
+
+
+def init_app(app):
+    app.cli.add_command(spool_cli)
+
+    directory = app.config.get("SPOOL_DIR")
+    if not directory:
+        return
+
+    spool = Spool(
+        directory,
+        segment_max_bytes=app.config.get("SPOOL_SEGMENT_MAX_BYTES", 16 * 1024 * 1024),
+    )
+    app.extensions["spool"] = spool
+
+    interval = app.config.get("SPOOL_REPLAY_INTERVAL_SECONDS", 30.0)
+    if interval:
+        replayer = SpoolReplayer(
+            spool,
+            firestore_batch_writer(app),
+            interval=interval,
+            max_backoff=app.config.get("SPOOL_MAX_BACKOFF_SECONDS", 600.0),
+            batch_size=app.config.get("SPOOL_REPLAY_BATCH_SIZE", 500),
+        )
+        app.extensions["spool_replayer"] = replayer
+        replayer.start()
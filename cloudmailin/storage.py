@@ -0,0 +1,274 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, UTC
+
+from cloudmailin.spool import dumps, loads
+
+STORAGE_BACKENDS = ("firestore", "memory", "sqlite")
+
+SQLITE_SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data: dict = None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data) if self._data is not None else None
+
+
+class DocumentReference:
+    def __init__(self, backend, parent, document_id: str):
+        self._backend = backend
+        self.parent = parent
+        self.id = document_id
+
+    def set(self, data: dict):
+        self._backend._commit([(self.parent.id, self.id, data)])
+
+    def get(self) -> DocumentSnapshot:
+        return DocumentSnapshot(self, self._backend._get(self.parent.id, self.id))
+
+    def delete(self):
+        self._backend._delete(self.parent.id, self.id)
+
+
+class CollectionReference:
+    def __init__(self, backend, name: str):
+        self._backend = backend
+        self.id = name
+
+    def document(self, document_id: str = None) -> DocumentReference:
+        # Firestore auto ids are 20 characters long
+        return DocumentReference(
+            self._backend, self, document_id or uuid.uuid4().hex[:20]
+        )
+
+    def add(self, data: dict) -> tuple:
+        reference = self.document()
+        reference.set(data)
+        return datetime.now(UTC), reference
+
+    def stream(self):
+        for document_id, data in self._backend._stream(self.id):
+            yield DocumentSnapshot(self.document(document_id), data)
+
+
+class WriteBatch:
+    def __init__(self, backend):
+        self._backend = backend
+        self._writes = []
+
+    def set(self, reference: DocumentReference, data: dict):
+        self._writes.append((reference.parent.id, reference.id, data))
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        if writes:
+            self._backend._commit(writes)
+
+
+class StorageBackend(ABC):
+    """
+    Document store behind DatabaseHelper, the write-behind buffer and the
+    spool replayer.
+
+    Backends expose the subset of the google.cloud.firestore.Client API the
+    app relies on, so the Firestore client is used as a backend as is:
+    collection(name) with add(), stream() and document(id), whose references
+    support set(), get() and delete(), and batch() with set() and commit().
+    Subclasses only implement the storage primitives below.
+    """
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self, name)
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def init_schema(self):
+        """
+        Create the tables and indexes of the backend, if it has any.
+        """
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def _commit(self, writes: list):
+        """
+        Atomically write (collection, document_id, data) triples.
+        """
+
+    @abstractmethod
+    def _get(self, collection: str, document_id: str):
+        """
+        Data of a document, or None if it does not exist.
+        """
+
+    @abstractmethod
+    def _delete(self, collection: str, document_id: str):
+        """
+        Delete a document, if it exists.
+        """
+
+    @abstractmethod
+    def _stream(self, collection: str):
+        """
+        Iterate over the (document_id, data) pairs of a collection.
+        """
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Embedded storage in a SQLite database, for edge and dev deployments.
+
+    Documents are stored as JSON (keeping datetimes and bytes, like the spool)
+    in a single table keyed by collection and id. The database runs in WAL
+    mode, so readers never block the writer; every thread gets its own
+    connection, whose statement cache keeps the fixed statements below
+    prepared, and write batches are committed with one executemany().
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS documents (
+            collection TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (collection, id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS documents_by_update "
+        "ON documents (collection, updated_at)",
+    )
+    UPSERT = (
+        "INSERT OR REPLACE INTO documents (collection, id, data, updated_at) "
+        "VALUES (?, ?, ?, ?)"
+    )
+    SELECT = "SELECT data FROM documents WHERE collection = ? AND id = ?"
+    SELECT_COLLECTION = (
+        "SELECT id, data FROM documents WHERE collection = ? ORDER BY updated_at"
+    )
+    DELETE = "DELETE FROM documents WHERE collection = ? AND id = ?"
+
+    def __init__(
+        self, path: str, synchronous: str = "NORMAL", busy_timeout: float = 5.0
+    ):
+        if synchronous.upper() not in SQLITE_SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {synchronous}")
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.init_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def init_schema(self):
+        connection = self._connection()
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _commit(self, writes: list):
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                self.UPSERT,
+                [
+                    (collection, document_id, dumps(data), now)
+                    for collection, document_id, data in writes
+                ],
+            )
+
+    def _get(self, collection: str, document_id: str):
+        row = self._connection().execute(self.SELECT, (collection, document_id))
+        row = row.fetchone()
+        return loads(row[0]) if row is not None else None
+
+    def _delete(self, collection: str, document_id: str):
+        connection = self._connection()
+        with connection:
+            connection.execute(self.DELETE, (collection, document_id))
+
+    def _stream(self, collection: str):
+        rows = self._connection().execute(self.SELECT_COLLECTION, (collection,))
+        for document_id, data in rows.fetchall():
+            yield document_id, loads(data)
+
+
+def sqlite_path(app) -> str:
+    return app.config.get("SQLITE_PATH") or os.path.join(
+        app.instance_path, "cloudmailin.sqlite"
+    )
+
+
+def client_factory(app):
+    """
+    Factory of the clients of the STORAGE_BACKEND, or None for Firestore.
+
+    The other backends share a single client (and its documents) across the
+    client pool.
+
+    Raises:
+        ValueError: If STORAGE_BACKEND is not a known backend.
+    """
+    backend = app.config.get("STORAGE_BACKEND") or "firestore"
+    if backend == "firestore":
+        return None
+
+    if backend == "memory":
+        from cloudmailin.fake_firestore import InMemoryFirestoreClient, LatencyModel
+
+        client = InMemoryFirestoreClient(
+            LatencyModel(
+                latency_ms=app.config.get("MEMORY_STORAGE_LATENCY_MS", 0.0),
+                jitter_ms=app.config.get("MEMORY_STORAGE_JITTER_MS", 0.0),
+                error_rate=app.config.get("MEMORY_STORAGE_ERROR_RATE", 0.0),
+            )
+        )
+    elif backend == "sqlite":
+        client = SQLiteStorage(
+            sqlite_path(app),
+            synchronous=app.config.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        )
+    else:
+        raise ValueError(
+            f"Unknown STORAGE_BACKEND: {backend} "
+            f"(expected one of {', '.join(STORAGE_BACKENDS)})"
+        )
+    return lambda **kwargs: client
@@ -0,0 +1,365 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import g, request
+
+logger = logging.getLogger("cloudmailin")
+
+# W3C Trace Context: version-trace_id-parent_id-flags
+TRACEPARENT_PATTERN = re.compile(
+    r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$"
+)
+# Google Cloud: TRACE_ID/SPAN_ID;o=OPTIONS, with a decimal span id
+CLOUD_TRACE_PATTERN = re.compile(r"^([0-9a-fA-F]{32})(?:/(\d+))?(?:;o=\d)?$")
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_NOOP = contextlib.nullcontext()
+
+# Sentinel telling the exporter thread to exit
+_STOP = object()
+
+# Trace of the request being served, and its innermost open span
+_current_trace = ContextVar("cloudmailin_trace", default=None)
+_current_span = ContextVar("cloudmailin_span", default=None)
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """
+    The spans recorded while serving one request.
+
+    `parent_id` is the span of the caller, when the request carried a trace
+    header; the root span of the request is its child.
+    """
+
+    __slots__ = ("trace_id", "parent_id", "spans")
+
+    def __init__(self, trace_id: str = None, parent_id: str = None):
+        self.trace_id = trace_id or new_trace_id()
+        self.parent_id = parent_id
+        self.spans = []
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+
+class _SpanScope:
+    __slots__ = ("trace", "span", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict = None):
+        parent = _current_span.get()
+        self.trace = trace
+        self.span = Span(
+            name, parent.span_id if parent else trace.parent_id, attributes
+        )
+
+    def __enter__(self) -> Span:
+        self.span.start_ns = time.time_ns()
+        self.trace.spans.append(self.span)
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.end()
+        if exc is not None:
+            self.span.attributes["error"] = repr(exc)
+        _current_span.reset(self._token)
+
+
+def span(name: str, attributes: dict = None):
+    """
+    Context manager recording a span of the current request.
+
+    Outside a traced request (or with tracing disabled) it is a shared no-op,
+    so instrumented code costs a context variable lookup.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    return _SpanScope(trace, name, attributes)
+
+
+def current_trace() -> Trace:
+    return _current_trace.get()
+
+
+def parse_trace_headers(headers) -> tuple:
+    """
+    Trace id and parent span id of the caller, from a W3C traceparent or a
+    Google Cloud X-Cloud-Trace-Context header, or (None, None).
+    """
+    match = TRACEPARENT_PATTERN.match(headers.get("traceparent", "").strip())
+    if match and set(match[1]) != {"0"} and set(match[2]) != {"0"}:
+        return match[1], match[2]
+
+    match = CLOUD_TRACE_PATTERN.match(headers.get("X-Cloud-Trace-Context", "").strip())
+    if match and set(match[1]) != {"0"}:
+        parent_id = None
+        if match[2] and 0 < int(match[2]) < 2**64:
+            parent_id = format(int(match[2]), "016x")
+        return match[1].lower(), parent_id
+
+    return None, None
+
+
+# --- Export --- #
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace, service_name: str = "cloudmailin") -> dict:
+    """
+    The trace as an OTLP/JSON ExportTraceServiceRequest.
+    """
+    spans = []
+    for recorded in trace.spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": recorded.span_id,
+            "name": recorded.name,
+            "kind": (
+                SPAN_KIND_SERVER if recorded is trace.root else SPAN_KIND_INTERNAL
+            ),
+            "startTimeUnixNano": str(recorded.start_ns),
+            "endTimeUnixNano": str(recorded.end_ns or recorded.start_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in recorded.attributes.items()
+            ],
+            # 1 = OK, 2 = ERROR
+            "status": {"code": 2 if "error" in recorded.attributes else 1},
+        }
+        if recorded.parent_id:
+            otlp_span["parentSpanId"] = recorded.parent_id
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": _otlp_value(service_name)}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "cloudmailin"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class FileSpanExporter:
+    """
+    Append each trace as one OTLP/JSON line to a file, the format read by the
+    OpenTelemetry Collector's otlpjsonfile receiver.
+
+    Traces are queued and serialized and written by a background thread, so
+    requests never wait on the file. When `max_queue_size` traces are waiting,
+    new ones are dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, path: str, max_queue_size: int = 10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue_size)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Wait until the queued traces are written.
+        """
+        self._queue.join()
+
+    def close(self, timeout: float = None):
+        """
+        Write the queued traces and stop the writer thread.
+        """
+        if self._thread.is_alive():
+            # Wait for room rather than failing on a full queue at shutdown
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        with open(self.path, "a") as file:
+            while True:
+                trace = self._queue.get()
+                try:
+                    if trace is _STOP:
+                        return
+                    file.write(json.dumps(to_otlp(trace), separators=(",", ":")))
+                    file.write("\n")
+                    # Write in batches while traces keep coming
+                    if self._queue.empty():
+                        file.flush()
+                except Exception as e:
+                    logger.warning(f"Failed to export trace {trace.trace_id}: {e}")
+                finally:
+                    self._queue.task_done()
+
+
+def format_breakdown(trace: Trace) -> str:
+    """
+    The spans of a trace as an indented tree of durations.
+    """
+    depths = {trace.parent_id: -1}
+    lines = []
+    for recorded in trace.spans:
+        depth = depths[recorded.span_id] = depths.get(recorded.parent_id, -1) + 1
+        lines.append(f"{'  ' * depth}{recorded.name} {recorded.duration_ms:.1f} ms")
+    return "\n".join(lines)
+
+
+# --- Request instrumentation --- #
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    Stamp log records with the trace of the request being served, so every
+    line can be correlated (and linked to the trace in Cloud Logging when the
+    project id is known).
+    """
+
+    def __init__(self, project_id: str = None):
+        super().__init__()
+        self.project_id = project_id
+
+    def filter(self, record) -> bool:
+        trace = _current_trace.get()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+            if self.project_id:
+                record.trace = f"projects/{self.project_id}/traces/{trace.trace_id}"
+            current = _current_span.get()
+            if current is not None:
+                record.span_id = current.span_id
+        return True
+
+
+def start_request_trace():
+    trace_id, parent_id = parse_trace_headers(request.headers)
+    trace = Trace(trace_id, parent_id)
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    root = Span(f"{request.method} {route}", parent_id, {"http.method": request.method})
+    trace.spans.append(root)
+    g.trace_tokens = (_current_trace.set(trace), _current_span.set(root))
+
+
+def record_response_status(response):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.root.attributes["http.status_code"] = response.status_code
+    return response
+
+
+def make_request_trace_finisher(exporter, slow_request_seconds: float = None):
+    def finish_request_trace(error=None):
+        tokens = g.pop("trace_tokens", None)
+        if tokens is None:
+            return
+        trace = _current_trace.get()
+        _current_span.reset(tokens[1])
+        _current_trace.reset(tokens[0])
+
+        trace.root.end()
+        if error is not None:
+            trace.root.attributes["error"] = repr(error)
+
+        if slow_request_seconds is not None:
+            if trace.root.duration_ms >= slow_request_seconds * 1000:
+                logger.warning(
+                    f"Slow request: {trace.root.name} took "
+                    f"{trace.root.duration_ms:.1f} ms (trace {trace.trace_id})\n"
+                    f"{format_breakdown(trace)}"
+                )
+
+        if exporter is not None:
+            try:
+                exporter.export(trace)
+            except Exception as e:
+                logger.warning(f"Failed to export trace {trace.trace_id}: {e}")
+
+    return finish_request_trace
+
+
+def init_app(app):
+    if not app.config.get("TRACING_ENABLED"):
+        return
+
+    exporter = None
+    path = app.config.get("TRACING_EXPORT_PATH")
+    if path:
+        exporter = FileSpanExporter(
+            path, app.config.get("TRACING_EXPORT_QUEUE_SIZE", 10000)
+        )
+        app.extensions["span_exporter"] = exporter
+        atexit.register(exporter.close)
+
+    app.before_request(start_request_trace)
+    app.after_request(record_response_status)
+    app.teardown_request(
+        make_request_trace_finisher(
+            exporter, app.config.get("TRACING_SLOW_REQUEST_SECONDS")
+        )
+    )
+
+    # Correlate the log lines of the request with its trace
+    trace_filter = TraceContextFilter(app.config.get("TRACING_PROJECT_ID"))
+    for handler in logging.getLogger("cloudmailin").handlers:
+        handler.addFilter(trace_filter)
@@ -0,0 +1,125 @@
+import re
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+from pydantic.networks import validate_email
+
+# RFC 2822 date-time, including the obsolete syntax of section 4.3: optional
+# weekday, optional seconds, two or three digit years, alphabetic zones and a
+# trailing comment such as "(UTC)"
+RFC2822_DATE_PATTERN = re.compile(
+    r"""
+    ^\s*
+    (?:[A-Za-z]{3}[a-z]*\s*,?\s*)?
+    (?P<day>\d{1,2})\s+
+    (?P<month>[A-Za-z]{3})[a-z]*\.?\s+
+    (?P<year>\d{2,4})\s+
+    (?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?
+    (?:\s*(?P<zone>[+-]\d{4}|[A-Za-z]{1,5}))?
+    \s*(?:\(.*\))?\s*$
+    """,
+    re.VERBOSE,
+)
+
+MONTHS = {
+    name: number
+    for number, name in enumerate(
+        ("jan", "feb", "mar", "apr", "may", "jun")
+        + ("jul", "aug", "sep", "oct", "nov", "dec"),
+        start=1,
+    )
+}
+
+# Obsolete zone names from RFC 2822 section 4.3, in hours from UTC
+ZONE_OFFSETS = {
+    "UT": 0,
+    "UTC": 0,
+    "GMT": 0,
+    "Z": 0,
+    "EST": -5,
+    "EDT": -4,
+    "CST": -6,
+    "CDT": -5,
+    "MST": -7,
+    "MDT": -6,
+    "PST": -8,
+    "PDT": -7,
+}
+
+
+@lru_cache(maxsize=4096)
+def _timezone_for(zone: str) -> timezone:
+    if zone is None or zone == "-0000":
+        # "-0000" means the local time zone is unknown, i.e. UTC
+        return timezone.utc
+    if zone[0] in "+-":
+        sign = -1 if zone[0] == "-" else 1
+        minutes = int(zone[1:3]) * 60 + int(zone[3:5])
+        return timezone(sign * timedelta(minutes=minutes))
+
+    hours = ZONE_OFFSETS.get(zone.upper())
+    if hours is None:
+        # Military and unknown zones "SHOULD be considered equivalent to -0000"
+        return timezone.utc
+    return timezone(timedelta(hours=hours))
+
+
+@lru_cache(maxsize=4096)
+def parse_rfc2822_date(value: str) -> datetime:
+    """
+    Parse an RFC 2822 date into a timezone-aware datetime.
+
+    Uses a precompiled pattern for the common shapes and falls back to the
+    standard library parser for anything else. Results are cached, since a
+    newsletter blast carries the same Date header thousands of times.
+
+    Raises:
+        ValueError: If the value is not a valid RFC 2822 date.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid date format: {value}")
+
+    match = RFC2822_DATE_PATTERN.match(value)
+    if match is None:
+        try:
+            parsed = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            raise ValueError(f"Invalid date format: {value}")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed
+
+    month = MONTHS.get(match["month"].lower())
+    if month is None:
+        raise ValueError(f"Invalid date format: {value}")
+
+    year = int(match["year"])
+    if len(match["year"]) == 2:
+        year += 2000 if year < 50 else 1900
+    elif len(match["year"]) == 3:
+        year += 1900
+
+    try:
+        return datetime(
+            year,
+            month,
+            int(match["day"]),
+            int(match["hour"]),
+            int(match["minute"]),
+            int(match["second"] or 0),
+            tzinfo=_timezone_for(match["zone"]),
+        )
+    except ValueError:
+        raise ValueError(f"Invalid date format: {value}")
+
+
+@lru_cache(maxsize=8192)
+def normalize_email_address(value: str) -> str:
+    """
+    Validate and normalize an email address, exactly like pydantic's EmailStr.
+
+    Results are cached, so repeat senders and recipients skip email_validator.
+    Invalid addresses are not cached and raise PydanticCustomError.
+    """
+    return validate_email(value)[1]
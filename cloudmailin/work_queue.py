@@ -0,0 +1,369 @@
+import atexit
+import fcntl
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import NamedTuple, Optional
+
+from flask import g
+
+from cloudmailin.schemas import Email
+
+INGEST_MODES = ("sync", "async")
+DURABILITY_MODES = ("memory", "disk")
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class IngestJob(NamedTuple):
+    job_id: str
+    email: Email
+    # The configured instance: it keeps its pipeline across registry reloads
+    handler: object
+    collection: Optional[str]
+    # Failed attempts so far
+    attempts: int = 0
+
+
+class IngestQueue:
+    """
+    In-process work queue drained by a pool of worker threads, used to
+    acknowledge emails before they are processed.
+
+    Emails whose handler failed are re-queued after an exponential backoff,
+    until max_attempts attempts were made. With "disk" durability every
+    accepted email is written and fsynced to a journal directory before it is
+    acknowledged, and removed once processed; emails that exhausted their
+    attempts, or were waiting for a retry at shutdown, stay journaled. Each
+    process journals to its own subdirectory, locked for as long as the
+    process lives. On start, the entries of processes that are gone (their
+    lock is released) are claimed by renaming them into the subdirectory of
+    this process and re-queued, so the workers of a server sharing
+    INGEST_JOURNAL_DIR never process each other's emails.
+    """
+
+    def __init__(
+        self,
+        app,
+        workers: int = 4,
+        max_size: int = 1000,
+        durability: str = "memory",
+        journal_dir: str = None,
+        max_attempts: int = 5,
+        retry_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(
+                f"INGEST_DURABILITY must be one of {', '.join(DURABILITY_MODES)}."
+            )
+        if durability == "disk" and not journal_dir:
+            raise ValueError("INGEST_JOURNAL_DIR is required for disk durability.")
+        if max_attempts < 1:
+            raise ValueError("INGEST_MAX_ATTEMPTS must be at least 1.")
+
+        self.app = app
+        self.durability = durability
+        self.journal_dir = journal_dir
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        # Heap of (due time, sequence, job) waiting to be re-queued
+        self._retries = []
+        self._retry_sequence = itertools.count()
+        self._retry_ready = threading.Condition()
+        self._stopping = False
+        self._retry_thread = threading.Thread(
+            target=self._schedule_retries, name="ingest-retry", daemon=True
+        )
+        self._retry_thread.start()
+
+        if durability == "disk":
+            self._open_worker_dir()
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        if durability == "disk":
+            self._recover()
+
+    def submit(self, email: Email, payload: dict, handler, collection=None):
+        """
+        Accept an email for background processing by a handler instance.
+
+        Returns:
+            bool: False if the queue is full, in which case the caller is
+            expected to process the email itself.
+        """
+        job = IngestJob(uuid.uuid4().hex, email, handler, collection)
+
+        if self.durability == "disk":
+            self._journal(job.job_id, payload, collection)
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._forget(job.job_id)
+            return False
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = None):
+        """
+        Let the workers finish the queued emails and stop them. Emails
+        waiting for a retry are not processed again.
+        """
+        with self._retry_ready:
+            self._stopping = True
+            self._retry_ready.notify()
+        self._retry_thread.join(timeout)
+
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+
+        with self._retry_ready:
+            pending = len(self._retries)
+        if pending:
+            kept = "kept in the journal" if self.durability == "disk" else "dropped"
+            self.app.logger.warning(
+                f"{pending} queued emails waiting for a retry were {kept} on shutdown"
+            )
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            try:
+                with self.app.app_context():
+                    if job.collection:
+                        g.firestore_collection = job.collection
+                    job.handler.handle(job.email)
+            except Exception:
+                self.app.logger.exception(
+                    f"Unhandled exception processing queued email {job.job_id}"
+                )
+                self._retry(job)
+                continue
+            self._forget(job.job_id)
+
+    def _retry(self, job: IngestJob):
+        """
+        Schedule a failed job to be re-queued after a backoff, unless it
+        exhausted its attempts.
+        """
+        attempts = job.attempts + 1
+        if attempts >= self.max_attempts:
+            # The journal entry is kept, so the email is retried by the
+            # next process recovering this journal
+            self.app.logger.error(
+                f"Giving up on queued email {job.job_id} after {attempts} attempts"
+            )
+            return
+
+        delay = min(self.retry_backoff * 2 ** (attempts - 1), self.max_backoff)
+        with self._retry_ready:
+            heapq.heappush(
+                self._retries,
+                (
+                    time.monotonic() + delay,
+                    next(self._retry_sequence),
+                    job._replace(attempts=attempts),
+                ),
+            )
+            self._retry_ready.notify()
+
+    def _next_retry(self) -> Optional[IngestJob]:
+        """
+        Wait for the next failed job to be due, or None once stopping.
+        """
+        with self._retry_ready:
+            while not self._stopping:
+                if not self._retries:
+                    self._retry_ready.wait()
+                    continue
+                delay = self._retries[0][0] - time.monotonic()
+                if delay > 0:
+                    self._retry_ready.wait(delay)
+                    continue
+                return heapq.heappop(self._retries)[2]
+        return None
+
+    def _schedule_retries(self):
+        while True:
+            job = self._next_retry()
+            if job is None:
+                return
+            # Outside of the lock: workers scheduling retries must not wait
+            # on a full queue
+            self._queue.put(job)
+
+    def _open_worker_dir(self):
+        """
+        Create the journal subdirectory of this process and lock it.
+
+        The directory is locked under a temporary name and then renamed, so
+        that recovering processes never find it unlocked.
+        """
+        os.makedirs(self.journal_dir, exist_ok=True)
+        name = f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        tmp_dir = os.path.join(self.journal_dir, f".{name}.tmp")
+        os.mkdir(tmp_dir)
+        self._lock_file = open(os.path.join(tmp_dir, ".lock"), "w")
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        self.worker_dir = os.path.join(self.journal_dir, name)
+        os.rename(tmp_dir, self.worker_dir)
+
+    def _journal_path(self, job_id: str) -> str:
+        return os.path.join(self.worker_dir, f"{job_id}.json")
+
+    def _journal(self, job_id: str, payload: dict, collection):
+        path = self._journal_path(job_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"payload": payload, "collection": collection}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        self._sync_worker_dir()
+
+    def _sync_worker_dir(self):
+        # Persist the renames into the directory
+        dir_fd = os.open(self.worker_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _forget(self, job_id: str):
+        if self.durability != "disk":
+            return
+        try:
+            os.remove(self._journal_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _claim_orphaned_entries(self) -> list:
+        """
+        Move the journal entries of processes that are gone into the
+        subdirectory of this process.
+
+        Returns:
+            list: The names of the claimed entries.
+        """
+        claimed = []
+        for name in sorted(os.listdir(self.journal_dir)):
+            path = os.path.join(self.journal_dir, name)
+            if name.endswith(".json"):
+                # Journaled before entries were kept per process
+                claimed += self._claim(self.journal_dir, [name])
+            elif name.startswith("worker-") and path != self.worker_dir:
+                claimed += self._claim_worker_dir(path)
+        if claimed:
+            self._sync_worker_dir()
+        return claimed
+
+    def _claim_worker_dir(self, path: str) -> list:
+        try:
+            lock_file = open(os.path.join(path, ".lock"))
+        except FileNotFoundError:
+            # Claimed by another process meanwhile
+            return []
+        with lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                names = os.listdir(path)
+            except (BlockingIOError, FileNotFoundError):
+                # Its process is alive, or it was claimed by another process
+                return []
+
+            claimed = self._claim(path, [n for n in names if n.endswith(".json")])
+            for name in os.listdir(path):
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+        return claimed
+
+    def _claim(self, directory: str, names: list) -> list:
+        claimed = []
+        for name in names:
+            try:
+                # Atomic: an entry is claimed by a single process
+                os.rename(
+                    os.path.join(directory, name), os.path.join(self.worker_dir, name)
+                )
+            except FileNotFoundError:
+                continue
+            claimed.append(name)
+        return claimed
+
+    def _recover(self):
+        """
+        Re-queue the emails journaled by processes that are gone.
+        """
+        registry = self.app.config["handler_registry"]
+        recovered = 0
+        for name in sorted(self._claim_orphaned_entries()):
+            job_id = name[: -len(".json")]
+            try:
+                with open(self._journal_path(job_id)) as file:
+                    entry = json.load(file)
+                email = Email(**entry["payload"])
+            except Exception:
+                self.app.logger.exception(f"Discarding unreadable journal entry {name}")
+                self._forget(job_id)
+                continue
+
+            handler = registry.get_handler(
+                registry.get_handler_for_sender(email.sender)
+            )
+            # Block rather than drop: recovered emails were already acknowledged
+            self._queue.put(IngestJob(job_id, email, handler, entry.get("collection")))
+            recovered += 1
+
+        if recovered:
+            self.app.logger.info(
+                f"Recovered {recovered} journaled emails for background processing"
+            )
+
+
+def get_ingest_queue(app):
+    """
+    Get the ingest queue of the app.
+    """
+    return app.extensions["ingest_queue"]
+
+
+def init_app(app):
+    mode = app.config.get("INGEST_MODE", "sync")
+    if mode not in INGEST_MODES:
+        raise ValueError(f"INGEST_MODE must be one of {', '.join(INGEST_MODES)}.")
+    if mode != "async":
+        return
+
+    ingest_queue = IngestQueue(
+        app,
+        workers=app.config.get("INGEST_WORKERS", 4),
+        max_size=app.config.get("INGEST_QUEUE_SIZE", 1000),
+        durability=app.config.get("INGEST_DURABILITY", "memory"),
+        journal_dir=app.config.get("INGEST_JOURNAL_DIR"),
+        max_attempts=app.config.get("INGEST_MAX_ATTEMPTS", 5),
+        retry_backoff=app.config.get("INGEST_RETRY_BACKOFF_SECONDS", 1.0),
+        max_backoff=app.config.get("INGEST_MAX_BACKOFF_SECONDS", 60.0),
+    )
+    app.extensions["ingest_queue"] = ingest_queue
+    atexit.register(ingest_queue.close, app.config.get("INGEST_DRAIN_TIMEOUT", 8.0))
@@ -0,0 +1,238 @@
+import atexit
+import logging
+import queue
+import signal
+import threading
+import time
+from typing import NamedTuple
+
+from flask import current_app
+
+from cloudmailin.metrics import STORAGE_WRITE_DURATION, STORAGE_WRITE_ERRORS
+
+# Firestore rejects write batches with more than 500 operations
+MAX_BATCH_SIZE = 500
+
+logger = logging.getLogger("cloudmailin")
+
+# Guards the lazy creation of the process-wide buffer
+_buffer_lock = threading.Lock()
+
+
+class PendingWrite(NamedTuple):
+    document: object
+    data: dict
+    enqueued_at: float
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process buffer of email documents, committed to Firestore in
+    batches by a background flusher thread.
+
+    A batch is flushed as soon as it reaches `batch_size` documents or its
+    oldest document is `max_age` seconds old, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        client_pool,
+        batch_size: int = MAX_BATCH_SIZE,
+        max_age: float = 1.0,
+        max_buffer: int = 10000,
+        spool=None,
+    ):
+        if not 1 <= batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(
+                f"WRITE_BEHIND_BATCH_SIZE must be between 1 and {MAX_BATCH_SIZE}."
+            )
+
+        self.client_pool = client_pool
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.spool = spool
+        self._queue = queue.Queue(maxsize=max_buffer)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "flushes": 0,
+            "flushed_documents": 0,
+            "failed_documents": 0,
+            "last_flush_size": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, document, data: dict) -> bool:
+        """
+        Queue a document write.
+
+        Returns:
+            bool: False if the buffer is full or closed, in which case the
+            caller is expected to write the document itself.
+        """
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait(PendingWrite(document, data, time.monotonic()))
+        except queue.Full:
+            return False
+        return True
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the buffer counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        return stats
+
+    def close(self, timeout: float = None):
+        """
+        Stop accepting writes and wait for the flusher to drain the buffer.
+        """
+        self._stopping.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+        # Writes that raced with close() are flushed by the caller
+        if not self._thread.is_alive():
+            leftovers = []
+            while True:
+                try:
+                    leftovers.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            while leftovers:
+                self._flush(leftovers[: self.batch_size])
+                del leftovers[: self.batch_size]
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping.is_set():
+                return
+
+    def _collect_batch(self) -> list:
+        # Wake up regularly while idle so that close() is noticed quickly
+        try:
+            first = self._queue.get(timeout=min(self.max_age, 0.5))
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_age
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0 and not self._stopping.is_set():
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            write_batch = self.client_pool.get_client().batch()
+            for pending in batch:
+                write_batch.set(pending.document, pending.data)
+            write_batch.commit()
+            failed = 0
+        except Exception as e:
+            failed = len(batch)
+            STORAGE_WRITE_ERRORS.inc("write_behind")
+            logger.error(
+                f"Failed to flush {failed} buffered emails to database: {e}",
+                exc_info=True,
+            )
+            if self.spool is not None:
+                for pending in batch:
+                    self.spool.append(
+                        pending.document.parent.id, pending.document.id, pending.data
+                    )
+        elapsed = time.perf_counter() - started
+        if not failed:
+            STORAGE_WRITE_DURATION.observe(elapsed, "write_behind")
+
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["flushed_documents"] += len(batch) - failed
+            self._stats["failed_documents"] += failed
+            self._stats["last_flush_size"] = len(batch)
+            self._stats["last_flush_seconds"] = elapsed
+            self._stats["total_flush_seconds"] += elapsed
+            self._stats["max_flush_seconds"] = max(
+                self._stats["max_flush_seconds"], elapsed
+            )
+
+
+def get_write_behind(app=None):
+    """
+    Get the write-behind buffer of the app, creating it on first use.
+    """
+    from cloudmailin.db import get_client_pool
+    from cloudmailin.spool import get_spool
+
+    app = app or current_app._get_current_object()
+    buffer = app.extensions.get("write_behind")
+    if buffer is None:
+        with _buffer_lock:
+            buffer = app.extensions.get("write_behind")
+            if buffer is None:
+                buffer = WriteBehindBuffer(
+                    get_client_pool(app),
+                    batch_size=app.config.get("WRITE_BEHIND_BATCH_SIZE", 500),
+                    max_age=app.config.get("WRITE_BEHIND_MAX_AGE_SECONDS", 1.0),
+                    max_buffer=app.config.get("WRITE_BEHIND_MAX_BUFFER", 10000),
+                    spool=get_spool(app),
+                )
+                app.extensions["write_behind"] = buffer
+    return buffer
+
+
+def drain_write_behind(app, timeout: float = None):
+    """
+    Flush and stop the write-behind buffer of the app, if it was ever started.
+    """
+    buffer = app.extensions.pop("write_behind", None)
+    if buffer is not None:
+        buffer.close(timeout)
+
+
+def install_sigterm_drain(app):
+    """
+    Drain the buffer when the process receives SIGTERM, then hand the signal
+    over to the previous handler (e.g. gunicorn's graceful shutdown).
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def _handle_sigterm(signum, frame):
+        drain_write_behind(app, app.config.get("WRITE_BEHIND_DRAIN_TIMEOUT", 8.0))
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+
+def init_app(app):
+    if not app.config.get("WRITE_BEHIND_ENABLED"):
+        return
+    install_sigterm_drain(app)
+    atexit.register(drain_write_behind, app)
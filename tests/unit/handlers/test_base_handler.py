@@ -1,4 +1,6 @@
+import logging
 from unittest.mock import patch, MagicMock
+from cloudmailin.dedup import email_dedup_key
 from cloudmailin.handlers.base_handler import BaseHandler
 from cloudmailin.schemas import Email
 
@@ -6,7 +8,7 @@ from cloudmailin.schemas import Email
 # --- Test logging behaviour --- #
 
 
-def test_base_handler_logs_health_message(valid_flat_payload, app_factory):
+def test_base_handler_logs_health_message(valid_flat_payload, app_factory, caplog):
     """
     Test that BaseHandler logs a health-related message when handling an email.
     """
@@ -15,10 +17,12 @@ def test_base_handler_logs_health_message(valid_flat_payload, app_factory):
     handler = BaseHandler()
 
     with app.app_context():
-        with patch.object(app.logger, "info") as mock_logger:
+        with caplog.at_level(logging.INFO, logger="cloudmailin"):
             handler.handle(email)
-            expected_message = f"[{handler.__class__.__name__}] Processing email from sender@example.com"
-            mock_logger.assert_any_call(expected_message)
+    expected_message = (
+        f"[{handler.__class__.__name__}] Processing email from sender@example.com"
+    )
+    assert expected_message in caplog.messages
 
 
 # --- Test basic operations and step execution --- #
@@ -55,7 +59,9 @@ def test_base_handler_executes_steps_in_order(valid_flat_payload, app_factory):
     assert result.subject == "Test Subject Step1 Step2"
 
 
-def test_base_handler_logs_email_stored_in_database(app_factory, valid_flat_payload):
+def test_base_handler_logs_email_stored_in_database(
+    app_factory, valid_flat_payload, caplog
+):
     """
     Test that the final modified email model is passed to the storage step to be stored in the database.
     """
@@ -79,7 +85,7 @@ def test_base_handler_logs_email_stored_in_database(app_factory, valid_flat_payl
     handler = TestHandler()
 
     with app.app_context():
-        with patch.object(app.logger, "info") as mock_logger:
+        with caplog.at_level(logging.INFO, logger="cloudmailin"):
             result = handler.handle(email)
 
     # Assert that the storage log was called with the final modified email
@@ -90,13 +96,11 @@ def test_base_handler_logs_email_stored_in_database(app_factory, valid_flat_payl
 
     # Verify the logger received the final email's subject indirectly
     storage_call = [
-        call
-        for call in mock_logger.call_args_list
-        if "Email stored in database:" in call.args[0]
+        message for message in caplog.messages if "Email stored in database:" in message
     ]
     assert storage_call, "Expected a storage log call but none was found."
     assert (
-        expected_final_subject in storage_call[0].args[0]
+        expected_final_subject in storage_call[0]
     ), "Storage log did not include the final email subject."
 
 
@@ -125,7 +129,9 @@ def test_base_handler_stores_email_in_database(
 
     # Assert
     # Assert the email was stored
-    mock_db.store_email.assert_called_once_with(email.model_dump())
+    mock_db.store_email.assert_called_once_with(
+        email.model_dump(), dedup_key=email_dedup_key(email)
+    )
 
 
 @patch("cloudmailin.handlers.base_handler.get_db")
@@ -162,7 +168,30 @@ def test_base_handler_stores_final_email_model(
 
     # Assert
     # Assert the email with the modifications from the steps was stored
-    mock_db.store_email.assert_called_once_with(result.model_dump())
+    mock_db.store_email.assert_called_once_with(
+        result.model_dump(), dedup_key=email_dedup_key(result)
+    )
 
 
 # --- Edge cases --- #
+
+
+@patch("cloudmailin.handlers.base_handler.get_db")
+def test_base_handler_returns_stored_document_id(
+    mock_get_db, app_factory, valid_flat_payload
+):
+    """
+    Test that the id of the stored document is set on the returned email.
+    """
+    # Arrange
+    app = app_factory()
+    email = Email.from_flat_data(**valid_flat_payload)
+    mock_get_db.return_value.store_email.return_value = "stored-document-id"
+
+    # Act
+    with app.app_context():
+        result = BaseHandler().handle(email)
+
+    # Assert
+    assert result.document_id == "stored-document-id"
+    assert "document_id" not in result.model_dump()
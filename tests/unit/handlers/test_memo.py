@@ -0,0 +1,167 @@
+from unittest.mock import patch
+
+import pytest
+
+from cloudmailin.handlers.memo import StepCache, digest_fields, pure_step
+from cloudmailin.handlers.pipeline import Pipeline
+from cloudmailin.schemas import Email
+
+
+@pytest.fixture
+def cache():
+    return StepCache(max_entries=2, ttl=60)
+
+
+@pytest.fixture
+def counting_step():
+    calls = []
+
+    @pure_step(reads=("subject",), writes=("campaign_type",))
+    def classify(email):
+        calls.append(email.subject)
+        return email.model_copy(update={"campaign_type": email.subject.upper()})
+
+    classify.calls = calls
+    return classify
+
+
+def make_email(valid_flat_payload, subject):
+    valid_flat_payload["subject"] = subject
+    return Email.from_flat_data(**valid_flat_payload)
+
+
+# --- Test memoization in pipelines --- #
+
+
+def test_pure_step_runs_once_per_distinct_content(
+    valid_flat_payload, cache, counting_step
+):
+    """
+    Test that identical emails reuse the result of a pure step.
+    """
+    pipeline = Pipeline([counting_step], cache=cache)
+
+    first = pipeline(make_email(valid_flat_payload, "Sale"))
+    second = pipeline(make_email(valid_flat_payload, "Sale"))
+    pipeline(make_email(valid_flat_payload, "Other"))
+
+    assert counting_step.calls == ["Sale", "Other"]
+    assert first.campaign_type == second.campaign_type == "SALE"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_cached_result_does_not_copy_bodies(valid_flat_payload, cache, counting_step):
+    """
+    Test that a cached result only updates the written fields of the email.
+    """
+    pipeline = Pipeline([counting_step], cache=cache)
+    pipeline(make_email(valid_flat_payload, "Sale"))
+    email = make_email(valid_flat_payload, "Sale")
+
+    result = pipeline(email)
+
+    assert result.html is email.html
+    assert result.plain is email.plain
+
+
+def test_impure_steps_are_not_memoized(valid_flat_payload, cache):
+    """
+    Test that steps without @pure_step always run.
+    """
+    calls = []
+
+    def step(email):
+        calls.append(email.subject)
+        return email
+
+    pipeline = Pipeline([step], cache=cache)
+    pipeline(make_email(valid_flat_payload, "Sale"))
+    pipeline(make_email(valid_flat_payload, "Sale"))
+
+    assert len(calls) == 2
+    assert pipeline.steps == (step,)
+
+
+def test_versioned_pure_step_is_not_shared_across_versions(valid_flat_payload, cache):
+    """
+    Test that results are cached per version of the state the step depends on.
+    """
+    version = ["rules-1"]
+    calls = []
+
+    @pure_step(
+        reads=("subject",), writes=("campaign_type",), version=lambda: version[0]
+    )
+    def classify(email):
+        calls.append(version[0])
+        return email.model_copy(update={"campaign_type": version[0]})
+
+    pipeline = Pipeline([classify], cache=cache)
+    pipeline(make_email(valid_flat_payload, "Sale"))
+    version[0] = "rules-2"
+
+    result = pipeline(make_email(valid_flat_payload, "Sale"))
+
+    assert calls == ["rules-1", "rules-2"]
+    assert result.campaign_type == "rules-2"
+
+
+def test_concatenated_pipelines_keep_their_cache(
+    valid_flat_payload, cache, counting_step
+):
+    """
+    Test that steps keep the cache of their pipeline through `+` and nesting.
+    """
+    pipeline = Pipeline([counting_step], cache=cache) + Pipeline([])
+
+    pipeline(make_email(valid_flat_payload, "Sale"))
+    Pipeline([pipeline])(make_email(valid_flat_payload, "Sale"))
+
+    assert counting_step.calls == ["Sale"]
+    assert cache.stats()["hits"] == 1
+
+
+# --- Test the cache --- #
+
+
+def test_cache_evicts_least_recently_used_entries(cache):
+    """
+    Test that the cache stays within max_entries, evicting the oldest entry.
+    """
+    cache.put("a", {"value": 1})
+    cache.put("b", {"value": 2})
+    cache.get("a")
+    cache.put("c", {"value": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_entries_expire(cache):
+    """
+    Test that entries older than the time to live are not served.
+    """
+    with patch("cloudmailin.handlers.memo.time.monotonic", return_value=0):
+        cache.put("a", {"value": 1})
+    with patch("cloudmailin.handlers.memo.time.monotonic", return_value=61):
+        assert cache.get("a") is None
+
+    assert cache.stats()["expirations"] == 1
+
+
+def test_digest_fields_separates_field_boundaries():
+    """
+    Test that moving characters between fields changes the digest.
+    """
+    assert digest_fields(["ab", "c"]) != digest_fields(["a", "bc"])
+    assert digest_fields(["ab", "c"]) == digest_fields(["ab", "c"])
+
+
+def test_pure_step_requires_reads_and_writes():
+    """
+    Test that a pure step must declare the fields it reads and writes.
+    """
+    with pytest.raises(ValueError):
+        pure_step(reads=(), writes=("campaign_type",))
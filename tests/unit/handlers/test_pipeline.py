@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.pipeline import Pipeline, compile_pipeline, resolve_step
+from cloudmailin.handlers.steps import assign_campaign_type
+from cloudmailin.schemas import Email
+
+
+def step_one(email):
+    return email.model_copy(update={"subject": email.subject + " Step1"})
+
+
+def step_two(email):
+    return email.model_copy(update={"subject": email.subject + " Step2"})
+
+
+async def async_step(email):
+    await asyncio.sleep(0)
+    return email.model_copy(update={"subject": email.subject + " Async"})
+
+
+# --- Test pipeline execution and composition --- #
+
+
+def test_pipeline_applies_steps_in_order(valid_flat_payload):
+    """
+    Test that a pipeline passes the email through each step in order.
+    """
+    email = Email.from_flat_data(**valid_flat_payload)
+
+    result = Pipeline([step_one, step_two])(email)
+
+    assert result.subject == "Test Subject Step1 Step2"
+
+
+def test_pipelines_compose_by_concatenation_and_nesting():
+    """
+    Test that pipelines can be concatenated and used as steps of other pipelines.
+    """
+    first = Pipeline([step_one])
+    second = Pipeline([step_two])
+
+    assert (first + second).steps == (step_one, step_two)
+    assert Pipeline([first, second, step_one]).steps == (step_one, step_two, step_one)
+
+
+def test_pipeline_rejects_non_callable_steps():
+    """
+    Test that building a pipeline with a non callable step fails.
+    """
+    with pytest.raises(ValueError, match="not callable"):
+        Pipeline([step_one, "not a step"])
+
+
+# --- Test async steps --- #
+
+
+def test_acall_mixes_async_and_sync_steps(valid_flat_payload):
+    """
+    Test that acall awaits async steps and runs sync ones in order.
+    """
+    email = Email.from_flat_data(**valid_flat_payload)
+
+    result = asyncio.run(Pipeline([step_one, async_step, step_two]).acall(email))
+
+    assert result.subject == "Test Subject Step1 Async Step2"
+
+
+def test_sync_call_rejects_async_steps(valid_flat_payload):
+    """
+    Test that a pipeline with async steps cannot be called synchronously.
+    """
+    email = Email.from_flat_data(**valid_flat_payload)
+
+    with pytest.raises(TypeError, match="acall"):
+        Pipeline([step_one, async_step])(email)
+
+
+# --- Test resolution of dotted paths --- #
+
+
+def test_compile_pipeline_resolves_dotted_paths():
+    """
+    Test that dotted step paths are imported into a pipeline.
+    """
+    pipeline = compile_pipeline(["cloudmailin.handlers.steps.assign_campaign_type"])
+
+    assert pipeline.steps == (assign_campaign_type,)
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "assign_campaign_type",
+        "cloudmailin.handlers.missing_module.step",
+        "cloudmailin.handlers.steps.missing_step",
+        "cloudmailin.handlers.steps.Email.__doc__",
+    ],
+)
+def test_resolve_step_rejects_invalid_paths(path):
+    """
+    Test that unknown modules, missing attributes and non callables raise ValueError.
+    """
+    with pytest.raises(ValueError, match="Invalid step"):
+        resolve_step(path)
+
+
+# --- Test handlers built on pipelines --- #
+
+
+def test_handler_uses_given_pipeline_instead_of_steps(app_factory, valid_flat_payload):
+    """
+    Test that a handler applies the pipeline it was built with.
+    """
+    app = app_factory()
+    email = Email.from_flat_data(**valid_flat_payload)
+    handler = BaseHandler(pipeline=Pipeline([step_two]))
+
+    with app.app_context():
+        result = handler.handle(email)
+
+    assert result.subject == "Test Subject Step2"
+
+
+def test_handler_instance_is_reusable(app_factory, valid_flat_payload):
+    """
+    Test that one handler instance processes several emails independently.
+    """
+    app = app_factory()
+    handler = BaseHandler(pipeline=Pipeline([step_one]))
+
+    with app.app_context():
+        first = handler.handle(Email.from_flat_data(**valid_flat_payload))
+        second = handler.handle(Email.from_flat_data(**valid_flat_payload))
+
+    assert first.subject == second.subject == "Test Subject Step1"
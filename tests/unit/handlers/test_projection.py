@@ -0,0 +1,124 @@
+from unittest.mock import patch
+
+import pytest
+
+from cloudmailin.dedup import email_dedup_key
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.projection import (
+    DEFAULT_PROJECTION,
+    Projection,
+    compile_projection,
+)
+from cloudmailin.schemas import Email
+
+
+@pytest.fixture
+def email(valid_flat_payload):
+    return Email.from_flat_data(**valid_flat_payload)
+
+
+# --- Test projections --- #
+
+
+def test_default_projection_matches_model_dump(email):
+    """
+    Test that the default projection stores the same document as model_dump().
+    """
+    email = email.model_copy(update={"campaign_type": "promotion", "document_id": "x"})
+
+    assert DEFAULT_PROJECTION(email) == email.model_dump()
+
+
+def test_projection_picks_renames_and_drops_fields(email):
+    """
+    Test that a projection keeps the listed fields, under their new names.
+    """
+    projection = Projection(
+        fields=["sender", "subject", "html"],
+        exclude=["html"],
+        rename={"sender": "from"},
+    )
+
+    assert projection(email) == {
+        "from": "sender@example.com",
+        "subject": "Test Subject",
+    }
+
+
+def test_projection_keeps_native_types_and_adds_epoch_millis(email):
+    """
+    Test that dates stay datetimes and can be added as epoch milliseconds.
+    """
+    document = Projection(fields=["date"], epoch_millis="date_ms")(email)
+
+    assert document["date"] is email.date
+    assert document["date_ms"] == 1326733201000
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        ["sender"],
+        {"fields": "sender"},
+        {"fields": ["unknown"]},
+        {"rename": {"sender": "subject"}},
+        {"include": ["sender"]},
+        {"epoch_millis": ""},
+        {"epoch_millis": 1},
+        {"epoch_millis": "date"},
+        {"rename": {"sender": "from"}, "epoch_millis": "from"},
+    ],
+)
+def test_compile_projection_rejects_invalid_specs(spec):
+    """
+    Test that malformed storage sections raise a ValueError.
+    """
+    with pytest.raises(ValueError):
+        compile_projection(spec)
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"rename": {"html": "html_body"}},
+        {"exclude": ["plain"]},
+        {"fields": ["subject"]},
+    ],
+)
+def test_compile_projection_requires_body_fields_when_asked(spec):
+    """
+    Test that projections must keep the bodies when compression or offload needs them.
+    """
+    assert compile_projection(spec) is not None
+    with pytest.raises(ValueError, match="'plain' and 'html'"):
+        compile_projection(spec, body_fields_required=True)
+
+
+def test_compile_projection_allows_renaming_other_fields_with_body_fields_required():
+    """
+    Test that fields other than the bodies can still be renamed.
+    """
+    projection = compile_projection(
+        {"rename": {"sender": "from"}}, body_fields_required=True
+    )
+
+    assert projection.keeps_body_fields
+
+
+# --- Test storage through the handler --- #
+
+
+def test_handler_stores_projected_document(app_factory, email):
+    """
+    Test that the handler stores the document produced by its projection.
+    """
+    app = app_factory()
+    handler = BaseHandler(projection=Projection(fields=["subject"]))
+
+    with app.app_context():
+        with patch("cloudmailin.handlers.base_handler.get_db") as mock_get_db:
+            handler.handle(email)
+
+    mock_get_db.return_value.store_email.assert_called_once_with(
+        {"subject": "Test Subject"}, dedup_key=email_dedup_key(email)
+    )
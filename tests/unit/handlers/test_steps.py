@@ -1,4 +1,5 @@
 from cloudmailin.schemas import Email
+from cloudmailin.handlers.pipeline import Pipeline
 from cloudmailin.handlers.steps import assign_campaign_type
 
 # --- Test step-specific logic: assign_campaign_type --- #
@@ -30,6 +31,28 @@ def test_assign_campaign_type_with_no_match(valid_flat_payload):
     assert result.campaign_type == "unclassified"
 
 
+def test_assign_campaign_type_results_follow_the_configured_rules(
+    app_factory, valid_flat_payload, tmp_path
+):
+    """
+    Test that memoized results are not shared between different rule files.
+    """
+    path = tmp_path / "rules.yaml"
+    path.write_text("campaigns: {events: {keywords: [sale]}}")
+    valid_flat_payload["subject"] = "Spring Sale Campaign"
+    email = Email.from_flat_data(**valid_flat_payload)
+    default_app = app_factory()
+    custom_app = app_factory({"CAMPAIGN_RULES_PATH": str(path)})
+
+    with default_app.app_context():
+        default_result = Pipeline([assign_campaign_type])(email)
+    with custom_app.app_context():
+        custom_result = Pipeline([assign_campaign_type])(email)
+
+    assert default_result.campaign_type == "promotion"
+    assert custom_result.campaign_type == "events"
+
+
 # --- Test Field Integrity --- #
 
 
@@ -0,0 +1,78 @@
+import pytest
+
+
+@pytest.fixture
+def admin_app(app_factory, tmp_path, valid_yaml_config):
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(valid_yaml_config)
+    return app_factory({"ADMIN_TOKEN": "secret", "HANDLER_CONFIG_PATH": str(path)})
+
+
+AUTH = {"Authorization": "Bearer secret"}
+
+
+def test_admin_endpoints_are_hidden_without_token(client):
+    """
+    Test that the admin endpoints do not exist when ADMIN_TOKEN is not set.
+    """
+    response = client.post("/admin/handlers/reload")
+    assert response.status_code == 404
+
+
+def test_admin_endpoints_require_token(admin_app):
+    """
+    Test that requests without the right bearer token are rejected.
+    """
+    response = admin_app.test_client().post(
+        "/admin/handlers/reload", headers={"Authorization": "Bearer wrong"}
+    )
+    assert response.status_code == 401
+
+
+def test_reload_handlers_swaps_registry(admin_app):
+    """
+    Test that the reload endpoint installs a new handler registry.
+    """
+    previous = admin_app.config["handler_registry"]
+
+    response = admin_app.test_client().post("/admin/handlers/reload", headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "reloaded"
+    assert response.get_json()["rules"] == 2
+    assert admin_app.config["handler_registry"] is not previous
+
+
+def test_reload_handlers_reports_failure(admin_app, tmp_path):
+    """
+    Test that a failed reload returns the error and keeps the previous registry.
+    """
+    previous = admin_app.config["handler_registry"]
+    (tmp_path / "handler_config.yaml").write_text("not: [valid")
+
+    response = admin_app.test_client().post("/admin/handlers/reload", headers=AUTH)
+
+    assert response.status_code == 500
+    assert response.get_json()["status"] == "failed"
+    assert response.get_json()["last_error"]
+    assert admin_app.config["handler_registry"] is previous
+
+
+def test_handlers_status(admin_app):
+    """
+    Test that the status endpoint describes the loaded configuration.
+    """
+    response = admin_app.test_client().get("/admin/handlers", headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.get_json()["last_error"] is None
+
+
+def test_step_cache_stats(admin_app):
+    """
+    Test that the step cache counters are reported.
+    """
+    response = admin_app.test_client().get("/admin/step-cache", headers=AUTH)
+
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions"} <= set(response.get_json())
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from cloudmailin.asgi import AsgiApp
+from cloudmailin.async_db import get_async_client_pool
+from cloudmailin.db import get_client_pool
+from cloudmailin.handlers.base_handler import BaseHandler
+
+
+async def async_step(email):
+    await asyncio.sleep(0)
+    return email.model_copy(update={"subject": email.subject + " Async"})
+
+
+class AsyncStepHandler(BaseHandler):
+    steps = [async_step]
+
+
+class LegacyHandler(BaseHandler):
+    def handle(self, email):
+        return email.model_copy(update={"subject": "Legacy"})
+
+
+async def request(app, method, path, body=b"", headers=()):
+    """
+    Send one HTTP request to an ASGI app, returning the status, the headers
+    and the body of the response.
+    """
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), *headers],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+@pytest.fixture
+def asgi_app_factory(app_factory):
+    def _create_asgi_app(custom_config=None):
+        return AsgiApp(
+            app_factory({"STORAGE_BACKEND": "memory", **(custom_config or {})})
+        )
+
+    return _create_asgi_app
+
+
+def post_email(app, payload):
+    return asyncio.run(
+        request(app, "POST", "/generic/new", json.dumps(payload).encode())
+    )
+
+
+# --- Async ingest route --- #
+
+
+def test_async_route_stores_email(asgi_app_factory, valid_email_data):
+    """
+    Ensure /generic/new is served on the event loop and stores the email.
+    """
+    app = asgi_app_factory()
+
+    status, headers, body = post_email(app, valid_email_data)
+
+    assert status == 200
+    assert headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["subject"] == "Test Subject"
+    documents = get_client_pool(app.app).get_client().documents("test_dummy_collection")
+    assert len(documents) == 1
+
+
+def test_async_route_awaits_async_steps(asgi_app_factory, valid_email_data):
+    """
+    Ensure handlers with async steps are run through their async pipeline.
+    """
+    app = asgi_app_factory()
+    app.app.config["handler_registry"].register("sender@example.com", AsyncStepHandler)
+
+    _, _, body = post_email(app, valid_email_data)
+
+    assert json.loads(body)["subject"] == "Test Subject Async"
+
+
+def test_async_route_keeps_custom_sync_handlers(asgi_app_factory, valid_email_data):
+    """
+    Ensure a handler overriding handle() keeps its behaviour on the async route.
+    """
+    app = asgi_app_factory()
+    app.app.config["handler_registry"].register("sender@example.com", LegacyHandler)
+
+    _, _, body = post_email(app, valid_email_data)
+
+    assert json.loads(body)["subject"] == "Legacy"
+
+
+def test_async_route_rejects_invalid_emails(asgi_app_factory):
+    """
+    Ensure validation errors are answered with a 400, as on the WSGI app.
+    """
+    status, _, body = post_email(asgi_app_factory(), {"envelope": {}})
+
+    assert status == 400
+    assert json.loads(body)["error"] == "Validation failed"
+
+
+def test_async_route_rejects_oversized_bodies(asgi_app_factory, valid_email_data):
+    """
+    Ensure bodies above MAX_CONTENT_LENGTH get the JSON 413.
+    """
+    app = asgi_app_factory({"MAX_CONTENT_LENGTH": 100})
+
+    status, _, body = post_email(app, valid_email_data)
+
+    assert status == 413
+    assert json.loads(body)["error"] == "Payload Too Large"
+
+
+def test_async_route_keeps_writes_in_flight_concurrently(
+    asgi_app_factory, valid_email_data
+):
+    """
+    Ensure concurrent requests overlap on firestore.AsyncClient writes.
+    """
+    in_flight, peak = 0, 0
+
+    async def add(data):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        in_flight -= 1
+        return None, type("Reference", (), {"id": "document"})()
+
+    app = asgi_app_factory({"STORAGE_BACKEND": "firestore"})
+
+    async def post_all():
+        body = json.dumps(valid_email_data).encode()
+        return await asyncio.gather(
+            *(request(app, "POST", "/generic/new", body) for _ in range(20))
+        )
+
+    with patch("cloudmailin.async_db.firestore.AsyncClient") as client:
+        client.return_value.collection.return_value.add = add
+        responses = asyncio.run(post_all())
+
+    assert [status for status, _, _ in responses] == [200] * 20
+    assert peak == 20
+
+
+def test_async_route_spools_failed_writes_off_the_event_loop(
+    asgi_app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure emails that fail to persist are spooled from a worker thread.
+    """
+    appended_on = []
+
+    async def add(data):
+        raise RuntimeError("Firestore unavailable")
+
+    def append(self, *args):
+        appended_on.append(threading.current_thread())
+
+    app = asgi_app_factory({"STORAGE_BACKEND": "firestore", "SPOOL_DIR": tmp_path})
+
+    with patch("cloudmailin.async_db.firestore.AsyncClient") as client, patch(
+        "cloudmailin.spool.Spool.append", append
+    ):
+        client.return_value.collection.return_value.add = add
+        status, _, _ = post_email(app, valid_email_data)
+
+    assert status == 200
+    assert len(appended_on) == 1
+    assert appended_on[0] is not threading.main_thread()
+
+
+# --- Other routes and lifespan --- #
+
+
+def test_other_routes_are_served_by_the_wsgi_app(asgi_app_factory):
+    """
+    Ensure routes without an async view are handed to the Flask app.
+    """
+    status, _, body = asyncio.run(request(asgi_app_factory(), "GET", "/health/"))
+
+    assert status == 200
+    assert body
+
+
+def test_lifespan_shutdown_closes_async_client_pool(asgi_app_factory):
+    """
+    Ensure the async client pool is discarded when the server shuts down.
+    """
+    app = asgi_app_factory()
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    get_async_client_pool(app.app)
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert "firestore_async_pool" not in app.app.extensions
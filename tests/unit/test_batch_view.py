@@ -0,0 +1,182 @@
+import io
+import json
+from unittest.mock import Mock
+
+from flask import current_app
+
+from cloudmailin.generic import OversizedLine, iter_lines
+
+
+def to_ndjson(*payloads):
+    return "\n".join(
+        payload if isinstance(payload, str) else json.dumps(payload)
+        for payload in payloads
+    )
+
+
+# --- Line streaming --- #
+
+
+def test_iter_lines_splits_lines_across_chunk_boundaries():
+    """
+    Ensure lines are reassembled when they span several chunks.
+    """
+    stream = io.BytesIO(b'{"a": 1}\n{"b": 2}\n{"c": 3}')
+
+    assert list(iter_lines(stream, chunk_size=3)) == [
+        b'{"a": 1}',
+        b'{"b": 2}',
+        b'{"c": 3}',
+    ]
+
+
+def test_iter_lines_replaces_oversized_lines():
+    """
+    Ensure lines over the maximum length are yielded as OversizedLine, whether
+    they fit in one chunk or span several.
+    """
+    stream = io.BytesIO(b"short\n" + b"x" * 20 + b"\nok\n" + b"y" * 8)
+
+    lines = list(iter_lines(stream, chunk_size=4, max_line_length=6))
+    single = list(iter_lines(io.BytesIO(b"x" * 20 + b"\nok"), max_line_length=6))
+
+    assert lines[0] == b"short" and lines[2] == b"ok"
+    assert isinstance(lines[1], OversizedLine) and lines[1].length == 20
+    assert isinstance(lines[3], OversizedLine) and lines[3].length == 8
+    assert single[0].length == 20 and single[1] == b"ok"
+
+
+# --- Batch endpoint --- #
+
+
+def test_batch_processes_every_line(client, valid_email_data):
+    """
+    Ensure each valid line is processed and reported.
+    """
+    response = client.post(
+        "/generic/batch", data=to_ndjson(valid_email_data, valid_email_data)
+    )
+
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data["processed"] == 2
+    assert data["failed"] == 0
+    assert [result["status"] for result in data["results"]] == [
+        "processed",
+        "processed",
+    ]
+    assert data["results"][0]["handler"] == "BaseHandler"
+
+
+def test_batch_reports_invalid_lines_without_failing_the_request(
+    client, valid_email_data
+):
+    """
+    Ensure invalid JSON and invalid emails are reported per line.
+    """
+    invalid_email = json.loads(json.dumps(valid_email_data))
+    invalid_email["envelope"]["from"] = "invalid-email"
+
+    response = client.post(
+        "/generic/batch",
+        data=to_ndjson(valid_email_data, "{not json", invalid_email, "[]"),
+    )
+
+    data = response.get_json()
+    assert data["processed"] == 1
+    assert data["failed"] == 3
+    assert [result["line"] for result in data["results"]] == [1, 2, 3, 4]
+    assert "Invalid JSON" in data["results"][1]["error"]
+    assert data["results"][2]["error"] == "Validation failed"
+    assert data["results"][3]["error"] == "Validation failed"
+
+
+def test_batch_routes_each_line_through_handler_registry(app_factory, valid_email_data):
+    """
+    Ensure each email is handled by the handler registered for its sender.
+    """
+    app = app_factory()
+
+    with app.app_context():
+        MockHandler = type("MockHandler", (), {"handle": Mock()})
+        current_app.config["handler_registry"].register(
+            "sender@example.com", MockHandler
+        )
+
+        response = app.test_client().post(
+            "/generic/batch", data=to_ndjson(valid_email_data, valid_email_data)
+        )
+
+    assert MockHandler.handle.call_count == 2
+    assert response.get_json()["results"][0]["handler"] == "MockHandler"
+
+
+def test_batch_commits_storage_in_bulk(
+    app_factory, valid_email_data, mock_firestore_client
+):
+    """
+    Ensure the emails of a batch are committed with write batches, not one add() each.
+    """
+    app = app_factory({"BATCH_COMMIT_SIZE": 2})
+
+    app.test_client().post("/generic/batch", data=to_ndjson(*[valid_email_data] * 3))
+
+    client = mock_firestore_client.return_value
+    assert client.batch.return_value.commit.call_count == 2
+    assert client.batch.return_value.set.call_count == 3
+    client.collection.return_value.add.assert_not_called()
+
+
+def test_batch_skips_blank_lines(client, valid_email_data):
+    """
+    Ensure empty lines, including a trailing newline, are ignored.
+    """
+    response = client.post("/generic/batch", data=to_ndjson(valid_email_data) + "\n\n")
+
+    assert response.get_json()["results"] == [
+        {"line": 1, "status": "processed", "handler": "BaseHandler"}
+    ]
+
+
+def test_batch_reports_lines_whose_commit_failed(app_factory, valid_email_data):
+    """
+    Ensure emails lost by a failed bulk commit are reported as errors, not
+    as processed.
+    """
+    app = app_factory({"STORAGE_BACKEND": "memory", "MEMORY_STORAGE_ERROR_RATE": 1.0})
+
+    response = app.test_client().post(
+        "/generic/batch", data=to_ndjson(*[valid_email_data] * 3)
+    )
+
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["processed"] == 0
+    assert body["failed"] == 3
+    assert {result["status"] for result in body["results"]} == {"error"}
+
+
+def test_batch_reports_spooled_lines_when_commit_fails(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure emails the spool took after a failed bulk commit are reported as such.
+    """
+    app = app_factory(
+        {
+            "STORAGE_BACKEND": "memory",
+            "MEMORY_STORAGE_ERROR_RATE": 1.0,
+            "SPOOL_DIR": str(tmp_path),
+            "SPOOL_REPLAY_INTERVAL_SECONDS": None,
+            "BATCH_COMMIT_SIZE": 2,
+        }
+    )
+
+    response = app.test_client().post(
+        "/generic/batch", data=to_ndjson(*[valid_email_data] * 3)
+    )
+
+    body = response.get_json()
+    assert body["failed"] == 3
+    assert [result["status"] for result in body["results"]] == ["spooled"] * 3
+    assert app.extensions["spool"].status()["pending_writes"] == 3
@@ -0,0 +1,51 @@
+from benchmarks.__main__ import main
+from benchmarks.harness import compare_results, save_results
+
+
+def make_results(**times):
+    return {
+        "results": {
+            name: {"time_per_op_us": value, "peak_alloc_bytes": 100}
+            for name, value in times.items()
+        }
+    }
+
+
+# --- Comparison --- #
+
+
+def test_compare_flags_regressions_above_threshold():
+    """
+    Ensure only metrics that grew by more than the threshold are flagged.
+    """
+    comparisons = compare_results(
+        make_results(fast=10.0, slow=10.0),
+        make_results(fast=10.5, slow=12.0),
+        threshold_percent=10,
+    )
+
+    regressed = {(row.name, row.metric) for row in comparisons if row.regressed}
+    assert regressed == {("slow", "time_per_op_us")}
+
+
+def test_compare_ignores_benchmarks_missing_from_the_baseline():
+    """
+    Ensure new benchmarks are not reported against a baseline without them.
+    """
+    comparisons = compare_results(make_results(), make_results(new=5.0))
+
+    assert comparisons == []
+
+
+def test_compare_command_exits_with_error_on_regression(tmp_path, capsys):
+    """
+    Ensure `python -m benchmarks compare` fails when a benchmark regressed.
+    """
+    baseline, current = tmp_path / "baseline.json", tmp_path / "current.json"
+    save_results(make_results(handle=10.0), str(baseline))
+    save_results(make_results(handle=20.0), str(current))
+
+    status = main(["compare", str(baseline), str(current), "--threshold", "50"])
+
+    assert status == 1
+    assert "REGRESSION" in capsys.readouterr().out
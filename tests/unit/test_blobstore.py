@@ -0,0 +1,140 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from cloudmailin.blobstore import (
+    OFFLOAD_MARKER,
+    BlobStore,
+    LocalBlobStore,
+    StoredDocument,
+    get_blob_store,
+    offload_bodies,
+)
+from cloudmailin.compression import BodyCodec
+from cloudmailin.db import DatabaseHelper
+
+LARGE_HTML = "<tr><td>Product</td></tr>" * 100
+
+
+@pytest.fixture
+def blob_store(tmp_path):
+    return LocalBlobStore(str(tmp_path / "blobs"))
+
+
+# --- Local blob store --- #
+
+
+def test_local_blob_store_round_trip(blob_store):
+    """
+    Ensure a stored blob is read back by its SHA-256 digest.
+    """
+    digest = blob_store.put(b"body")
+
+    assert len(digest) == 64
+    assert blob_store.exists(digest)
+    assert blob_store.get(digest) == b"body"
+
+
+def test_identical_blobs_are_stored_once(blob_store):
+    """
+    Ensure identical bodies share a single file.
+    """
+    first = blob_store.put(b"newsletter body")
+    second = blob_store.put(b"newsletter body")
+
+    assert first == second
+    assert len(os.listdir(os.path.join(blob_store.directory, first[:2]))) == 1
+
+
+def test_blob_stores_must_implement_every_method():
+    """
+    Ensure an incomplete blob store fails when instantiated, not on first use.
+    """
+
+    class PutOnlyBlobStore(BlobStore):
+        def put(self, data: bytes) -> str:
+            return ""
+
+    with pytest.raises(TypeError):
+        PutOnlyBlobStore()
+
+
+# --- Offloading --- #
+
+
+def test_offload_keeps_only_digest_and_size(blob_store):
+    """
+    Ensure large bodies leave the document, which keeps their digest and size.
+    """
+    document = {"subject": "Hello", "plain": "Short", "html": LARGE_HTML}
+
+    stored = offload_bodies(document, blob_store, threshold=1024)
+
+    assert "html" not in stored
+    assert stored["plain"] == "Short"
+    assert stored[OFFLOAD_MARKER]["html"]["size"] == len(LARGE_HTML)
+    assert blob_store.exists(stored[OFFLOAD_MARKER]["html"]["sha256"])
+
+
+def test_stored_document_fetches_bodies_lazily(blob_store):
+    """
+    Ensure offloaded bodies are only read from the blob store when accessed.
+    """
+    stored = offload_bodies({"subject": "Hello", "html": LARGE_HTML}, blob_store, 1024)
+    spy = MagicMock(wraps=blob_store)
+
+    document = StoredDocument(stored, spy)
+    assert document["subject"] == "Hello"
+    spy.get.assert_not_called()
+
+    assert document["html"] == LARGE_HTML
+    assert document["html"] == LARGE_HTML
+    spy.get.assert_called_once()
+    assert dict(document) == {"subject": "Hello", "html": LARGE_HTML}
+
+
+def test_stored_document_decompresses_offloaded_bodies(blob_store):
+    """
+    Ensure bodies both compressed and offloaded are restored.
+    """
+    encoded = BodyCodec("zlib", threshold=1024).encode_document({"html": LARGE_HTML})
+
+    stored = offload_bodies(encoded, blob_store, threshold=16)
+
+    assert stored[OFFLOAD_MARKER]["html"]["encoding"] is None
+    assert StoredDocument(stored, blob_store)["html"] == LARGE_HTML
+
+
+# --- Configuration and storage --- #
+
+
+def test_unknown_blob_store_is_rejected():
+    """
+    Ensure an unknown BLOB_STORE fails at startup.
+    """
+    with pytest.raises(ValueError, match="Unknown blob store"):
+        get_blob_store({"BLOB_STORE": "s3"})
+
+
+def test_store_email_offloads_large_bodies(app_factory, tmp_path):
+    """
+    Ensure the database helper writes the offloaded document.
+    """
+    app = app_factory(
+        {
+            "BLOB_STORE": "local",
+            "BLOB_STORE_DIR": str(tmp_path),
+            "BLOB_OFFLOAD_THRESHOLD": 1024,
+        }
+    )
+
+    with app.app_context():
+        helper = DatabaseHelper(
+            app.config, client=MagicMock(), blob_store=app.extensions["blob_store"]
+        )
+        helper.store_email({"subject": "Hello", "html": LARGE_HTML})
+
+    stored = helper.client.collection.return_value.add.call_args.args[0]
+    assert "html" not in stored
+    assert StoredDocument(stored, app.extensions["blob_store"])["html"] == LARGE_HTML
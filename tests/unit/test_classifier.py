@@ -0,0 +1,189 @@
+import textwrap
+
+import pytest
+
+from cloudmailin.classifier import (
+    DEFAULT_CAMPAIGN_RULES_PATH,
+    CampaignClassifier,
+    CampaignRule,
+    KeywordMatcher,
+    get_campaign_classifier,
+    load_campaign_rules,
+)
+from cloudmailin.schemas import Email
+
+
+def rule(name, keywords, priority=0, **field_weights):
+    return CampaignRule(name, priority, tuple(keywords), field_weights)
+
+
+@pytest.fixture
+def email(valid_flat_payload):
+    valid_flat_payload.update(
+        subject="Spring sale", plain="Your order confirmation", html="<p>Hi</p>"
+    )
+    return Email.from_flat_data(**valid_flat_payload)
+
+
+# --- Keyword matching --- #
+
+
+def test_keyword_matcher_finds_words_and_phrases():
+    """
+    Ensure single words, phrases and punctuation keywords are found in one scan.
+    """
+    matcher = KeywordMatcher(["Sale", "order confirmation", "% off", "missing"])
+
+    found = matcher.find("big sale: 50% off! your order confirmation.")
+
+    assert found == {"sale", "order confirmation", "% off"}
+
+
+def test_keyword_matcher_matches_whole_words_only():
+    """
+    Ensure keywords do not match inside longer words.
+    """
+    matcher = KeywordMatcher(["sale", "order confirmation"])
+
+    assert matcher.find("wholesale salesforce order confirmations") == set()
+
+
+@pytest.mark.parametrize(
+    "subject, campaign_type",
+    [
+        ("Spring Sale", "promotion"),
+        ("Summer Sales", "promotion"),
+        # Matched by the former substring check, no longer a promotion
+        ("Wholesale prices", "unclassified"),
+    ],
+)
+def test_shipped_rules_match_whole_words(valid_flat_payload, subject, campaign_type):
+    """
+    Ensure the shipped rules list the forms of "sale" they match, as keywords
+    no longer match inside other words.
+    """
+    valid_flat_payload["subject"] = subject
+    email = Email.from_flat_data(**valid_flat_payload)
+
+    classifier = load_campaign_rules(DEFAULT_CAMPAIGN_RULES_PATH)
+
+    assert classifier.classify(email) == campaign_type
+
+
+# --- Classification --- #
+
+
+def test_classifier_applies_field_weights(email):
+    """
+    Ensure a campaign only scores the weights of the fields its keywords are in.
+    """
+    classifier = CampaignClassifier(
+        [rule("promotion", ["sale"]), rule("transactional", ["order confirmation"])],
+        field_weights={"subject": 2.0, "plain": 0.5, "html": 0.5},
+    )
+
+    assert classifier.scores(email) == {"promotion": 2.0, "transactional": 0.5}
+    assert classifier.classify(email) == "promotion"
+
+
+def test_classifier_prefers_priority_over_score(email):
+    """
+    Ensure the highest priority candidate wins, even with a lower score.
+    """
+    classifier = CampaignClassifier(
+        [
+            rule("promotion", ["sale"]),
+            rule("transactional", ["order confirmation"], priority=5),
+        ],
+        min_score=0.5,
+    )
+
+    assert classifier.classify(email) == "transactional"
+
+
+def test_classifier_ignores_campaigns_below_min_score(email):
+    """
+    Ensure campaigns scoring less than min_score are not assigned.
+    """
+    classifier = CampaignClassifier(
+        [rule("transactional", ["order confirmation"], plain=0.5)]
+    )
+
+    assert classifier.classify(email) == "unclassified"
+
+
+# --- Loading rules --- #
+
+
+def write_rules(tmp_path, content):
+    path = tmp_path / "campaign_rules.yaml"
+    path.write_text(textwrap.dedent(content))
+    return str(path)
+
+
+def test_load_campaign_rules(tmp_path, email):
+    """
+    Ensure rules are loaded with their priority and field weights.
+    """
+    path = write_rules(
+        tmp_path,
+        """
+        min_score: 0.5
+        fields: {subject: 1.0, plain: 0.5, html: 0.0}
+        campaigns:
+          transactional:
+            priority: 5
+            keywords: ["order confirmation"]
+          promotion:
+            fields: {subject: 3.0}
+            keywords: ["sale"]
+        """,
+    )
+
+    classifier = load_campaign_rules(path)
+
+    assert classifier.rules[0].priority == 5
+    assert classifier.scores(email) == {"transactional": 0.5, "promotion": 3.0}
+    assert classifier.classify(email) == "transactional"
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "rules: []",
+        "campaigns: {promotion: [sale]}",
+        "campaigns: {promotion: {keywords: sale}}",
+        "campaigns: {promotion: {keywords: [sale], priority: high}}",
+        "campaigns: {promotion: {keywords: [sale], fields: {body: 1.0}}}",
+    ],
+)
+def test_load_campaign_rules_rejects_invalid_rules(tmp_path, content):
+    """
+    Ensure malformed rule files raise a ValueError.
+    """
+    with pytest.raises(ValueError, match="Invalid campaign rules"):
+        load_campaign_rules(write_rules(tmp_path, content))
+
+
+def test_get_campaign_classifier_uses_configured_rules(app_factory, tmp_path):
+    """
+    Ensure the classifier is loaded from CAMPAIGN_RULES_PATH, once.
+    """
+    path = write_rules(tmp_path, "campaigns: {events: {keywords: [webinar]}}")
+    app = app_factory({"CAMPAIGN_RULES_PATH": path})
+
+    with app.app_context():
+        classifier = get_campaign_classifier()
+        assert get_campaign_classifier() is classifier
+
+    assert [rule.name for rule in classifier.rules] == ["events"]
+
+
+def test_invalid_campaign_rules_fail_app_creation(app_factory, tmp_path):
+    """
+    Ensure the rules are validated when the app is created, not on a request.
+    """
+    path = write_rules(tmp_path, "campaigns: {promotion: {keywords: sale}}")
+
+    with pytest.raises(ValueError, match="Invalid campaign rules"):
+        app_factory({"CAMPAIGN_RULES_PATH": path})
@@ -0,0 +1,103 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from cloudmailin.compression import (
+    COMPRESSION_MARKER,
+    BodyCodec,
+    decode_document,
+    get_body_codec,
+)
+from cloudmailin.db import DatabaseHelper
+
+LARGE_HTML = "<tr><td style='padding: 4px'>Product</td></tr>" * 200
+
+
+@pytest.fixture
+def codec():
+    return BodyCodec("zlib", threshold=1024)
+
+
+# --- Encoding and decoding --- #
+
+
+def test_encode_compresses_large_bodies_only(codec):
+    """
+    Ensure bodies above the threshold are stored as compressed bytes.
+    """
+    document = {"subject": "Hello", "plain": "Short body", "html": LARGE_HTML}
+
+    encoded = codec.encode_document(document)
+
+    assert isinstance(encoded["html"], bytes)
+    assert len(encoded["html"]) < len(LARGE_HTML)
+    assert encoded["plain"] == "Short body"
+    assert encoded[COMPRESSION_MARKER] == {"html": "zlib"}
+    assert document["html"] == LARGE_HTML
+
+
+def test_decode_restores_original_document(codec):
+    """
+    Ensure decode_document reverses encode_document.
+    """
+    document = {"subject": "Hello", "plain": "Ünïcödé " * 500, "html": LARGE_HTML}
+
+    assert decode_document(codec.encode_document(document)) == document
+
+
+def test_incompressible_bodies_are_stored_raw():
+    """
+    Ensure a body is left as text when compressing it would not make it smaller.
+    """
+    codec = BodyCodec("zlib", threshold=16)
+    document = {"plain": "abcdefghijklmnopqrst", "html": ""}
+
+    assert codec.encode_document(document) is document
+
+
+def test_documents_without_marker_are_decoded_unchanged():
+    """
+    Ensure documents stored before compression was enabled are read as is.
+    """
+    document = {"subject": "Hello", "html": "<p>Hi</p>"}
+
+    assert decode_document(document) is document
+
+
+# --- Configuration --- #
+
+
+def test_unknown_codec_is_rejected():
+    """
+    Ensure an unsupported codec fails at startup.
+    """
+    with pytest.raises(ValueError, match="Unsupported compression codec"):
+        get_body_codec({"STORAGE_COMPRESSION": "brotli"})
+
+
+def test_compression_is_disabled_by_default(app_factory):
+    """
+    Ensure bodies are stored raw unless STORAGE_COMPRESSION is set.
+    """
+    app = app_factory()
+
+    assert app.extensions["body_codec"] is None
+
+
+def test_store_email_compresses_bodies(app_factory):
+    """
+    Ensure the database helper stores the encoded document.
+    """
+    app = app_factory(
+        {"STORAGE_COMPRESSION": "zlib", "STORAGE_COMPRESSION_THRESHOLD": 1024}
+    )
+
+    with app.app_context():
+        helper = DatabaseHelper(
+            app.config, client=MagicMock(), codec=app.extensions["body_codec"]
+        )
+        helper.store_email({"subject": "Hello", "html": LARGE_HTML})
+
+    stored = helper.client.collection.return_value.add.call_args.args[0]
+    assert stored[COMPRESSION_MARKER] == {"html": "zlib"}
+    assert decode_document(stored)["html"] == LARGE_HTML
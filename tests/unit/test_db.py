@@ -140,3 +140,179 @@ def test_missing_firestore_collection_raises_error(app_factory):
             ValueError, match="FIRESTORE_COLLECTION is required but not configured."
         ):
             DatabaseHelper(app.config)
+
+
+# --- Tests for the process-wide client pool --- #
+
+
+def test_get_db_reuses_pooled_client_across_requests(
+    app_factory, mock_firestore_client
+):
+    """
+    Ensure helpers created in different app contexts share the same Firestore client.
+    """
+    app = app_factory()
+
+    with app.app_context():
+        first_client = db.get_db().client
+
+    with app.app_context():
+        second_client = db.get_db().client
+
+    assert first_client is second_client
+    mock_firestore_client.assert_called_once_with(database="cloudmailin")
+
+
+def test_client_pool_hands_out_clients_round_robin(mock_firestore_client):
+    """
+    Ensure the pool creates the configured number of clients and rotates through them.
+    """
+    mock_firestore_client.side_effect = [MagicMock(), MagicMock()]
+
+    pool = db.FirestoreClientPool(database="cloudmailin", size=2)
+    clients = [pool.get_client() for _ in range(4)]
+
+    assert len(pool) == 2
+    assert clients[0] is clients[2]
+    assert clients[1] is clients[3]
+    assert clients[0] is not clients[1]
+
+
+def test_client_pool_rejects_invalid_size():
+    """
+    Ensure the pool refuses to be created without any client.
+    """
+    with pytest.raises(ValueError, match="FIRESTORE_CHANNEL_POOL_SIZE"):
+        db.FirestoreClientPool(database="cloudmailin", size=0)
+
+
+def test_client_pool_opens_channel_with_configured_keepalive(mock_firestore_client):
+    """
+    Ensure a custom keepalive makes the pool build the gRPC channel itself.
+    """
+    mock_firestore_client.return_value._emulator_host = None
+
+    with patch("cloudmailin.db._open_channel") as mock_open_channel:
+        db.FirestoreClientPool(database="cloudmailin", keepalive_ms=60000)
+
+    mock_open_channel.assert_called_once_with(mock_firestore_client.return_value, 60000)
+
+
+def test_open_channel_rebuilds_transport_of_real_firestore_client():
+    """
+    Ensure the private attributes used to build the channel exist on the
+    installed google-cloud-firestore client.
+    """
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud.firestore_v1.client import Client
+    from google.cloud.firestore_v1.services.firestore.transports import grpc
+
+    # firestore.Client itself is mocked by the autouse fixture
+    client = Client(
+        project="test-project",
+        credentials=AnonymousCredentials(),
+        database="cloudmailin",
+    )
+    create_channel = grpc.FirestoreGrpcTransport.create_channel
+
+    with patch.object(
+        grpc.FirestoreGrpcTransport, "create_channel", wraps=create_channel
+    ) as mock_create_channel:
+        db._open_channel(client, 60000)
+
+    try:
+        options = dict(mock_create_channel.call_args.kwargs["options"])
+        assert options["grpc.keepalive_time_ms"] == 60000
+        assert client._firestore_api.transport is client._transport
+        assert isinstance(client._transport, grpc.FirestoreGrpcTransport)
+    finally:
+        db._close_channel(client)
+
+
+def test_client_pool_falls_back_to_default_channel(mock_firestore_client, caplog):
+    """
+    Ensure a client whose channel cannot be rebuilt keeps its default channel.
+    """
+    mock_firestore_client.return_value._emulator_host = None
+
+    with patch("cloudmailin.db._open_channel", side_effect=AttributeError("_target")):
+        pool = db.FirestoreClientPool(database="cloudmailin", keepalive_ms=60000)
+
+    assert pool.get_client() is mock_firestore_client.return_value
+    assert "using the default gRPC channel" in caplog.text
+
+
+def test_client_pool_registers_exit_handler_when_created(
+    app_factory, mock_firestore_client
+):
+    """
+    Ensure the pool is closed at exit once, only for apps that created one.
+    """
+    with patch("cloudmailin.db.atexit.register") as mock_register:
+        app = app_factory()
+        app_factory()
+        db.get_client_pool(app)
+        db.get_client_pool(app)
+
+    mock_register.assert_called_once_with(db.close_client_pool, app)
+
+
+def test_close_client_pool_closes_channels_and_discards_pool(
+    app_factory, mock_firestore_client
+):
+    """
+    Ensure closing the pool closes every client channel and removes it from the app.
+    """
+    app = app_factory()
+
+    with app.app_context():
+        client = db.get_db().client
+
+    db.close_client_pool(app)
+
+    client._firestore_api_internal.transport.close.assert_called_once()
+    assert "firestore_pool" not in app.extensions
+
+
+def test_collection_override_works_on_top_of_pooled_client(app_factory):
+    """
+    Ensure the per-request collection override is applied to the shared client.
+    """
+    app = app_factory({"FIRESTORE_COLLECTION": "default_collection"})
+
+    with app.test_request_context(headers={"X-Firestore-Collection": "override"}):
+        app.preprocess_request()
+        helper = db.get_db()
+        helper.get_collection()
+
+    helper.client.collection.assert_called_once_with("override")
+
+
+@patch("cloudmailin.db.firestore.Client")
+def test_store_email_returns_document_id(mock_firestore_client, app_factory):
+    """
+    Ensure store_email returns the id of the document Firestore created.
+    """
+    app = app_factory({"FIRESTORE_COLLECTION": "custom_collection"})
+
+    with app.app_context():
+        helper = DatabaseHelper(app.config)
+        mock_collection = mock_firestore_client.return_value.collection.return_value
+        mock_collection.add.return_value = (MagicMock(), MagicMock(id="new-id"))
+
+        assert helper.store_email({"sender": "test@example.com"}) == "new-id"
+
+
+@patch("cloudmailin.db.firestore.Client")
+def test_store_email_returns_none_on_failure(mock_firestore_client, app_factory):
+    """
+    Ensure store_email returns no id when the email could not be stored.
+    """
+    app = app_factory({"FIRESTORE_COLLECTION": "custom_collection"})
+
+    with app.app_context():
+        helper = DatabaseHelper(app.config)
+        mock_collection = mock_firestore_client.return_value.collection.return_value
+        mock_collection.add.side_effect = Exception("Firestore error")
+
+        assert helper.store_email({"sender": "test@example.com"}) is None
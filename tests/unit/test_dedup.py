@@ -0,0 +1,215 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cloudmailin.db import DatabaseHelper
+from cloudmailin.dedup import (
+    BloomFilter,
+    RotatingBloomFilter,
+    dedup_key,
+    document_id_for,
+    email_dedup_key,
+)
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.projection import Projection
+from cloudmailin.schemas import Email
+
+
+@pytest.fixture
+def email_data():
+    return {
+        "sender": "sender@example.com",
+        "recipient": "recipient@example.com",
+        "subject": "Hello",
+        "date": datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        "message_id": "<4F145791.8040802@example.com>",
+    }
+
+
+# --- Dedup keys --- #
+
+
+def test_message_id_is_parsed_from_headers(valid_email_data):
+    """
+    Ensure the Message-ID header is kept on the email.
+    """
+    valid_email_data["headers"]["message_id"] = "<abc@example.com>"
+
+    assert Email.model_validate(valid_email_data).message_id == "<abc@example.com>"
+
+
+def test_dedup_key_uses_message_id_and_recipient(email_data):
+    """
+    Ensure retries share a key, but copies for other recipients do not.
+    """
+    retry = dict(email_data, message_id="4F145791.8040802@example.com", subject="X")
+    other_recipient = dict(email_data, recipient="another@example.com")
+
+    assert dedup_key(retry) == dedup_key(email_data)
+    assert dedup_key(other_recipient) != dedup_key(email_data)
+
+
+def test_dedup_key_falls_back_to_content(email_data):
+    """
+    Ensure emails without Message-ID are identified by sender, date and subject.
+    """
+    email_data["message_id"] = None
+
+    assert dedup_key(email_data) == dedup_key(dict(email_data, plain="Other body"))
+    assert dedup_key(email_data) != dedup_key(dict(email_data, subject="Other"))
+
+
+def test_email_dedup_key_matches_document_key(valid_email_data):
+    """
+    Ensure the key read from an Email equals the key of its default document.
+    """
+    valid_email_data["headers"]["message_id"] = "<abc@example.com>"
+    email = Email.model_validate(valid_email_data)
+
+    assert email_dedup_key(email) == dedup_key(email.model_dump())
+
+
+def test_projected_emails_are_deduplicated_by_email_identity(
+    app_factory, valid_email_data
+):
+    """
+    Ensure a projection dropping the identifying fields does not collapse
+    distinct emails onto one dedup key.
+    """
+    app = app_factory({"DEDUP_ENABLED": True, "STORAGE_BACKEND": "memory"})
+    handler = BaseHandler(projection=Projection(fields=["plain"]))
+    first = Email.model_validate(valid_email_data)
+    second = first.model_copy(update={"subject": "Another email"})
+
+    with app.test_request_context():
+        first_id = handler.handle(first).document_id
+        second_id = handler.handle(second).document_id
+
+    assert first_id != second_id
+
+
+# --- Bloom filters --- #
+
+
+def test_bloom_filter_has_no_false_negatives():
+    """
+    Ensure every added key is reported as present.
+    """
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for index in range(1000):
+        bloom.add(f"key-{index}")
+
+    assert all(f"key-{index}" in bloom for index in range(1000))
+    false_positives = sum(f"other-{index}" in bloom for index in range(10000))
+    assert false_positives < 300
+
+
+def test_rotating_bloom_filter_forgets_after_two_rotations():
+    """
+    Ensure keys are remembered for one rotation and forgotten after two.
+    """
+    bloom = RotatingBloomFilter(capacity=1, error_rate=0.01, rotation_seconds=None)
+    bloom.add("first")
+    bloom.add("second")
+    assert "first" in bloom
+
+    bloom.add("third")
+    assert "first" not in bloom
+    assert "second" in bloom
+
+
+# --- Storage --- #
+
+
+@pytest.fixture
+def helper(app_factory):
+    app = app_factory({"DEDUP_ENABLED": True})
+    with app.app_context():
+        helper = DatabaseHelper(
+            app.config,
+            client=MagicMock(),
+            dedup=app.extensions["dedup_filter"],
+        )
+        yield helper
+
+
+def test_new_email_is_set_under_deterministic_id_without_lookup(helper, email_data):
+    """
+    Ensure a new email is written with set() to its dedup id, skipping the lookup.
+    """
+    document_id = helper.store_email(email_data)
+
+    collection = helper.client.collection.return_value
+    assert document_id == document_id_for(dedup_key(email_data))
+    collection.document.assert_called_once_with(document_id)
+    collection.document.return_value.set.assert_called_once_with(email_data)
+    collection.document.return_value.get.assert_not_called()
+    collection.add.assert_not_called()
+
+
+def test_duplicate_email_is_skipped(helper, email_data):
+    """
+    Ensure a retried delivery of a stored email is not written again.
+    """
+    helper.store_email(email_data)
+    document = helper.client.collection.return_value.document.return_value
+    document.get.return_value.exists = True
+
+    helper.store_email(dict(email_data))
+
+    document.get.assert_called_once()
+    document.set.assert_called_once()
+
+
+def test_bloom_false_positive_still_stores_email(helper, email_data):
+    """
+    Ensure a false positive of the filter costs a lookup, never the email.
+    """
+    helper.dedup.add(dedup_key(email_data))
+    document = helper.client.collection.return_value.document.return_value
+    document.get.return_value.exists = False
+
+    helper.store_email(email_data)
+
+    document.get.assert_called_once()
+    document.set.assert_called_once_with(email_data)
+
+
+def test_failed_lookup_still_stores_email(helper, email_data):
+    """
+    Ensure the email is written when the duplicate lookup fails.
+    """
+    helper.dedup.add(dedup_key(email_data))
+    document = helper.client.collection.return_value.document.return_value
+    document.get.side_effect = Exception("Firestore unavailable")
+
+    helper.store_email(email_data)
+
+    document.set.assert_called_once_with(email_data)
+
+
+def test_duplicates_within_a_batch_are_written_once(helper, email_data):
+    """
+    Ensure the same email twice in a bulk commit is only written once.
+    """
+
+    def document(document_id):
+        return MagicMock(id=document_id, **{"get.return_value.exists": False})
+
+    helper.client.collection.return_value.document.side_effect = document
+
+    with patch.object(helper, "_commit_pending_writes"):
+        with helper.batched():
+            helper.store_email(email_data)
+            helper.store_email(dict(email_data))
+            assert len(helper._pending_writes) == 1
+
+
+def test_dedup_is_disabled_by_default(app_factory):
+    """
+    Ensure the Bloom filter is only created when DEDUP_ENABLED is set.
+    """
+    app = app_factory()
+
+    assert "dedup_filter" not in app.extensions
@@ -150,3 +150,18 @@ def test_preprocess_payload_raises_valuerror_for_invalid_date(valid_nested_paylo
 
     with pytest.raises(ValueError, match="Invalid date format"):
         Email.preprocess_payload(valid_nested_payload)
+
+
+def test_preprocess_payload_accepts_obsolete_rfc2822_dates(valid_nested_payload):
+    """
+    Test preprocess_payload with a date missing its weekday and using an obsolete zone.
+
+    Ensures that real-world RFC 2822 variants are accepted.
+    """
+    valid_nested_payload["headers"]["date"] = "16 Jan 2012 12:00:01 EST"
+
+    result = Email.preprocess_payload(valid_nested_payload)
+
+    assert result["date"] == datetime.strptime(
+        "Mon, 16 Jan 2012 17:00:01 +0000", "%a, %d %b %Y %H:%M:%S %z"
+    )
@@ -39,7 +39,7 @@ def test_create_app_initializes_handler_registry_correctly():
         app = create_app()
 
         # Verify the function was called with the expected configuration path
-        mock_init.assert_called_once_with("config/handler_config.yaml")
+        mock_init.assert_called_once_with("config/handler_config.yaml", False)
 
         # Verify the registry in the app is the mocked registry
         assert (
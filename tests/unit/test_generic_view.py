@@ -191,3 +191,70 @@ def test_generic_view_missing_required_fields(
     data = response.get_json()
     assert "error" in data
     assert error_message in data["error"]
+
+
+# --- Response profile tests --- #
+
+
+def test_generic_view_summary_profile_returns_document_id(
+    app_factory, valid_email_data, mock_firestore_client
+):
+    """
+    Test that the summary profile returns only the stored document id, handler and status.
+    """
+    app = app_factory({"RESPONSE_PROFILE": "summary"})
+    collection = mock_firestore_client.return_value.collection.return_value
+    collection.add.return_value = (Mock(), Mock(id="stored-document-id"))
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "id": "stored-document-id",
+        "handler": "BaseHandler",
+        "status": "processed",
+    }
+
+
+def test_generic_view_empty_profile_returns_204(app_factory, valid_email_data):
+    """
+    Test that the empty profile replies with a 204 and no body.
+    """
+    app = app_factory({"RESPONSE_PROFILE": "empty"})
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 204
+    assert response.data == b""
+
+
+def test_generic_view_profile_header_overrides_config(
+    client, valid_email_data, mock_firestore_client
+):
+    """
+    Test that the X-Response-Profile header overrides the configured profile.
+    """
+    collection = mock_firestore_client.return_value.collection.return_value
+    collection.add.return_value = (Mock(), Mock(id="stored-document-id"))
+
+    response = client.post(
+        "/generic/new",
+        json=valid_email_data,
+        headers={"X-Response-Profile": "summary"},
+    )
+
+    assert set(response.get_json()) == {"id", "handler", "status"}
+
+
+def test_generic_view_ignores_unknown_profile_header(client, valid_email_data):
+    """
+    Test that an unknown profile in the header falls back to the configured profile.
+    """
+    response = client.post(
+        "/generic/new",
+        json=valid_email_data,
+        headers={"X-Response-Profile": "verbose"},
+    )
+
+    assert response.status_code == 200
+    assert "html" in response.get_json()
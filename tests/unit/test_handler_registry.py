@@ -1,13 +1,19 @@
+import os
+import textwrap
+
 import pytest
 from unittest.mock import patch, mock_open
 
 import yaml
 
 from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.steps import assign_campaign_type
 
 from cloudmailin.handler_registry import (
     HandlerRegistry,
     HANDLERS_MAP,
+    RegistryReloader,
+    normalize_sender,
     load_config,
     initialize_handler_registry_from_config,
 )
@@ -178,3 +184,357 @@ def test_initialize_handler_registry_from_config(valid_yaml_config, app_factory)
             registry.get_handler_for_sender("promo@example.com")
             == HANDLERS_MAP["CampaignClassifierHandler"]
         )
+
+
+# --- Test sender rules --- #
+
+
+class MockHandler:
+    def handle(self, email):
+        return email
+
+
+class OtherMockHandler(MockHandler):
+    pass
+
+
+@pytest.mark.parametrize(
+    "sender, expected",
+    [
+        ("Newsletter@Example.com", "newsletter@example.com"),
+        ("newsletter+weekly@example.com", "newsletter@example.com"),
+        ("info@bücher.de", "info@xn--bcher-kva.de"),
+        ("not-an-address", "not-an-address"),
+    ],
+)
+def test_normalize_sender(sender, expected):
+    """
+    Test that senders are lowercased, stripped of plus tags and IDN-encoded.
+    """
+    assert normalize_sender(sender) == expected
+
+
+def test_exact_rules_match_normalized_senders():
+    """
+    Test that exact rules match regardless of case and plus-addressing.
+    """
+    registry = HandlerRegistry()
+    registry.register("Newsletter@Example.com", MockHandler)
+
+    assert registry.get_handler_for_sender("newsletter+tag@EXAMPLE.com") == MockHandler
+
+
+def test_domain_wildcard_matches_domain_but_not_subdomains():
+    """
+    Test that "*@domain" matches every address of the domain only.
+    """
+    registry = HandlerRegistry()
+    registry.register("*@example.com", MockHandler)
+
+    assert registry.get_handler_for_sender("anyone@example.com") == MockHandler
+    assert registry.get_handler_for_sender("anyone@mail.example.com") == BaseHandler
+    assert registry.get_handler_for_sender("anyone@notexample.com") == BaseHandler
+
+
+def test_subdomain_wildcard_matches_nested_subdomains():
+    """
+    Test that "*@*.domain" matches every subdomain, but not the domain itself.
+    """
+    registry = HandlerRegistry()
+    registry.register("*@*.example.com", MockHandler)
+
+    assert registry.get_handler_for_sender("a@mail.example.com") == MockHandler
+    assert registry.get_handler_for_sender("a@eu.mail.example.com") == MockHandler
+    assert registry.get_handler_for_sender("a@example.com") == BaseHandler
+
+
+def test_regex_rules_match_whole_address():
+    """
+    Test that "re:" rules are matched against the whole normalized address.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:promo-\d+@shop\.com", MockHandler)
+
+    assert registry.get_handler_for_sender("Promo-42@shop.com") == MockHandler
+    assert registry.get_handler_for_sender("promo-42@shop.com.evil") == BaseHandler
+
+
+def test_regex_rules_see_plus_tags():
+    """
+    Test that regexes match the address as received, while exact rules
+    ignore its plus tag.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:.*\+promo@shop\.com", MockHandler)
+    registry.register("news@shop.com", OtherMockHandler)
+
+    assert registry.get_handler_for_sender("Deals+Promo@shop.com") == MockHandler
+    assert registry.get_handler_for_sender("news+promo@shop.com") == OtherMockHandler
+    assert registry.get_handler_for_sender("deals@shop.com") == BaseHandler
+
+
+def test_rule_precedence():
+    """
+    Test that exact rules win over domain rules, more specific domains over
+    less specific ones, and domain rules over regexes.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:.*@.*", BaseHandler)
+    registry.register("*@*.example.com", MockHandler)
+    registry.register("*@mail.example.com", OtherMockHandler)
+    registry.register("ceo@mail.example.com", MockHandler)
+
+    assert registry.get_handler_for_sender("ceo@mail.example.com") == MockHandler
+    assert registry.get_handler_for_sender("a@mail.example.com") == OtherMockHandler
+    assert registry.get_handler_for_sender("a@eu.mail.example.com") == MockHandler
+
+
+def test_regex_rules_registered_after_a_lookup_are_matched():
+    """
+    Test that the combined pattern is recompiled after a new registration.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:a@.*", MockHandler)
+    registry.get_handler_for_sender("a@example.com")
+
+    registry.register(r"re:b@.*", OtherMockHandler)
+
+    assert registry.get_handler_for_sender("b@example.com") == OtherMockHandler
+
+
+@pytest.mark.parametrize(
+    "rule, sender",
+    [
+        (r"re:(?i)BAR@y\.com", "bar@y.com"),
+        (r"re:(a)(b)\2@x\.com", "abb@x.com"),
+        (r"re:(?P<user>b)@x\.com", "b@x.com"),
+    ],
+)
+def test_regex_rules_that_cannot_share_the_alternation_are_matched(rule, sender):
+    """
+    Test that inline global flags, numbered backreferences and named groups
+    reused across rules keep working next to the other regex rules.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:(?P<user>a)@x\.com", OtherMockHandler)
+    registry.register(rule, MockHandler)
+    registry.register(r"re:.*@z\.com", OtherMockHandler)
+
+    assert registry.get_handler_for_sender(sender) == MockHandler
+    assert registry.get_handler_for_sender("a@x.com") == OtherMockHandler
+    assert registry.get_handler_for_sender("c@z.com") == OtherMockHandler
+
+
+def test_numbered_backreferences_keep_their_meaning():
+    """
+    Test that a backreference still refers to the group of its own rule.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:x@.*", OtherMockHandler)
+    registry.register(r"re:(a)(b)\2@x\.com", MockHandler)
+
+    assert registry.get_handler_for_sender("aba@x.com") == BaseHandler
+
+
+def test_regex_rules_keep_registration_order_across_patterns():
+    """
+    Test that the first registered regex wins, even when the rules are split
+    over several compiled patterns.
+    """
+    registry = HandlerRegistry()
+    registry.register(r"re:(?i).*@x\.com", MockHandler)
+    registry.register(r"re:a@.*", OtherMockHandler)
+
+    assert registry.get_handler_for_sender("a@x.com") == MockHandler
+    assert registry.get_handler_for_sender("a@y.com") == OtherMockHandler
+
+
+@pytest.mark.parametrize(
+    "sender", ["re:(unclosed", "*@", "*@*.", "*@exa*mple.com", "*@a..com"]
+)
+def test_malformed_sender_rules_are_rejected(sender):
+    """
+    Test that malformed wildcards and regexes raise a ValueError.
+    """
+    registry = HandlerRegistry()
+
+    with pytest.raises(ValueError):
+        registry.register(sender, MockHandler)
+
+
+# --- Test hot reload --- #
+
+
+@pytest.fixture
+def handler_config_file(tmp_path, valid_yaml_config):
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(valid_yaml_config)
+    return path
+
+
+def test_reloader_swaps_in_new_registry_when_file_changes(
+    app_factory, handler_config_file
+):
+    """
+    Test that a changed config file is loaded into a new registry.
+    """
+    app = app_factory({"HANDLER_CONFIG_PATH": str(handler_config_file)})
+    reloader = RegistryReloader(app, str(handler_config_file))
+    previous = app.config["handler_registry"]
+
+    handler_config_file.write_text(
+        handler_config_file.read_text().replace("promo@", "*@")
+    )
+    os.utime(handler_config_file, ns=(0, 0))
+
+    assert reloader.check() is True
+    registry = app.config["handler_registry"]
+    assert registry is not previous
+    assert (
+        registry.get_handler_for_sender("anyone@example.com")
+        == HANDLERS_MAP["CampaignClassifierHandler"]
+    )
+    assert reloader.check() is False
+
+
+def test_reloader_keeps_previous_registry_on_invalid_config(
+    app_factory, handler_config_file
+):
+    """
+    Test that a failed reload keeps the previous registry and records the error.
+    """
+    app = app_factory({"HANDLER_CONFIG_PATH": str(handler_config_file)})
+    reloader = RegistryReloader(app, str(handler_config_file))
+    previous = app.config["handler_registry"]
+
+    handler_config_file.write_text("handlers:\n  UnknownHandler: {}\n")
+
+    assert reloader.reload() is False
+    assert app.config["handler_registry"] is previous
+    assert "UnknownHandler" in reloader.last_error
+
+
+def test_reloader_polls_config_file(app_factory, handler_config_file):
+    """
+    Test that the app starts polling the config file when enabled.
+    """
+    app = app_factory(
+        {
+            "HANDLER_CONFIG_PATH": str(handler_config_file),
+            "HANDLER_CONFIG_POLL_SECONDS": 0.01,
+        }
+    )
+    reloader = app.extensions["handler_registry_reloader"]
+
+    try:
+        assert reloader._thread.is_alive()
+    finally:
+        reloader.stop(timeout=5)
+
+
+# --- Test pipelines from configuration --- #
+
+
+def test_initialize_registry_compiles_configured_steps(tmp_path):
+    """
+    Test that the configured steps become the pipeline of the shared handler.
+    """
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(
+        textwrap.dedent(
+            """
+            handlers:
+              CampaignClassifierHandler:
+                steps: []
+                senders: ["newsletter@example.com"]
+            """
+        )
+    )
+
+    registry = initialize_handler_registry_from_config(str(path))
+    handler_class = registry.get_handler_for_sender("newsletter@example.com")
+    handler = registry.get_handler(handler_class)
+
+    assert handler_class == HANDLERS_MAP["CampaignClassifierHandler"]
+    assert len(handler.pipeline) == 0
+    assert registry.get_handler(handler_class) is handler
+
+
+def test_initialize_registry_creates_handlers_declared_with_class(tmp_path):
+    """
+    Test that an entry with a `class` key defines a new handler without Python code.
+    """
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(
+        textwrap.dedent(
+            """
+            handlers:
+              DealsHandler:
+                class: BaseHandler
+                steps:
+                  - cloudmailin.handlers.steps.assign_campaign_type
+                senders: ["*@deals.example.com"]
+            """
+        )
+    )
+
+    registry = initialize_handler_registry_from_config(str(path))
+    handler_class = registry.get_handler_for_sender("offers@deals.example.com")
+
+    assert handler_class.__name__ == "DealsHandler"
+    assert issubclass(handler_class, BaseHandler)
+    assert registry.get_handler(handler_class).pipeline.steps == (assign_campaign_type,)
+
+
+def test_initialize_registry_rejects_unknown_steps(tmp_path):
+    """
+    Test that a step that cannot be imported fails at load time.
+    """
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(
+        textwrap.dedent(
+            """
+            handlers:
+              CampaignClassifierHandler:
+                steps: ["cloudmailin.handlers.steps.missing_step"]
+                senders: ["newsletter@example.com"]
+            """
+        )
+    )
+
+    with pytest.raises(ValueError, match="missing_step"):
+        initialize_handler_registry_from_config(str(path))
+
+
+def test_get_handler_creates_one_instance_per_class():
+    """
+    Test that unconfigured handler classes are instantiated once and reused.
+    """
+    registry = HandlerRegistry()
+
+    assert registry.get_handler(MockHandler) is registry.get_handler(MockHandler)
+
+
+def test_initialize_registry_compiles_storage_projection(tmp_path):
+    """
+    Test that the `storage` section becomes the projection of the handler.
+    """
+    path = tmp_path / "handler_config.yaml"
+    path.write_text(
+        textwrap.dedent(
+            """
+            handlers:
+              CampaignClassifierHandler:
+                steps: []
+                senders: ["newsletter@example.com"]
+                storage:
+                  fields: [sender, subject]
+                  rename: {sender: from}
+            """
+        )
+    )
+
+    registry = initialize_handler_registry_from_config(str(path))
+    handler = registry.get_handler(HANDLERS_MAP["CampaignClassifierHandler"])
+
+    assert handler.projection.keys == ("from", "subject")
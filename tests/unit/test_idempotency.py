@@ -0,0 +1,303 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+import pytest
+
+from cloudmailin.idempotency import (
+    IdempotencyConflict,
+    IdempotencyKeyReused,
+    IdempotencyStore,
+)
+
+
+@pytest.fixture
+def store():
+    return IdempotencyStore(ttl=60, max_entries=2)
+
+
+# --- Single-flight store --- #
+
+
+def test_store_runs_once_and_replays_result(store):
+    """
+    Ensure a completed key replays its result instead of running again.
+    """
+    function = Mock(return_value="result")
+
+    assert store.run("key", function) == ("result", False)
+    assert store.run("key", function) == ("result", True)
+    function.assert_called_once()
+
+
+def test_concurrent_requests_wait_for_in_flight_result(store):
+    """
+    Ensure a request arriving while the first one runs waits for its result.
+    """
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    leader = threading.Thread(target=store.run, args=("key", slow))
+    leader.start()
+    started.wait(5)
+
+    results = []
+    follower = threading.Thread(
+        target=lambda: results.append(store.run("key", slow, wait_timeout=5))
+    )
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == [1]
+    assert results == [("result", True)]
+
+
+def test_failed_run_is_not_cached(store):
+    """
+    Ensure a failure is not replayed: the next request with the key runs again.
+    """
+    with pytest.raises(RuntimeError):
+        store.run("key", Mock(side_effect=RuntimeError("boom")))
+
+    assert store.run("key", Mock(return_value="result")) == ("result", False)
+
+
+def test_waiting_request_times_out_with_conflict(store):
+    """
+    Ensure a request waiting on a stuck in-flight request gives up.
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+
+    leader = threading.Thread(target=store.run, args=("key", stuck))
+    leader.start()
+    started.wait(5)
+    try:
+        with pytest.raises(IdempotencyConflict):
+            store.run("key", Mock(), wait_timeout=0.01)
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_results_expire_after_window(store):
+    """
+    Ensure keys older than the window run again.
+    """
+    function = Mock(return_value="result")
+    with patch("cloudmailin.idempotency.time.monotonic", return_value=0):
+        store.run("key", function)
+    with patch("cloudmailin.idempotency.time.monotonic", return_value=61):
+        assert store.run("key", function) == ("result", False)
+
+
+def test_store_is_bounded(store):
+    """
+    Ensure the least recently used completed keys are evicted.
+    """
+    for key in ("a", "b", "c"):
+        store.run(key, Mock(return_value=key))
+
+    assert len(store) == 2
+    assert store.run("a", Mock(return_value="new")) == ("new", False)
+
+
+def test_async_run_is_single_flighted_with_sync_runs(store):
+    """
+    Ensure arun shares results with run and awaits its coroutine function once.
+    """
+    calls = []
+
+    async def function():
+        calls.append(1)
+        return "result"
+
+    assert asyncio.run(store.arun("key", function)) == ("result", False)
+    assert asyncio.run(store.arun("key", function)) == ("result", True)
+    assert store.run("key", Mock()) == ("result", True)
+    assert calls == [1]
+
+
+def test_async_waiters_do_not_take_executor_threads(store):
+    """
+    Ensure duplicates awaiting an async run leave the default executor to it.
+    """
+
+    async def function():
+        # Let the duplicates start waiting first
+        await asyncio.sleep(0.01)
+        await asyncio.to_thread(time.sleep, 0.01)
+        return "result"
+
+    async def run_duplicates():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(1))
+        return await asyncio.gather(
+            *(store.arun("key", function, wait_timeout=1) for _ in range(5))
+        )
+
+    results = asyncio.run(run_duplicates())
+
+    assert sorted(results) == [("result", False)] + [("result", True)] * 4
+
+
+def test_async_waiters_are_woken_by_sync_runs(store):
+    """
+    Ensure a coroutine waiting for a run on another thread gets its result.
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def function():
+        started.set()
+        release.wait(5)
+        return "result"
+
+    leader = threading.Thread(target=store.run, args=("key", function))
+    leader.start()
+    started.wait(5)
+
+    async def wait_for_leader():
+        waiter = asyncio.create_task(store.arun("key", Mock(), wait_timeout=5))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await waiter
+
+    assert asyncio.run(wait_for_leader()) == ("result", True)
+    leader.join(5)
+
+
+def test_async_waiter_times_out_with_conflict(store):
+    """
+    Ensure an async waiter gives up after wait_timeout.
+    """
+    store._claim("key")
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(store.arun("key", Mock(), wait_timeout=0.01))
+    assert store._calls["key"].async_waiters == []
+
+
+def test_key_reused_with_another_fingerprint_is_rejected(store):
+    """
+    Ensure a result is only replayed to requests with the same payload.
+    """
+    store.run("key", Mock(return_value="result"), fingerprint=b"first")
+
+    with pytest.raises(IdempotencyKeyReused):
+        store.run("key", Mock(), fingerprint=b"second")
+    assert store.run("key", Mock(), fingerprint=b"first") == ("result", True)
+
+
+# --- /generic/new --- #
+
+
+@pytest.fixture
+def counting_app(app_factory):
+    def create(config=None):
+        app = app_factory(config)
+        handler = Mock(side_effect=lambda email: email)
+        MockHandler = type("MockHandler", (), {"handle": handler})
+        app.config["handler_registry"].register("sender@example.com", MockHandler)
+        return app, handler
+
+    return create
+
+
+def test_idempotency_key_runs_handler_once(counting_app, valid_email_data):
+    """
+    Ensure a retry with the same Idempotency-Key replays the first response.
+    """
+    app, handler = counting_app()
+    client = app.test_client()
+    headers = {"Idempotency-Key": "delivery-1"}
+
+    first = client.post("/generic/new", json=valid_email_data, headers=headers)
+    retry = client.post("/generic/new", json=valid_email_data, headers=headers)
+
+    handler.assert_called_once()
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+
+def test_requests_without_key_are_not_coalesced(counting_app, valid_email_data):
+    """
+    Ensure requests without an Idempotency-Key are processed every time.
+    """
+    app, handler = counting_app()
+    client = app.test_client()
+
+    client.post("/generic/new", json=valid_email_data)
+    client.post("/generic/new", json=valid_email_data)
+
+    assert handler.call_count == 2
+
+
+def test_derived_keys_coalesce_identical_emails(counting_app, valid_email_data):
+    """
+    Ensure IDEMPOTENCY_DERIVED_KEYS identifies retries without a header.
+    """
+    app, handler = counting_app({"IDEMPOTENCY_DERIVED_KEYS": True})
+    client = app.test_client()
+
+    client.post("/generic/new", json=valid_email_data)
+    client.post("/generic/new", json=valid_email_data)
+
+    handler.assert_called_once()
+
+
+def test_conflict_returns_409(client, valid_email_data):
+    """
+    Ensure a request that gave up waiting is answered with a 409.
+    """
+    with patch(
+        "cloudmailin.generic.get_idempotency_store",
+        return_value=Mock(**{"run.side_effect": IdempotencyConflict("key")}),
+    ):
+        response = client.post(
+            "/generic/new",
+            json=valid_email_data,
+            headers={"Idempotency-Key": "delivery-1"},
+        )
+
+    assert response.status_code == 409
+
+
+def test_key_reused_for_another_payload_returns_422(counting_app, valid_email_data):
+    """
+    Ensure an Idempotency-Key reused with a different email is not replayed.
+    """
+    app, handler = counting_app()
+    client = app.test_client()
+    headers = {"Idempotency-Key": "delivery-1"}
+    client.post("/generic/new", json=valid_email_data, headers=headers)
+    valid_email_data["headers"]["subject"] = "Another email"
+
+    response = client.post("/generic/new", json=valid_email_data, headers=headers)
+
+    assert response.status_code == 422
+    handler.assert_called_once()
+
+
+def test_derived_keys_do_not_serialize_the_email(counting_app, valid_email_data):
+    """
+    Ensure derived keys hash the identifying fields instead of dumping the email.
+    """
+    app, _ = counting_app({"IDEMPOTENCY_DERIVED_KEYS": True})
+
+    with patch("cloudmailin.schemas.Email.model_dump") as model_dump:
+        app.test_client().post("/generic/new", json=valid_email_data)
+
+    model_dump.assert_not_called()
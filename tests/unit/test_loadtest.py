@@ -0,0 +1,172 @@
+from collections import Counter
+
+import pytest
+from google.api_core import exceptions
+
+from cloudmailin.db import get_client_pool
+from cloudmailin.fake_firestore import InMemoryFirestoreClient, LatencyModel
+from cloudmailin.loadtest import (
+    LoadReport,
+    PayloadSynthesizer,
+    parse_senders,
+    run_load,
+)
+from cloudmailin.schemas import Email
+
+
+# --- Payload synthesis --- #
+
+
+def test_synthesized_payloads_are_valid_emails():
+    """
+    Ensure generated payloads pass the Email validation of /generic/new.
+    """
+    synthesizer = PayloadSynthesizer(seed=1, max_body_size=4096)
+
+    for _ in range(50):
+        email = Email.model_validate(synthesizer.payload())
+        assert len(email.plain) <= 4096
+        assert email.message_id
+
+
+def test_sender_mix_follows_weights_and_expands_domains():
+    """
+    Ensure senders are drawn by weight and "*@domain" yields random addresses.
+    """
+    synthesizer = PayloadSynthesizer(
+        senders={"vip@example.com": 0.000001, "*@shop.com": 1}, seed=1
+    )
+
+    senders = {synthesizer.sender() for _ in range(20)}
+
+    assert all(sender.endswith("@shop.com") for sender in senders)
+    assert len(senders) > 1
+
+
+def test_parse_senders_rejects_invalid_weights():
+    """
+    Ensure the --sender option reports malformed weights.
+    """
+    assert parse_senders(["a@example.com=2", "*@b.com"]) == {
+        "a@example.com": 2.0,
+        "*@b.com": 1.0,
+    }
+    with pytest.raises(ValueError, match="Invalid sender weight"):
+        parse_senders(["a@example.com=heavy"])
+
+
+# --- Load driver --- #
+
+
+def test_report_percentiles_and_error_rate():
+    """
+    Ensure latency percentiles use the nearest rank and errors include failures.
+    """
+    report = LoadReport(
+        4, 2.0, [10.0, 20.0, 30.0, 40.0], Counter({200: 2, 500: 1, "TimeoutError": 1})
+    )
+
+    assert report.percentile(50) == 20.0
+    assert report.percentile(99) == 40.0
+    assert report.throughput == 2.0
+    assert report.error_rate == 0.5
+
+
+def test_run_load_stops_after_the_requested_count():
+    """
+    Ensure the closed loop sends exactly the requested number of requests.
+    """
+    sent = []
+
+    report = run_load(sent.append, dict, concurrency=4, duration=None, requests=25)
+
+    assert len(sent) == 25
+    assert report.requests == 25
+
+
+def test_run_load_open_loop_records_send_failures():
+    """
+    Ensure exceptions raised while sending are reported as errors.
+    """
+
+    def send(payload):
+        raise ConnectionError("refused")
+
+    report = run_load(send, dict, rps=1000, duration=None, requests=10)
+
+    assert report.statuses == Counter({"ConnectionError": 10})
+
+
+# --- In-memory Firestore --- #
+
+
+def test_in_memory_firestore_stores_documents_and_batches():
+    """
+    Ensure add(), set() and write batches are visible to get().
+    """
+    client = InMemoryFirestoreClient()
+    collection = client.collection("emails")
+
+    _, added = collection.add({"subject": "Added"})
+    batch = client.batch()
+    batch.set(collection.document("doc-1"), {"subject": "Batched"})
+    batch.commit()
+
+    assert collection.document(added.id).get().to_dict() == {"subject": "Added"}
+    assert collection.document("doc-1").get().exists
+    assert not collection.document("missing").get().exists
+    assert len(client.documents("emails")) == 2
+
+
+def test_in_memory_firestore_injects_failures():
+    """
+    Ensure the latency model fails RPCs at the configured error rate.
+    """
+    client = InMemoryFirestoreClient(LatencyModel(error_rate=1.0))
+
+    with pytest.raises(exceptions.ServiceUnavailable):
+        client.collection("emails").add({"subject": "Hello"})
+
+
+def test_client_pool_uses_in_memory_firestore_when_configured(app_factory):
+    """
+    Ensure STORAGE_BACKEND="memory" replaces the Firestore client.
+    """
+    app = app_factory({"STORAGE_BACKEND": "memory"})
+
+    with app.app_context():
+        client = get_client_pool().get_client()
+
+    assert isinstance(client, InMemoryFirestoreClient)
+
+
+# --- CLI --- #
+
+
+def test_loadtest_command_drives_local_instance(app_factory):
+    """
+    Ensure `flask loadtest` serves the app offline and reports the results.
+    """
+    app = app_factory()
+
+    result = app.test_cli_runner().invoke(
+        args=[
+            "loadtest",
+            "--requests",
+            "20",
+            "--concurrency",
+            "2",
+            "--firestore-latency-ms",
+            "0",
+            "--firestore-jitter-ms",
+            "0",
+            "--seed",
+            "1",
+        ]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "requests:   20" in result.output
+    assert "200: 20" in result.output
+    stored = get_client_pool(app).get_client().documents("test_dummy_collection")
+    assert len(stored) == 20
@@ -2,7 +2,12 @@ from unittest.mock import patch
 from cloudmailin import create_app
 import json
 import logging
+import queue
+
+import pytest
+
 from cloudmailin import JSONFormatter
+from cloudmailin.logs import DeferredQueueHandler, SamplingFilter, stop_logging
 
 
 # --- Test Logging Initialization --- #
@@ -20,13 +25,13 @@ def test_logging_initialization_message_logged():
 # --- Test Incoming Request Logging --- #
 
 
-def test_logging_incoming_request(client):
+def test_logging_incoming_request(client, caplog):
     """
     Test that incoming requests are logged with method and path.
     """
-    with patch.object(client.application.logger, "info") as mock_logger:
+    with caplog.at_level(logging.INFO, logger="cloudmailin"):
         client.post("/generic/new", json={})
-        mock_logger.assert_any_call("Received request: POST /generic/new")
+    assert "Received request: POST /generic/new" in caplog.messages
 
 
 # --- Test Logging Json format --- #
@@ -57,3 +62,115 @@ def test_json_logging_format(caplog):
     assert log_data["level"] == "INFO"
     assert log_data["message"] == "Test JSON log message"
     assert "timestamp" in log_data
+
+
+def test_json_logging_uses_record_creation_time():
+    """
+    Ensure the timestamp is the time the record was created, not written.
+    """
+    record = logging.LogRecord("cloudmailin", logging.INFO, "", 0, "Hello", (), None)
+    record.created = 0
+
+    log_data = json.loads(JSONFormatter().format(record))
+
+    assert log_data["timestamp"] == "1970-01-01T00:00:00+00:00"
+
+
+# --- Test Sampling --- #
+
+
+def make_record(name, level=logging.INFO):
+    return logging.LogRecord(name, level, "", 0, "Hello", (), None)
+
+
+def test_sampling_rate_is_inherited_from_the_closest_configured_logger():
+    """
+    Ensure rates are looked up by logger name, falling back to the ancestors.
+    """
+    sampling = SamplingFilter({"cloudmailin": 0.5, "cloudmailin.requests": 0.01})
+
+    assert sampling.rate_for("cloudmailin.requests") == 0.01
+    assert sampling.rate_for("cloudmailin.handlers") == 0.5
+    assert sampling.rate_for("werkzeug") == 1.0
+
+
+def test_sampling_drops_info_lines_but_never_warnings():
+    """
+    Ensure a zero rate drops INFO records while warnings always pass.
+    """
+    sampling = SamplingFilter({"cloudmailin.requests": 0})
+
+    assert not sampling.filter(make_record("cloudmailin.requests"))
+    assert sampling.filter(make_record("cloudmailin.requests", logging.WARNING))
+    assert sampling.filter(make_record("cloudmailin"))
+
+
+def test_sampling_rejects_invalid_rates():
+    """
+    Ensure rates outside [0, 1] are reported as configuration errors.
+    """
+    with pytest.raises(ValueError, match="Invalid log sampling rate"):
+        SamplingFilter({"cloudmailin": 2})
+
+
+# --- Test Asynchronous Writing --- #
+
+
+def test_deferred_queue_handler_defers_formatting_of_plain_arguments():
+    """
+    Ensure messages with immutable arguments are formatted on the writer thread.
+    """
+    log_queue = queue.Queue()
+    handler = DeferredQueueHandler(log_queue)
+
+    handler.emit(
+        logging.LogRecord("cloudmailin", logging.INFO, "", 0, "Hi %s", ("Bob",), None)
+    )
+
+    record = log_queue.get_nowait()
+    assert record.msg == "Hi %s"
+    assert record.getMessage() == "Hi Bob"
+
+
+def test_deferred_queue_handler_formats_mutable_arguments_eagerly():
+    """
+    Ensure arguments that could change before being written are rendered now.
+    """
+    log_queue = queue.Queue()
+    handler = DeferredQueueHandler(log_queue)
+    recipients = ["a@example.com"]
+
+    handler.emit(
+        logging.LogRecord(
+            "cloudmailin", logging.INFO, "", 0, "To %s", (recipients,), None
+        )
+    )
+    recipients.append("b@example.com")
+
+    assert log_queue.get_nowait().getMessage() == "To ['a@example.com']"
+
+
+def test_deferred_queue_handler_drops_records_when_queue_is_full():
+    """
+    Ensure a full queue drops records instead of blocking the caller.
+    """
+    handler = DeferredQueueHandler(queue.Queue(maxsize=1))
+
+    handler.emit(make_record("cloudmailin"))
+    handler.emit(make_record("cloudmailin"))
+
+    assert handler.dropped == 1
+
+
+def test_async_logging_writes_json_lines_from_background_thread(app_factory, capfd):
+    """
+    Ensure the app writes its logs through the queue and flushes them on stop.
+    """
+    app = app_factory({"LOG_ASYNC": True})
+    assert isinstance(app.logger.handlers[0], DeferredQueueHandler)
+
+    app.logger.info("Queued %s", "message")
+    stop_logging()
+
+    lines = [json.loads(line) for line in capfd.readouterr().err.splitlines()]
+    assert {"level": "INFO", "message": "Queued message"}.items() <= lines[-1].items()
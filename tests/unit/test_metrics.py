@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+
+import pytest
+
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.handlers.pipeline import Pipeline
+from cloudmailin.handler_registry import HandlerRegistry
+from cloudmailin.metrics import (
+    REGISTRY,
+    REGISTRY_LOOKUPS,
+    STEP_DURATION,
+    VALIDATION_FAILURES,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    merge_snapshots,
+    read_snapshots,
+    render,
+    write_snapshot,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    REGISTRY.reset()
+    yield
+    REGISTRY.reset()
+
+
+# --- Metric types --- #
+
+
+def test_counter_sums_the_shards_of_every_thread():
+    """
+    Ensure increments made by different threads are all collected.
+    """
+    counter = Counter("test_total", "Test counter.", ("result",))
+
+    threads = [
+        threading.Thread(target=lambda: [counter.inc("ok") for _ in range(100)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("failed", amount=2)
+
+    assert counter.collect() == {("ok",): 400.0, ("failed",): 2.0}
+
+
+def test_histogram_counts_observations_in_buckets():
+    """
+    Ensure observations land in the first bucket whose bound they do not exceed.
+    """
+    histogram = Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1.0))
+
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    assert histogram.collect() == {(): [1, 1, 1, 5.6]}
+
+
+def test_registry_rejects_duplicate_metric_names():
+    """
+    Ensure two metrics cannot share a name.
+    """
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Test counter.")
+
+    with pytest.raises(ValueError, match="already registered"):
+        registry.counter("test_total", "Test counter.")
+
+
+# --- Exposition --- #
+
+
+def test_render_uses_prometheus_text_format():
+    """
+    Ensure histograms are rendered with cumulative buckets, sum and count.
+    """
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        "test_seconds", "Test histogram.", ("route",), buckets=(0.1, 1.0)
+    )
+    counter = registry.counter("test_total", "Test counter.", ("route",))
+    histogram.observe(0.05, "/generic/new")
+    histogram.observe(0.5, "/generic/new")
+    counter.inc('say "hi"')
+
+    text = render(merge_snapshots([registry.snapshot()]))
+
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{route="/generic/new",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{route="/generic/new",le="1.0"} 2' in text
+    assert 'test_seconds_bucket{route="/generic/new",le="+Inf"} 2' in text
+    assert 'test_seconds_count{route="/generic/new"} 2' in text
+    assert 'test_total{route="say \\"hi\\""} 1.0' in text
+
+
+def test_snapshots_of_several_workers_are_merged(tmp_path):
+    """
+    Ensure the snapshots written to the shared directory are summed.
+    """
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter.", ("result",))
+    counter.inc("ok")
+    write_snapshot(str(tmp_path), registry)
+    own_snapshot = tmp_path / f"metrics-{os.getpid()}.json"
+    (tmp_path / "metrics-1.json").write_text(own_snapshot.read_text())
+
+    merged = merge_snapshots(read_snapshots(str(tmp_path)))
+
+    assert merged["test_total"]["samples"] == [(("ok",), 2.0)]
+
+
+# --- Instrumentation --- #
+
+
+def test_pipeline_records_step_durations():
+    """
+    Ensure each pipeline step is timed under its own name.
+    """
+
+    def add_tag(email):
+        return email
+
+    Pipeline([add_tag])(object())
+
+    counts = STEP_DURATION.collect()[("add_tag",)]
+    assert sum(counts[:-1]) == 1
+
+
+def test_registry_lookups_count_default_and_configured_handlers():
+    """
+    Ensure lookups are counted by whether a configured handler matched.
+    """
+
+    class CustomHandler(BaseHandler):
+        pass
+
+    registry = HandlerRegistry()
+    registry.register("known@example.com", CustomHandler)
+    registry.compile()
+
+    registry.get_handler_for_sender("known@example.com")
+    registry.get_handler_for_sender("unknown@example.com")
+
+    assert REGISTRY_LOOKUPS.collect() == {("configured",): 1.0, ("default",): 1.0}
+
+
+def test_validation_failures_are_counted(client):
+    """
+    Ensure payloads rejected by the schema are counted per route.
+    """
+    client.post("/generic/new", json={"headers": {}})
+
+    assert VALIDATION_FAILURES.collect() == {("/generic/new", "schema"): 1.0}
+
+
+# --- Endpoint --- #
+
+
+def test_metrics_endpoint_reports_request_latency(app_factory, valid_nested_payload):
+    """
+    Ensure /metrics exposes the latency of the requests served, per handler.
+    """
+    client = app_factory({"METRICS_ENABLED": True}).test_client()
+    client.post("/generic/new", json=valid_nested_payload)
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert (
+        'cloudmailin_request_duration_seconds_count{method="POST",'
+        'route="/generic/new",status="200",handler="BaseHandler"} 1'
+    ) in response.get_data(as_text=True)
+
+
+def test_metrics_endpoint_merges_worker_snapshots(app_factory, tmp_path):
+    """
+    Ensure /metrics reports the sum of every worker sharing the directory.
+    """
+    app = app_factory(
+        {
+            "METRICS_ENABLED": True,
+            "METRICS_MULTIPROC_DIR": str(tmp_path),
+            "METRICS_FLUSH_SECONDS": 60,
+        }
+    )
+    try:
+        other_worker = MetricsRegistry()
+        other_worker.counter(
+            "cloudmailin_registry_lookups_total", "Lookups.", ("result",)
+        ).inc("default", amount=5)
+        (tmp_path / "metrics-1.json").write_text(json.dumps(other_worker.snapshot()))
+        REGISTRY_LOOKUPS.inc("default")
+
+        text = app.test_client().get("/metrics").get_data(as_text=True)
+    finally:
+        app.extensions["metrics_flusher"].stop(timeout=5)
+
+    assert 'cloudmailin_registry_lookups_total{result="default"} 6.0' in text
+
+
+def test_metrics_endpoint_is_disabled_by_default(client):
+    """
+    Ensure the unauthenticated /metrics does not exist unless enabled.
+    """
+    assert client.get("/metrics").status_code == 404
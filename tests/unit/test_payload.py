@@ -0,0 +1,204 @@
+import json
+import tracemalloc
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from cloudmailin.metrics import REQUEST_PEAK_MEMORY
+from cloudmailin.payload import check_body_fields
+
+
+# --- Body field limits --- #
+
+
+def test_check_body_fields_accepts_fields_within_limit(valid_email_data):
+    """
+    Ensure payloads with bodies under the limit pass untouched.
+    """
+    check_body_fields(valid_email_data, max_field_length=1000)
+
+
+@pytest.mark.parametrize("field", ["plain", "html"])
+def test_check_body_fields_rejects_oversized_field(valid_email_data, field):
+    """
+    Ensure an oversized plain or html body is rejected.
+    """
+    valid_email_data["plain"] = valid_email_data["html"] = ""
+    valid_email_data[field] = "x" * 11
+
+    with pytest.raises(RequestEntityTooLarge, match=field):
+        check_body_fields(valid_email_data, max_field_length=10)
+
+
+# --- 413 responses --- #
+
+
+def test_new_email_over_max_content_length_returns_json_413(
+    app_factory, valid_email_data
+):
+    """
+    Ensure a body larger than MAX_CONTENT_LENGTH gets a clean JSON 413.
+    """
+    app = app_factory({"MAX_CONTENT_LENGTH": 100})
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 413
+    assert response.get_json()["error"] == "Payload Too Large"
+
+
+def test_new_email_with_oversized_body_field_returns_413(app_factory, valid_email_data):
+    """
+    Ensure a body field over MAX_BODY_FIELD_LENGTH gets a 413, not a 500.
+    """
+    app = app_factory({"MAX_BODY_FIELD_LENGTH": 10})
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 413
+    assert "exceeds the maximum length" in response.get_json()["details"]
+
+
+def test_batch_reports_oversized_lines_individually(app_factory, valid_email_data):
+    """
+    Ensure a line with an oversized body field is reported without failing the batch.
+    """
+    app = app_factory({"MAX_BODY_FIELD_LENGTH": 1000})
+    oversized = json.loads(json.dumps(valid_email_data))
+    oversized["plain"] = "x" * 1001
+
+    response = app.test_client().post(
+        "/generic/batch",
+        data="\n".join([json.dumps(valid_email_data), json.dumps(oversized)]),
+    )
+
+    results = response.get_json()["results"]
+    assert results[0]["status"] == "processed"
+    assert results[1]["error"] == "Payload Too Large"
+
+
+def test_batch_is_not_bound_by_single_email_limit(app_factory, valid_email_data):
+    """
+    Ensure a batch larger than MAX_CONTENT_LENGTH is accepted line by line.
+    """
+    line = json.dumps(valid_email_data)
+    app = app_factory({"MAX_CONTENT_LENGTH": len(line) + 10})
+
+    response = app.test_client().post("/generic/batch", data="\n".join([line] * 5))
+
+    assert response.status_code == 200
+    assert response.get_json()["processed"] == 5
+
+
+def test_batch_over_max_batch_content_length_returns_413(app_factory, valid_email_data):
+    """
+    Ensure the batch endpoint enforces its own body limit.
+    """
+    app = app_factory({"MAX_BATCH_CONTENT_LENGTH": 100})
+
+    response = app.test_client().post(
+        "/generic/batch", data="\n".join([json.dumps(valid_email_data)] * 5)
+    )
+
+    assert response.status_code == 413
+
+
+def test_batch_reports_lines_over_max_content_length(app_factory, valid_email_data):
+    """
+    Ensure a line longer than MAX_CONTENT_LENGTH is reported on its own, even
+    when it arrives within a single chunk.
+    """
+    line = json.dumps(valid_email_data)
+    oversized = json.loads(line)
+    oversized["plain"] = "x" * 5000
+    app = app_factory({"MAX_CONTENT_LENGTH": 2000})
+
+    response = app.test_client().post(
+        "/generic/batch", data="\n".join([line, json.dumps(oversized), line])
+    )
+
+    assert response.status_code == 200
+    assert [result["status"] for result in response.get_json()["results"]] == [
+        "processed",
+        "invalid",
+        "processed",
+    ]
+
+
+def test_batch_exceeding_limit_mid_stream_reports_lines_read(
+    app_factory, valid_email_data
+):
+    """
+    Ensure a chunked batch cut off by MAX_BATCH_CONTENT_LENGTH reports the
+    lines processed before the limit.
+    """
+    line = json.dumps(valid_email_data).encode()
+    app = app_factory({"MAX_BATCH_CONTENT_LENGTH": len(line) * 3})
+
+    # No Content-Length, as in a chunked upload: the limit trips mid-stream
+    environ = EnvironBuilder(
+        path="/generic/batch", method="POST", data=(line + b"\n") * 10
+    ).get_environ()
+    del environ["CONTENT_LENGTH"]
+    environ["wsgi.input_terminated"] = True
+
+    body, status, _ = run_wsgi_app(app, environ)
+
+    assert status.startswith("413")
+    data = json.loads(b"".join(body))
+    assert data["error"] == "Payload Too Large"
+    assert data["processed"] == len(data["results"]) >= 1
+
+
+# --- Memory profiling --- #
+
+
+def test_memory_profiling_logs_request_peak(app_factory, valid_email_data, caplog):
+    """
+    Ensure the peak memory of each request is logged when profiling is enabled.
+    """
+    app = app_factory({"REQUEST_MEMORY_PROFILING": True})
+
+    with caplog.at_level("INFO"):
+        app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert "Request peak memory:" in caplog.text
+    assert "for POST /generic/new" in caplog.text
+
+
+def test_memory_profiling_exports_peak_histogram_by_route(
+    app_factory, valid_email_data
+):
+    """
+    Ensure the peak memory of each request is exported as a metric.
+    """
+    REQUEST_PEAK_MEMORY.reset()
+    app = app_factory({"REQUEST_MEMORY_PROFILING": True})
+
+    app.test_client().post("/generic/new", json=valid_email_data)
+
+    counts = REQUEST_PEAK_MEMORY.collect()[("/generic/new",)]
+    assert sum(counts[:-1]) == 1
+    assert counts[-1] > 0
+
+
+def test_memory_profiling_stops_tracing_between_requests(app_factory, valid_email_data):
+    """
+    Ensure tracemalloc does not keep running once no request is measured.
+    """
+    app = app_factory({"REQUEST_MEMORY_PROFILING": True})
+
+    app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_profiling_disabled_by_default(client, valid_email_data, caplog):
+    """
+    Ensure no memory measurement happens unless configured.
+    """
+    with caplog.at_level("INFO"):
+        client.post("/generic/new", json=valid_email_data)
+
+    assert "Request peak memory:" not in caplog.text
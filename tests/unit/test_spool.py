@@ -0,0 +1,280 @@
+import fcntl
+import os
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cloudmailin.db import DatabaseHelper
+from cloudmailin.spool import Spool, SpoolReplayer, dumps, loads
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / "spool"))
+
+
+# --- Serialization --- #
+
+
+def test_dumps_and_loads_preserve_datetimes_and_bytes():
+    """
+    Ensure Firestore-native values survive a round trip through the spool format.
+    """
+    document = {
+        "date": datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        "html": b"\x78\x9c compressed",
+        "subject": "Test Subject",
+    }
+
+    assert loads(dumps(document)) == document
+
+
+# --- Appending and rotation --- #
+
+
+def test_append_writes_entry_to_segment(spool):
+    """
+    Ensure failed writes are appended to a segment file.
+    """
+    spool.append("emails", None, {"subject": "Hello"})
+
+    assert spool.status()["pending_writes"] == 1
+    assert spool.status()["segments"] == 1
+
+
+def test_segments_rotate_when_they_reach_max_size(tmp_path):
+    """
+    Ensure a new segment is started once the active one is full.
+    """
+    spool = Spool(str(tmp_path), segment_max_bytes=1)
+
+    spool.append("emails", None, {"index": 1})
+    spool.append("emails", None, {"index": 2})
+
+    assert spool.status()["segments"] == 2
+    assert len(spool.sealed_segments()) == 2
+
+
+def test_spool_survives_restart(tmp_path):
+    """
+    Ensure writes spooled by a previous process are still pending and not overwritten.
+    """
+    Spool(str(tmp_path)).append("emails", None, {"index": 1})
+
+    restarted = Spool(str(tmp_path))
+    restarted.append("emails", None, {"index": 2})
+
+    assert restarted.status()["pending_writes"] == 2
+    assert restarted.status()["segments"] == 2
+
+
+# --- Draining --- #
+
+
+def test_drain_replays_entries_in_batches_and_empties_spool(spool):
+    """
+    Ensure drain hands the entries over in batches and removes replayed segments.
+    """
+    for index in range(5):
+        spool.append("emails", f"id-{index}", {"index": index})
+    write_batch = MagicMock()
+
+    replayed = spool.drain(write_batch, batch_size=2)
+
+    assert replayed == 5
+    assert [len(call.args[0]) for call in write_batch.call_args_list] == [2, 2, 1]
+    assert write_batch.call_args_list[0].args[0][0] == {
+        "collection": "emails",
+        "id": "id-0",
+        "data": {"index": 0},
+    }
+    assert spool.status()["segments"] == 0
+
+
+def test_drain_resumes_after_failure_without_duplicates(spool):
+    """
+    Ensure a drain interrupted by a failure resumes after the last committed batch.
+    """
+    for index in range(4):
+        spool.append("emails", None, {"index": index})
+    failing_write = MagicMock(side_effect=[None, Exception("Firestore down")])
+
+    with pytest.raises(Exception, match="Firestore down"):
+        spool.drain(failing_write, batch_size=2)
+
+    write_batch = MagicMock()
+    spool.drain(write_batch, batch_size=2)
+
+    write_batch.assert_called_once()
+    assert [entry["data"]["index"] for entry in write_batch.call_args.args[0]] == [
+        2,
+        3,
+    ]
+
+
+# --- Shared spool directories --- #
+
+
+def test_drain_skips_segments_another_process_is_writing(tmp_path):
+    """
+    Ensure a drain from another process (e.g. the CLI) leaves live segments alone.
+    """
+    worker = Spool(str(tmp_path))
+    worker.append("emails", "doc-1", {"index": 1})
+    cli = Spool(str(tmp_path))
+    write_batch = MagicMock()
+
+    assert cli.drain(write_batch) == 0
+    write_batch.assert_not_called()
+
+    worker.append("emails", "doc-2", {"index": 2})
+    worker.rotate()
+    assert cli.drain(write_batch) == 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_drain_seals_segments_of_processes_that_are_gone(tmp_path):
+    """
+    Ensure an active segment whose writer died (lock released) gets replayed.
+    """
+    worker = Spool(str(tmp_path))
+    worker.append("emails", "doc-1", {"index": 1})
+    worker._active.close()
+
+    assert Spool(str(tmp_path)).drain(MagicMock()) == 1
+
+
+def test_processes_sharing_directory_write_distinct_segments(tmp_path):
+    """
+    Ensure writers sharing SPOOL_DIR never append to the same segment.
+    """
+    first, second = Spool(str(tmp_path)), Spool(str(tmp_path))
+
+    first.append("emails", "doc-1", {"index": 1})
+    second.append("emails", "doc-2", {"index": 2})
+    first.rotate()
+    second.rotate()
+
+    assert len(first.sealed_segments()) == 2
+    assert first.status()["pending_writes"] == 2
+
+
+def test_drain_skips_segments_locked_by_another_drain(spool):
+    """
+    Ensure a segment is replayed by one drain only.
+    """
+    spool.append("emails", "doc-1", {"index": 1})
+    spool.rotate()
+    (path,) = spool.sealed_segments()
+
+    with open(path) as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        assert spool.drain(MagicMock()) == 0
+
+    assert spool.drain(MagicMock()) == 1
+
+
+# --- Replayer --- #
+
+
+def test_replayer_backs_off_while_database_keeps_failing(spool):
+    """
+    Ensure the retry delay doubles on failures and resets after a success.
+    """
+    spool.append("emails", None, {"index": 1})
+    write_batch = MagicMock(side_effect=[Exception("down"), Exception("down"), None])
+    replayer = SpoolReplayer(spool, write_batch, interval=10, max_backoff=30)
+
+    replayer.replay_once()
+    assert replayer._delay == 20
+    replayer.replay_once()
+    assert replayer._delay == 30
+    assert replayer.replay_once() == 1
+    assert replayer._delay == 10
+
+
+# --- Integration with the database helper --- #
+
+
+@patch("cloudmailin.db.firestore.Client")
+def test_store_email_spools_email_on_failure(mock_firestore_client, app_factory, spool):
+    """
+    Ensure an email that fails to persist is recorded in the spool.
+    """
+    app = app_factory({"FIRESTORE_COLLECTION": "custom_collection"})
+    mock_firestore_client.return_value.collection.return_value.add.side_effect = (
+        Exception("Firestore error")
+    )
+
+    with app.app_context():
+        helper = DatabaseHelper(app.config, spool=spool)
+        document_id = helper.store_email({"subject": "Hello World"})
+
+    entries = []
+    spool.drain(entries.extend)
+    assert document_id is not None
+    assert entries == [
+        {
+            "collection": "custom_collection",
+            "id": document_id,
+            "data": {"subject": "Hello World"},
+        }
+    ]
+
+
+def test_spool_is_configured_from_spool_dir(app_factory, tmp_path):
+    """
+    Ensure the app creates the spool and starts the replayer when SPOOL_DIR is set.
+    """
+    app = app_factory({"SPOOL_DIR": str(tmp_path)})
+
+    try:
+        assert isinstance(app.extensions["spool"], Spool)
+        assert app.extensions["spool_replayer"]._thread.is_alive()
+    finally:
+        app.extensions["spool_replayer"].stop(timeout=5)
+
+
+# --- CLI --- #
+
+
+def test_spool_status_command_reports_pending_writes(app_factory, tmp_path):
+    """
+    Ensure `flask spool status` shows what is waiting in the spool.
+    """
+    app = app_factory(
+        {"SPOOL_DIR": str(tmp_path), "SPOOL_REPLAY_INTERVAL_SECONDS": None}
+    )
+    app.extensions["spool"].append("emails", None, {"index": 1})
+
+    result = app.test_cli_runner().invoke(args=["spool", "status"])
+
+    assert "pending_writes: 1" in result.output
+
+
+def test_spool_drain_command_replays_to_firestore(app_factory, tmp_path):
+    """
+    Ensure `flask spool drain` commits the spooled writes through the client pool.
+    """
+    app = app_factory(
+        {"SPOOL_DIR": str(tmp_path), "SPOOL_REPLAY_INTERVAL_SECONDS": None}
+    )
+    app.extensions["spool"].append("emails", "doc-1", {"index": 1})
+
+    result = app.test_cli_runner().invoke(args=["spool", "drain"])
+
+    assert "Replayed 1 spooled writes" in result.output
+    assert os.listdir(tmp_path) == []
+
+
+def test_spool_commands_fail_when_spool_is_not_configured(app_factory):
+    """
+    Ensure the CLI explains that spooling is disabled.
+    """
+    app = app_factory()
+
+    result = app.test_cli_runner().invoke(args=["spool", "status"])
+
+    assert result.exit_code != 0
+    assert "SPOOL_DIR" in result.output
@@ -0,0 +1,137 @@
+import sqlite3
+from datetime import datetime, UTC
+
+import pytest
+
+from cloudmailin.db import get_client_pool
+from cloudmailin.storage import SQLiteStorage, StorageBackend
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "emails.sqlite"))
+    yield storage
+    storage.close()
+
+
+# --- SQLite Backend --- #
+
+
+def test_sqlite_round_trips_documents(sqlite_storage):
+    """
+    Ensure documents keep their datetimes and bytes through SQLite.
+    """
+    data = {"subject": "Hello", "date": datetime.now(UTC), "raw": b"\x00\x01"}
+
+    _, reference = sqlite_storage.collection("emails").add(data)
+
+    snapshot = sqlite_storage.collection("emails").document(reference.id).get()
+    assert snapshot.exists
+    assert snapshot.to_dict() == data
+
+
+def test_sqlite_batch_commit_writes_every_document(sqlite_storage):
+    """
+    Ensure a batch commit writes all its documents, keyed by collection.
+    """
+    batch = sqlite_storage.batch()
+    for index in range(3):
+        reference = sqlite_storage.collection("emails").document(f"email-{index}")
+        batch.set(reference, {"index": index})
+    batch.commit()
+    sqlite_storage.collection("other").document("email-0").set({"index": 99})
+
+    stored = {
+        snapshot.id: snapshot.to_dict()
+        for snapshot in sqlite_storage.collection("emails").stream()
+    }
+    assert stored == {f"email-{index}": {"index": index} for index in range(3)}
+
+
+def test_sqlite_delete_removes_document(sqlite_storage):
+    """
+    Ensure deleted documents are reported as missing.
+    """
+    reference = sqlite_storage.collection("emails").document("email")
+    reference.set({"subject": "Hello"})
+
+    reference.delete()
+
+    assert not reference.get().exists
+
+
+def test_sqlite_runs_in_wal_mode(sqlite_storage):
+    """
+    Ensure the database uses a write-ahead log.
+    """
+    sqlite_storage.collection("emails").add({"subject": "Hello"})
+
+    with sqlite3.connect(sqlite_storage.path) as connection:
+        (mode,) = connection.execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+def test_sqlite_rejects_invalid_synchronous_mode(tmp_path):
+    """
+    Ensure SQLITE_SYNCHRONOUS only accepts SQLite's synchronous levels.
+    """
+    with pytest.raises(ValueError):
+        SQLiteStorage(str(tmp_path / "emails.sqlite"), synchronous="NORMAL; --")
+
+
+def test_storage_backends_must_implement_every_primitive():
+    """
+    Ensure an incomplete backend fails when instantiated, not on first use.
+    """
+
+    class WriteOnlyStorage(StorageBackend):
+        def _commit(self, writes: list):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyStorage()
+
+
+# --- App Integration --- #
+
+
+def test_init_db_command_creates_schema(app_factory, tmp_path):
+    """
+    Ensure `flask init-db` creates the documents table and its index.
+    """
+    path = str(tmp_path / "emails.sqlite")
+    app = app_factory({"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": path})
+
+    result = app.test_cli_runner().invoke(args=["init-db"])
+
+    assert result.exit_code == 0, result.output
+    with sqlite3.connect(path) as connection:
+        names = {row[0] for row in connection.execute("SELECT name FROM sqlite_master")}
+    assert {"documents", "documents_by_update"} <= names
+
+
+def test_generic_view_stores_email_in_sqlite(app_factory, valid_email_data, tmp_path):
+    """
+    Ensure emails received with STORAGE_BACKEND="sqlite" are stored in SQLite.
+    """
+    app = app_factory(
+        {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "emails.sqlite")}
+    )
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 200
+    client = get_client_pool(app).get_client()
+    stored = [s.to_dict() for s in client.collection("test_dummy_collection").stream()]
+    assert len(stored) == 1
+    assert stored[0]["sender"] == valid_email_data["envelope"]["from"]
+
+
+def test_unknown_storage_backend_raises_value_error(app_factory):
+    """
+    Ensure an unknown STORAGE_BACKEND is reported when the pool is created.
+    """
+    app = app_factory({"STORAGE_BACKEND": "postgres"})
+
+    with pytest.raises(ValueError):
+        get_client_pool(app)
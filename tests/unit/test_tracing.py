@@ -0,0 +1,222 @@
+import json
+import logging
+import threading
+from unittest.mock import patch
+
+from cloudmailin.logs import JSONFormatter
+from cloudmailin.tracing import (
+    FileSpanExporter,
+    Span,
+    Trace,
+    TraceContextFilter,
+    current_trace,
+    format_breakdown,
+    parse_trace_headers,
+    span,
+    to_otlp,
+)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+# --- Trace headers --- #
+
+
+def test_parse_w3c_traceparent():
+    """
+    Ensure the trace and parent span ids are read from a traceparent header.
+    """
+    headers = {"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"}
+
+    assert parse_trace_headers(headers) == (TRACE_ID, "00f067aa0ba902b7")
+
+
+def test_parse_cloud_trace_context_with_decimal_span_id():
+    """
+    Ensure X-Cloud-Trace-Context is accepted, converting its decimal span id.
+    """
+    headers = {"X-Cloud-Trace-Context": f"{TRACE_ID.upper()}/255;o=1"}
+
+    assert parse_trace_headers(headers) == (TRACE_ID, "00000000000000ff")
+
+
+def test_invalid_trace_headers_are_ignored():
+    """
+    Ensure malformed or all-zero ids start a new trace instead.
+    """
+    headers = {"traceparent": f"00-{'0' * 32}-00f067aa0ba902b7-01"}
+
+    assert parse_trace_headers(headers) == (None, None)
+    assert parse_trace_headers({"traceparent": "garbage"}) == (None, None)
+
+
+# --- Spans --- #
+
+
+def test_span_is_a_noop_outside_a_trace():
+    """
+    Ensure spans cost nothing (and record nothing) when tracing is off.
+    """
+    with span("validate") as recorded:
+        pass
+
+    assert recorded is None
+    assert current_trace() is None
+
+
+def test_otlp_export_links_spans_to_their_parent():
+    """
+    Ensure exported spans carry the trace id and the id of their parent span.
+    """
+    trace = Trace(TRACE_ID, "00f067aa0ba902b7")
+
+    root = Span("POST /generic/new", trace.parent_id)
+    child = Span("validate", root.span_id, {"size": 3})
+    trace.spans.extend([root, child])
+    root.end()
+    child.end()
+
+    spans = to_otlp(trace)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    assert [s["traceId"] for s in spans] == [TRACE_ID, TRACE_ID]
+    assert spans[0]["parentSpanId"] == "00f067aa0ba902b7"
+    assert spans[1]["parentSpanId"] == root.span_id
+    assert spans[1]["attributes"] == [{"key": "size", "value": {"intValue": "3"}}]
+
+
+def test_file_exporter_writes_traces_from_a_background_thread(tmp_path):
+    """
+    Ensure export only queues the trace, which the writer thread appends.
+    """
+    exporter = FileSpanExporter(str(tmp_path / "traces.jsonl"))
+    trace = Trace(TRACE_ID)
+    trace.spans.append(Span("request"))
+
+    with patch("cloudmailin.tracing.to_otlp", wraps=to_otlp) as serialize:
+        exporter.export(trace)
+        exporter.close(timeout=5)
+
+    assert serialize.call_args_list[0].args == (trace,)
+    lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert json.loads(lines[0]) == to_otlp(trace)
+
+
+def test_file_exporter_drops_traces_when_queue_is_full(tmp_path):
+    """
+    Ensure requests never block on a full export queue.
+    """
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_to_otlp(trace):
+        writing.set()
+        release.wait(5)
+        return to_otlp(trace)
+
+    exporter = FileSpanExporter(str(tmp_path / "traces.jsonl"), max_queue_size=1)
+    with patch("cloudmailin.tracing.to_otlp", side_effect=slow_to_otlp):
+        exporter.export(Trace())
+        writing.wait(5)
+        exporter.export(Trace())
+        exporter.export(Trace())
+        release.set()
+        exporter.close(timeout=5)
+
+    assert exporter.dropped == 1
+    assert len((tmp_path / "traces.jsonl").read_text().splitlines()) == 2
+
+
+# --- Request tracing --- #
+
+
+def test_traced_request_exports_spans_of_every_stage(
+    app_factory, tmp_path, valid_nested_payload
+):
+    """
+    Ensure a request records validation, lookup, handler, step and storage spans.
+    """
+    export_path = tmp_path / "traces.jsonl"
+    app = app_factory(
+        {"TRACING_ENABLED": True, "TRACING_EXPORT_PATH": str(export_path)}
+    )
+
+    app.test_client().post(
+        "/generic/new",
+        json=valid_nested_payload,
+        headers={"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"},
+    )
+    app.extensions["span_exporter"].flush()
+
+    exported = json.loads(export_path.read_text().splitlines()[-1])
+    spans = exported["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans] == [
+        "POST /generic/new",
+        "validate",
+        "lookup_handler",
+        "BaseHandler",
+        "store_email",
+    ]
+    assert {s["traceId"] for s in spans} == {TRACE_ID}
+    assert current_trace() is None
+
+
+def test_slow_requests_log_their_span_breakdown(app_factory, caplog):
+    """
+    Ensure requests over the threshold are logged with their spans.
+    """
+    app = app_factory({"TRACING_ENABLED": True, "TRACING_SLOW_REQUEST_SECONDS": 0})
+
+    with caplog.at_level(logging.WARNING, logger="cloudmailin"):
+        app.test_client().get("/health/")
+
+    message = next(m for m in caplog.messages if m.startswith("Slow request"))
+    assert "GET /health/" in message
+
+
+def test_format_breakdown_indents_child_spans():
+    """
+    Ensure the breakdown shows the span tree.
+    """
+    trace = Trace(TRACE_ID)
+
+    root = Span("POST /generic/new")
+    trace.spans.extend([root, Span("validate", root.span_id)])
+
+    lines = format_breakdown(trace).splitlines()
+
+    assert lines[0].startswith("POST /generic/new ")
+    assert lines[1].startswith("  validate ")
+
+
+# --- Log correlation --- #
+
+
+def test_log_lines_of_a_traced_request_carry_the_trace_id(app_factory):
+    """
+    Ensure log records are stamped with the trace of the request being served.
+    """
+    app = app_factory({"TRACING_ENABLED": True, "TRACING_PROJECT_ID": "my-project"})
+    app_handler = logging.getLogger("cloudmailin").handlers[0]
+    assert any(isinstance(f, TraceContextFilter) for f in app_handler.filters)
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    capture = Capture()
+    capture.addFilter(TraceContextFilter("my-project"))
+    logging.getLogger("cloudmailin").addHandler(capture)
+    try:
+        app.test_client().get(
+            "/health/", headers={"X-Cloud-Trace-Context": f"{TRACE_ID}/1;o=1"}
+        )
+    finally:
+        logging.getLogger("cloudmailin").removeHandler(capture)
+
+    request_line = next(r for r in records if "Received request" in r.getMessage())
+    log_data = json.loads(JSONFormatter().format(request_line))
+    assert log_data["trace_id"] == TRACE_ID
+    assert (
+        log_data["logging.googleapis.com/trace"]
+        == f"projects/my-project/traces/{TRACE_ID}"
+    )
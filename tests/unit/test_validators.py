@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic_core import PydanticCustomError
+
+from cloudmailin.validators import normalize_email_address, parse_rfc2822_date
+
+# --- RFC 2822 date parsing --- #
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (
+            "Mon, 16 Jan 2012 17:00:01 +0000",
+            datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        ),
+        (  # Missing weekday
+            "16 Jan 2012 17:00:01 +0000",
+            datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        ),
+        (  # Missing seconds and single digit day
+            "Mon, 6 Jan 2012 17:00 +0100",
+            datetime(2012, 1, 6, 17, 0, tzinfo=timezone(timedelta(hours=1))),
+        ),
+        (  # Obsolete alphabetic zone
+            "Mon, 16 Jan 2012 12:00:01 EST",
+            datetime(2012, 1, 16, 12, 0, 1, tzinfo=timezone(timedelta(hours=-5))),
+        ),
+        (  # GMT zone
+            "Mon, 16 Jan 2012 17:00:01 GMT",
+            datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        ),
+        (  # Two digit year and trailing comment
+            "Mon, 16 Jan 12 17:00:01 +0000 (UTC)",
+            datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        ),
+        (  # Unknown local time zone
+            "Mon, 16 Jan 2012 17:00:01 -0000",
+            datetime(2012, 1, 16, 17, 0, 1, tzinfo=timezone.utc),
+        ),
+    ],
+)
+def test_parse_rfc2822_date_accepts_real_world_variants(value, expected):
+    """
+    Ensure the parser accepts the RFC 2822 variants found in real emails.
+    """
+    parsed = parse_rfc2822_date(value)
+
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+def test_parse_rfc2822_date_matches_strict_format_parsing():
+    """
+    Ensure the fast path produces the same value as the previous strptime parsing.
+    """
+    value = "Mon, 16 Jan 2012 17:00:01 +0530"
+
+    assert parse_rfc2822_date(value) == datetime.strptime(
+        value, "%a, %d %b %Y %H:%M:%S %z"
+    )
+
+
+@pytest.mark.parametrize(
+    "value", ["Invalid Date", "Mon, 32 Jan 2012 17:00:01 +0000", "", None, 12]
+)
+def test_parse_rfc2822_date_rejects_invalid_values(value):
+    """
+    Ensure invalid dates raise a ValueError.
+    """
+    with pytest.raises(ValueError, match="Invalid date format"):
+        parse_rfc2822_date(value)
+
+
+# --- Email address normalization --- #
+
+
+def test_normalize_email_address_lowercases_domain():
+    """
+    Ensure addresses are normalized like pydantic's EmailStr.
+    """
+    assert normalize_email_address("Sender@EXAMPLE.com") == "Sender@example.com"
+
+
+def test_normalize_email_address_caches_repeat_addresses():
+    """
+    Ensure a repeat address is served from the cache.
+    """
+    normalize_email_address.cache_clear()
+
+    normalize_email_address("repeat@example.com")
+    normalize_email_address("repeat@example.com")
+
+    assert normalize_email_address.cache_info().hits == 1
+
+
+def test_normalize_email_address_rejects_invalid_address():
+    """
+    Ensure invalid addresses raise a pydantic error.
+    """
+    with pytest.raises(PydanticCustomError):
+        normalize_email_address("invalid-email")
@@ -0,0 +1,375 @@
+import json
+import os
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from cloudmailin.handlers.base_handler import BaseHandler
+from cloudmailin.schemas import Email
+from cloudmailin.handler_registry import HandlerRegistry
+from cloudmailin.work_queue import _STOP, IngestJob, IngestQueue, get_ingest_queue
+
+
+@pytest.fixture
+def async_app_factory(app_factory):
+    """
+    Factory for apps running in async ingest mode, closing their queue afterwards.
+    """
+    apps = []
+
+    def _create_app(custom_config=None):
+        config = {"INGEST_MODE": "async", "INGEST_WORKERS": 1}
+        config.update(custom_config or {})
+        app = app_factory(config)
+        apps.append(app)
+        return app
+
+    yield _create_app
+
+    for app in apps:
+        get_ingest_queue(app).close(timeout=5)
+
+
+def journal_entries(journal_dir) -> list:
+    """
+    Paths of the journaled emails, in every worker subdirectory.
+    """
+    return sorted(
+        os.path.join(directory, name)
+        for directory, _, names in os.walk(journal_dir)
+        for name in names
+        if name.endswith(".json")
+    )
+
+
+# --- Async mode in the view --- #
+
+
+def test_async_mode_returns_202_and_processes_in_background(
+    async_app_factory, valid_email_data
+):
+    """
+    Ensure the view acknowledges with a 202 and the handler runs on a worker thread.
+    """
+    app = async_app_factory()
+    MockHandler = type("MockHandler", (), {"handle": Mock()})
+    app.config["handler_registry"].register(
+        valid_email_data["envelope"]["from"], MockHandler
+    )
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+    get_ingest_queue(app).close(timeout=5)
+
+    assert response.status_code == 202
+    assert response.get_json()["status"] == "accepted"
+    assert response.get_json()["handler"] == "MockHandler"
+    MockHandler.handle.assert_called_once()
+
+
+def test_async_mode_processes_synchronously_when_queue_is_full(
+    async_app_factory, valid_email_data
+):
+    """
+    Ensure a full queue falls back to processing the email before replying.
+    """
+    app = async_app_factory()
+
+    with patch.object(get_ingest_queue(app), "submit", return_value=False):
+        response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "processed"
+
+
+def test_async_mode_still_rejects_invalid_payloads(async_app_factory, valid_email_data):
+    """
+    Ensure validation happens before the email is acknowledged.
+    """
+    app = async_app_factory()
+    valid_email_data["headers"]["date"] = "Invalid Date"
+
+    response = app.test_client().post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 400
+
+
+def test_sync_mode_is_the_default(client, valid_email_data):
+    """
+    Ensure emails are processed before replying unless async mode is configured.
+    """
+    response = client.post("/generic/new", json=valid_email_data)
+
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "processed"
+
+
+def test_invalid_ingest_mode_raises_error(app_factory):
+    """
+    Ensure an unknown ingest mode is rejected at startup.
+    """
+    with pytest.raises(ValueError, match="INGEST_MODE"):
+        app_factory({"INGEST_MODE": "eventually"})
+
+
+# --- Durability --- #
+
+
+def test_disk_durability_requires_journal_dir(app_factory):
+    """
+    Ensure disk durability cannot be enabled without a journal directory.
+    """
+    app = app_factory()
+
+    with pytest.raises(ValueError, match="INGEST_JOURNAL_DIR"):
+        IngestQueue(app, durability="disk")
+
+
+def test_disk_durability_journals_email_before_ack(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure the email is on disk when submit returns and removed once processed.
+    """
+    app = app_factory()
+    email = Email(**valid_email_data)
+    ingest_queue = IngestQueue(
+        app, workers=0, durability="disk", journal_dir=str(tmp_path)
+    )
+
+    assert ingest_queue.submit(email, valid_email_data, BaseHandler(), "custom")
+
+    journal_files = journal_entries(tmp_path)
+    assert len(journal_files) == 1
+    with open(journal_files[0]) as file:
+        assert json.load(file) == {
+            "payload": valid_email_data,
+            "collection": "custom",
+        }
+
+
+def test_disk_durability_recovers_journaled_emails_on_start(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure emails journaled by a previous process are processed on start.
+    """
+    app = app_factory()
+    MockHandler = type("MockHandler", (), {"handle": Mock()})
+    app.config["handler_registry"].register(
+        valid_email_data["envelope"]["from"], MockHandler
+    )
+    with open(tmp_path / "previous.json", "w") as file:
+        json.dump({"payload": valid_email_data, "collection": None}, file)
+
+    ingest_queue = IngestQueue(
+        app, workers=1, durability="disk", journal_dir=str(tmp_path)
+    )
+    ingest_queue.close(timeout=5)
+
+    MockHandler.handle.assert_called_once()
+    assert journal_entries(tmp_path) == []
+
+
+def test_disk_durability_leaves_entries_of_live_processes_alone(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure a process starting on a shared journal does not take the emails
+    another running process has journaled.
+    """
+    app = app_factory()
+    running = IngestQueue(app, workers=0, durability="disk", journal_dir=str(tmp_path))
+    running.submit(Email(**valid_email_data), valid_email_data, BaseHandler())
+
+    starting = IngestQueue(app, workers=0, durability="disk", journal_dir=str(tmp_path))
+
+    assert starting.depth() == 0
+    assert [os.path.dirname(path) for path in journal_entries(tmp_path)] == [
+        running.worker_dir
+    ]
+
+
+def test_disk_durability_claims_entries_of_processes_that_are_gone(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure the journal of a process that died is moved to the recovering one.
+    """
+    app = app_factory()
+    previous = IngestQueue(app, workers=0, durability="disk", journal_dir=str(tmp_path))
+    previous.submit(Email(**valid_email_data), valid_email_data, BaseHandler())
+    previous._lock_file.close()
+
+    recovering = IngestQueue(
+        app, workers=0, durability="disk", journal_dir=str(tmp_path)
+    )
+
+    assert recovering.depth() == 1
+    assert not os.path.exists(previous.worker_dir)
+    assert [os.path.dirname(path) for path in journal_entries(tmp_path)] == [
+        recovering.worker_dir
+    ]
+
+
+def test_disk_durability_keeps_entries_of_failed_emails(
+    app_factory, valid_email_data, tmp_path
+):
+    """
+    Ensure an email whose handler raised stays journaled for a later retry.
+    """
+    app = app_factory()
+    FailingHandler = type(
+        "FailingHandler", (), {"handle": Mock(side_effect=Exception("boom"))}
+    )
+    ingest_queue = IngestQueue(
+        app, workers=1, durability="disk", journal_dir=str(tmp_path), max_attempts=1
+    )
+
+    ingest_queue.submit(Email(**valid_email_data), valid_email_data, FailingHandler())
+    ingest_queue.close(timeout=5)
+
+    FailingHandler.handle.assert_called_once()
+    assert len(journal_entries(tmp_path)) == 1
+
+
+# --- Retries --- #
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_failed_emails_are_retried_in_process(app_factory, valid_email_data, tmp_path):
+    """
+    Ensure an email whose handler raised is processed again after a backoff,
+    and forgotten once it succeeds.
+    """
+    app = app_factory()
+    handle = Mock(side_effect=[Exception("boom"), Exception("boom"), None])
+    FlakyHandler = type("FlakyHandler", (), {"handle": handle})
+    ingest_queue = IngestQueue(
+        app,
+        workers=1,
+        durability="disk",
+        journal_dir=str(tmp_path),
+        retry_backoff=0.01,
+    )
+
+    ingest_queue.submit(Email(**valid_email_data), valid_email_data, FlakyHandler())
+    wait_for(lambda: handle.call_count == 3)
+    ingest_queue.close(timeout=5)
+
+    assert handle.call_count == 3
+    assert journal_entries(tmp_path) == []
+
+
+def test_retries_stop_after_max_attempts(
+    app_factory, valid_email_data, tmp_path, caplog
+):
+    """
+    Ensure an email that keeps failing is left journaled after max_attempts.
+    """
+    app = app_factory()
+    handle = Mock(side_effect=Exception("boom"))
+    FailingHandler = type("FailingHandler", (), {"handle": handle})
+    ingest_queue = IngestQueue(
+        app,
+        workers=1,
+        durability="disk",
+        journal_dir=str(tmp_path),
+        max_attempts=3,
+        retry_backoff=0.01,
+    )
+
+    ingest_queue.submit(Email(**valid_email_data), valid_email_data, FailingHandler())
+    wait_for(lambda: "Giving up" in caplog.text)
+    ingest_queue.close(timeout=5)
+
+    assert handle.call_count == 3
+    assert len(journal_entries(tmp_path)) == 1
+
+
+def test_retry_backoff_doubles_up_to_max_backoff(app_factory, valid_email_data):
+    """
+    Ensure each failed attempt waits twice as long, capped at max_backoff.
+    """
+    app = app_factory()
+    ingest_queue = IngestQueue(
+        app, workers=0, max_attempts=10, retry_backoff=1.0, max_backoff=3.0
+    )
+    # Stopped first, so the scheduled retries stay pending
+    ingest_queue.close(timeout=5)
+    job = IngestJob("job", Email(**valid_email_data), None, None)
+
+    with patch("cloudmailin.work_queue.time.monotonic", return_value=100.0):
+        for attempts in range(4):
+            ingest_queue._retry(job._replace(attempts=attempts))
+
+    assert sorted(due for due, _, _ in ingest_queue._retries) == [
+        101.0,
+        102.0,
+        103.0,
+        103.0,
+    ]
+
+
+def test_invalid_max_attempts_raises_error(app_factory):
+    """
+    Ensure at least one attempt is required.
+    """
+    with pytest.raises(ValueError, match="INGEST_MAX_ATTEMPTS"):
+        IngestQueue(app_factory(), workers=0, max_attempts=0)
+
+
+def test_worker_applies_collection_override(app_factory, valid_email_data):
+    """
+    Ensure the collection override of the request is restored on the worker.
+    """
+    app = app_factory()
+    seen_collections = []
+
+    class RecordingHandler:
+        def handle(self, email):
+            from flask import g
+
+            seen_collections.append(g.firestore_collection)
+
+    ingest_queue = IngestQueue(app, workers=1)
+    ingest_queue.submit(
+        Email(**valid_email_data), valid_email_data, RecordingHandler(), "override"
+    )
+    ingest_queue.close(timeout=5)
+
+    assert seen_collections == ["override"]
+
+
+def test_jobs_queued_before_a_registry_reload_keep_their_handler(
+    app_factory, valid_email_data
+):
+    """
+    Ensure a queued email is processed by the configured handler instance it
+    was accepted with, even if the registry was swapped meanwhile.
+    """
+    app = app_factory()
+    handled = []
+
+    class ConfiguredHandler:
+        def __init__(self, label="default"):
+            self.label = label
+
+        def handle(self, email):
+            handled.append(self.label)
+
+    app.config["handler_registry"].add_handler(ConfiguredHandler("configured"))
+    handler = app.config["handler_registry"].get_handler(ConfiguredHandler)
+    ingest_queue = IngestQueue(app, workers=0)
+    ingest_queue.submit(Email(**valid_email_data), valid_email_data, handler)
+
+    app.config["handler_registry"] = HandlerRegistry()
+    ingest_queue._queue.put(_STOP)
+    ingest_queue._work()
+
+    assert handled == ["configured"]
@@ -0,0 +1,200 @@
+import signal
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from cloudmailin import db
+from cloudmailin.write_behind import (
+    WriteBehindBuffer,
+    drain_write_behind,
+    get_write_behind,
+    install_sigterm_drain,
+)
+
+
+@pytest.fixture
+def client_pool():
+    """
+    Provides a client pool whose client hands out a mocked write batch.
+    """
+    return MagicMock()
+
+
+# --- Buffering and flushing --- #
+
+
+def test_buffer_flushes_when_batch_size_is_reached(client_pool):
+    """
+    Ensure a full batch is committed in a single write batch.
+    """
+    buffer = WriteBehindBuffer(client_pool, batch_size=3, max_age=60)
+    documents = [MagicMock() for _ in range(3)]
+
+    for index, document in enumerate(documents):
+        assert buffer.put(document, {"index": index})
+    buffer.close(timeout=5)
+
+    write_batch = client_pool.get_client.return_value.batch.return_value
+    assert write_batch.set.call_count == 3
+    write_batch.set.assert_any_call(documents[0], {"index": 0})
+    write_batch.commit.assert_called_once()
+
+
+def test_buffer_flushes_partial_batch_when_max_age_is_reached(client_pool):
+    """
+    Ensure a batch smaller than batch_size is flushed once it gets old enough.
+    """
+    buffer = WriteBehindBuffer(client_pool, batch_size=500, max_age=0.05)
+
+    buffer.put(MagicMock(), {"sender": "sender@example.com"})
+
+    write_batch = client_pool.get_client.return_value.batch.return_value
+    for _ in range(100):
+        if write_batch.commit.called:
+            break
+        buffer._stopping.wait(0.02)
+    buffer.close(timeout=5)
+
+    write_batch.commit.assert_called_once()
+    assert buffer.stats()["last_flush_size"] == 1
+
+
+def test_close_drains_pending_writes_and_rejects_new_ones(client_pool):
+    """
+    Ensure closing the buffer flushes what is queued and refuses further writes.
+    """
+    buffer = WriteBehindBuffer(client_pool, batch_size=500, max_age=60)
+    buffer.put(MagicMock(), {"index": 1})
+
+    buffer.close(timeout=5)
+
+    assert buffer.stats()["flushed_documents"] == 1
+    assert buffer.stats()["depth"] == 0
+    assert buffer.put(MagicMock(), {"index": 2}) is False
+
+
+def test_put_returns_false_when_buffer_is_full(client_pool):
+    """
+    Ensure a full buffer asks the caller to write the document itself.
+    """
+    buffer = WriteBehindBuffer(client_pool, batch_size=500, max_age=60, max_buffer=1)
+    buffer._stopping.set()  # Keep the flusher from consuming the queue
+    buffer._thread.join()
+    buffer._stopping.clear()
+
+    assert buffer.put(MagicMock(), {"index": 1}) is True
+    assert buffer.put(MagicMock(), {"index": 2}) is False
+
+
+def test_failed_flush_is_logged_and_counted(client_pool, caplog):
+    """
+    Ensure a failing commit is logged and reported in the counters.
+    """
+    write_batch = client_pool.get_client.return_value.batch.return_value
+    write_batch.commit.side_effect = Exception("Firestore error")
+    buffer = WriteBehindBuffer(client_pool, batch_size=2, max_age=60)
+
+    buffer.put(MagicMock(), {"index": 1})
+    buffer.put(MagicMock(), {"index": 2})
+    buffer.close(timeout=5)
+
+    assert buffer.stats()["failed_documents"] == 2
+    assert "Failed to flush 2 buffered emails to database" in caplog.text
+
+
+@pytest.mark.parametrize("batch_size", [0, 501])
+def test_buffer_rejects_invalid_batch_size(client_pool, batch_size):
+    """
+    Ensure the batch size stays within Firestore's write batch limit.
+    """
+    with pytest.raises(ValueError, match="WRITE_BEHIND_BATCH_SIZE"):
+        WriteBehindBuffer(client_pool, batch_size=batch_size)
+
+
+# --- Integration with the database helper --- #
+
+
+def test_store_email_queues_document_when_write_behind_enabled(app_factory):
+    """
+    Ensure store_email hands the document to the buffer instead of adding it inline.
+    """
+    app = app_factory({"WRITE_BEHIND_ENABLED": True})
+
+    with app.app_context():
+        helper = db.get_db()
+        email_data = {"sender": "test@example.com"}
+
+        with patch.object(helper.write_behind, "put", return_value=True) as mock_put:
+            helper.store_email(email_data)
+
+        collection = helper.client.collection.return_value
+        mock_put.assert_called_once_with(collection.document.return_value, email_data)
+        collection.add.assert_not_called()
+
+    drain_write_behind(app)
+
+
+def test_store_email_writes_inline_when_buffer_is_full(app_factory):
+    """
+    Ensure store_email falls back to a direct write when the buffer rejects it.
+    """
+    app = app_factory({"WRITE_BEHIND_ENABLED": True})
+
+    with app.app_context():
+        helper = db.get_db()
+        email_data = {"sender": "test@example.com"}
+
+        with patch.object(helper.write_behind, "put", return_value=False):
+            helper.store_email(email_data)
+
+        helper.client.collection.return_value.add.assert_called_once_with(email_data)
+
+    drain_write_behind(app)
+
+
+def test_write_behind_disabled_by_default(app_factory):
+    """
+    Ensure emails are written inline unless write-behind is configured.
+    """
+    app = app_factory()
+
+    with app.app_context():
+        assert db.get_db().write_behind is None
+
+
+def test_get_write_behind_returns_same_buffer(app_factory):
+    """
+    Ensure the buffer is created once per app and reused.
+    """
+    app = app_factory({"WRITE_BEHIND_ENABLED": True})
+
+    assert get_write_behind(app) is get_write_behind(app)
+
+    drain_write_behind(app)
+    assert "write_behind" not in app.extensions
+
+
+# --- SIGTERM handling --- #
+
+
+def test_sigterm_drains_buffer_and_calls_previous_handler(app_factory):
+    """
+    Ensure SIGTERM drains the buffer before handing over to the previous handler.
+    """
+    app = app_factory()
+    received = []
+
+    def previous_handler(signum, frame):
+        received.append(signum)
+
+    original_handler = signal.signal(signal.SIGTERM, previous_handler)
+
+    try:
+        with patch("cloudmailin.write_behind.drain_write_behind") as mock_drain:
+            install_sigterm_drain(app)
+            signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+        mock_drain.assert_called_once()
+        assert received == [signal.SIGTERM]
+    finally:
+        signal.signal(signal.SIGTERM, original_handler)